@@ -0,0 +1,65 @@
+"""Benchmarks the Galilean sampler against the Metropolis sampler on the toy image of main.py
+
+Runs the nested sampler with both samplers for the same number of iterations from the same seed and
+prints the elapsed time, the log evidence and the likelihood evaluations per accepted point.
+Then both samplers evolve the same final active set under the same likelihood constraint and the
+mean squared jump distance in the unit hypercube per likelihood evaluation is printed, which measures
+how far a replacement decorrelates from its starting point for the likelihood budget spent.
+The image is the one pointed to by IMAGE_PATH in config.cfg (multinest_toy_noised by default).
+
+"""
+
+import os
+import sys
+import time
+import random
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Src"))
+import sources
+
+#[X,Y,A,R] priors and noise used in main.py
+prior_array = [[0.0,200.0],[0.0,200.0],[1.0,12.5],[2.0,9.0]]
+noise_rms = 2.0
+active_points = 300
+iterations = 3000
+
+problem = sources.problem_from_config(sources.Config, noise = noise_rms, prior = prior_array)
+sources.Config['STOP_BY_EVIDENCE'] = '0'
+
+span = np.array([i[1] - i[0] for i in prior_array])
+
+
+def jump_distance(sampler, active, trials=200):
+
+    """Mean squared jump distance in the unit hypercube per likelihood evaluation"""
+
+    LC = min(i.logL for i in active)
+    jumps = 0.0
+    number = 0
+    for k in range(trials):
+        start = active[np.random.randint(len(active))]
+        if sampler == "metropolis":
+            evolved, number = sources.Metropolis_sampler(to_evolve = start, likelihood_constraint = LC, no = number, problem = problem).sample()
+        else:
+            evolved, number = sources.Galilean_sampler(to_evolve = start, active_samples = active, likelihood_constraint = LC, no = number, problem = problem).sample()
+        jump = (np.array([evolved.X, evolved.Y, evolved.A, evolved.R]) - np.array([start.X, start.Y, start.A, start.R]))/span
+        jumps += np.sum(jump**2)
+    return jumps/number
+
+
+active = None
+for sampler in ["metropolis", "galilean"]:
+    np.random.seed(0)
+    random.seed(0)
+    start = time.time()
+    nested = sources.Nested_Sampler(no_active_samples = active_points, max_iter = iterations, sample = sampler, problem = problem)
+    out = nested.fit()
+    print sampler+"  elapsed time: "+str(time.time() - start)+"  log evidence: "+str(out["logZ"])+ \
+          "  likelihood calculations per accepted point: "+str(out["evaluations_per_accept"])
+    if active is None:
+        active = out["src"]
+
+for sampler in ["metropolis", "galilean"]:
+    np.random.seed(1)
+    print sampler+"  squared jump distance per likelihood evaluation: "+str(jump_distance(sampler, active))
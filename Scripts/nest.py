@@ -36,6 +36,7 @@ http://www.inference.phy.cam.ac.uk/bayesys/
 import numpy as np
 from math import *
 import sources
+from telemetry import Telemetry, console
 from clust_ellip import *
 
 
@@ -45,7 +46,7 @@ class Nested_Sampler(object):
 
     """Initialization for the Nested_Sampler"""
 
-    def __init__(self, active_samples, no_active_samples, max_iter, sample = "metropolis", plot=False, conv_thresh=0.1):
+    def __init__(self, active_samples, no_active_samples, max_iter, sample = "metropolis", plot=False, conv_thresh=0.1, telemetry=None):
  
         """Number of active_samples in the nested sampling loop to start"""
         self.no_active_samples     = no_active_samples
@@ -80,6 +81,9 @@ class Nested_Sampler(object):
         """ Total number of likelihood calculations""" 
         self.no_likelihood         = no_active_samples
 
+        """ Sink of the progress records, by default printed every 1000 iterations"""
+        self.telemetry             = telemetry if telemetry is not None else Telemetry(interval = None, every = 1000, callbacks = [console])
+
     
     """ Method that runs the main nested sampling loop"""
     
@@ -105,7 +109,9 @@ class Nested_Sampler(object):
 
             stop = self.active_samples[largest].logL + self.log_width - self.log_evidence
 
-            print str(iteration)
+            if self.telemetry.due(iteration):
+                self.telemetry.emit({"iteration":iteration, "logZ":float(self.log_evidence), "remaining":float(stop),
+                                     "likelihood_calculations":self.no_likelihood})
             
             """Calculating the updated evidence"""
             temp_evidence = np.logaddexp(self.log_evidence, self.active_samples[smallest].logWt)
@@ -1,22 +1,22 @@
 """Just a script to find noiseRMS in an Image
 
-Prints the noiseRMS in the image using scipy.stats.mode
+Prints the sky level and the noiseRMS of the image, the medians over the cells of a 64 pixel mesh after
+sigma clipping (see background.mesh_background). Unlike the mode of all pixels this is not biased by the
+sources or by a varying sky.
 
 """
 
 import numpy as np
-from astropy.io import fits
-from scipy import stats
+from images import read_image
+from background import mesh_background
 
 
 #Reading the Image data from fits file
 fitsFile = 'C:/Users/chaithuzz2/Desktop/Bayes_detect/assets/simulated_images/ufig_20_g_gal_sub_500_sub_small.fits'
 
-hdulist   = fits.open(fitsFile)
-data_map   = (hdulist[0].data)
+data_map = read_image(fitsFile)
+sky, rms = mesh_background(data_map, mesh = 64)
 
-data_map = data_map.flatten()
-
-print str(stats.mode(data_map))
-print str(max(data_map))
-print str(np.mean(data_map))
\ No newline at end of file
+print "sky: "+str(np.median(sky))
+print "noise rms: "+str(np.median(rms))
+print "max: "+str(np.nanmax(data_map))
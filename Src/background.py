@@ -0,0 +1,349 @@
+"""Background and noise estimation on a mesh of cells for large frames.
+
+The frame is cut into square cells of BACKGROUND_MESH pixels. In every cell the sky level and the RMS are
+estimated from the pixels which survive iterative sigma clipping, all cells of a row of cells at once. As
+in SExtractor the sky is the mode estimate 2.5*median - 1.5*mean of the clipped pixels, or their median
+where the cell is crowded. Cells with too few valid pixels, counted against their pixels inside the frame
+so that the partial cells along the edges are kept, are filled from their neighbouring cells, and the mesh
+is median filtered to remove cells raised by bright sources. The background and RMS maps are the
+bilinear interpolation of the mesh between cell centres.
+
+The frame is read one row of cells at a time from its memory-mapped FITS or .npy file, and the background
+subtracted image and its inverse variance weight map are written the same way, so only a strip of
+BACKGROUND_MESH rows is ever held in memory. background_problem turns a DetectionProblem into one on the
+background subtracted image with the weight map and the measured noise.
+
+    python background.py <image> [output root]
+
+"""
+
+import os
+import sys
+import warnings
+import numpy as np
+from images import read_image, split_extension, FITS_EXTENSIONS
+
+
+def clipped_statistics(cells, nsigma=3.0, iterations=5, min_valid=0.5, pixels=None):
+
+    """
+    Returns the sky and RMS of every row of cells by iterative sigma clipping.
+
+    Parameters
+    ----------
+    cells : 2Darray
+        One cell per row, nan for pixels to ignore. Modified in place.
+    nsigma : float
+        Pixels further than nsigma RMS from the median are clipped
+    iterations : int
+        Largest number of clipping iterations
+    min_valid : float
+        Cells with a smaller fraction of valid pixels after clipping get nan
+    pixels : array
+        Number of pixels of every cell inside the frame, the fraction of valid pixels is taken of these.
+        By default every pixel of a row.
+
+    Returns
+    -------
+    sky : array
+        Sky level of every cell
+    rms : array
+        RMS of every cell
+
+    """
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for k in range(iterations):
+            median = np.nanmedian(cells, axis=1)
+            rms = np.nanstd(cells, axis=1)
+            with np.errstate(invalid='ignore'):
+                clip = np.abs(cells - median[:,None]) > nsigma*rms[:,None]
+            if not clip.any():
+                break
+            cells[clip] = np.nan
+        median = np.nanmedian(cells, axis=1)
+        mean = np.nanmean(cells, axis=1)
+        rms = np.nanstd(cells, axis=1)
+        if pixels is None:
+            pixels = cells.shape[1]
+        valid = np.sum(np.isfinite(cells), axis=1) >= min_valid*np.asarray(pixels)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        crowded = np.abs(mean - median)/rms >= 0.3
+    sky = np.where(crowded, median, 2.5*median - 1.5*mean)
+    sky[~valid] = np.nan
+    rms[~valid] = np.nan
+    return sky, rms
+
+
+def cell_edges(size, mesh):
+
+    """Returns the first pixel of every cell along an axis of size pixels, followed by size."""
+
+    return np.append(np.arange(0, size, mesh), size)
+
+
+def fill_missing(grid):
+
+    """
+    Returns a mesh whose nan cells are replaced by the mean of their valid neighbours, filling inwards from
+    the valid cells.
+
+    Raises
+    ------
+    ValueError
+        If no cell is valid
+
+    """
+
+    grid = np.array(grid, dtype=float)
+    missing = ~np.isfinite(grid)
+    if missing.all():
+        raise ValueError("No mesh cell has enough valid pixels to estimate the background")
+    height, width = grid.shape
+    while missing.any():
+        values = np.pad(np.where(missing, 0.0, grid), 1, mode='constant')
+        valid = np.pad((~missing).astype(float), 1, mode='constant')
+        total = np.zeros(grid.shape)
+        count = np.zeros(grid.shape)
+        for dy in [-1, 0, 1]:
+            for dx in [-1, 0, 1]:
+                total += values[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+                count += valid[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+        filled = missing & (count > 0)
+        grid[filled] = total[filled]/count[filled]
+        missing &= ~filled
+    return grid
+
+
+def mesh_background(image, mask=None, mesh=64, nsigma=3.0, iterations=5, filter_size=3):
+
+    """
+    Returns the sky and RMS of every mesh cell of an image, reading one row of cells at a time.
+
+    Parameters
+    ----------
+    image : 2Darray
+        The image, usually memory-mapped
+    mask : 2Darray
+        Nonzero for the pixels to ignore, None to use every finite pixel
+    mesh : int
+        Side of the cells
+    nsigma : float
+        Clipping threshold in units of the RMS
+    iterations : int
+        Largest number of clipping iterations
+    filter_size : int
+        Side of the median filter applied to the mesh, 1 to not filter
+
+    Returns
+    -------
+    sky : 2Darray
+        Sky level of every cell
+    rms : 2Darray
+        RMS of every cell
+
+    """
+
+    height, width = image.shape
+    row_edges = cell_edges(height, mesh)
+    column_edges = cell_edges(width, mesh)
+    nx = len(column_edges) - 1
+    sky = np.empty((len(row_edges) - 1, nx))
+    rms = np.empty((len(row_edges) - 1, nx))
+    columns = np.diff(column_edges)
+
+    for j in range(len(row_edges) - 1):
+        strip = np.full((mesh, nx*mesh), np.nan)
+        rows = row_edges[j + 1] - row_edges[j]
+        strip[:rows, :width] = image[row_edges[j]:row_edges[j + 1]]
+        if mask is not None:
+            strip[:rows, :width][np.asarray(mask[row_edges[j]:row_edges[j + 1]]) != 0] = np.nan
+        cells = strip.reshape(mesh, nx, mesh).transpose(1, 0, 2).reshape(nx, mesh*mesh)
+        sky[j], rms[j] = clipped_statistics(cells, nsigma, iterations, pixels = rows*columns)
+
+    sky = fill_missing(sky)
+    rms = fill_missing(rms)
+    if filter_size > 1:
+        from scipy.ndimage import median_filter
+        sky = median_filter(sky, size=filter_size, mode='nearest')
+        rms = median_filter(rms, size=filter_size, mode='nearest')
+    return sky, rms
+
+
+class MeshInterpolator(object):
+
+    """
+    Bilinear interpolation of a mesh between the centres of its cells, evaluated a strip of rows at a time.
+    Beyond the outermost centres the values of the outermost cells are kept.
+
+    """
+
+    def __init__(self, grid, height, width, mesh):
+
+        """
+        Parameters
+        ----------
+        grid : 2Darray
+            Value of every cell
+        height : int
+            height of the image
+        width : int
+            width of the image
+        mesh : int
+            Side of the cells
+
+        """
+
+        row_edges = cell_edges(height, mesh)
+        column_edges = cell_edges(width, mesh)
+        self.row_centres = 0.5*(row_edges[:-1] + row_edges[1:] - 1)
+        column_centres = 0.5*(column_edges[:-1] + column_edges[1:] - 1)
+        #Interpolated along x once, one row per row of cells
+        self.columns = np.array([np.interp(np.arange(width), column_centres, i) for i in grid])
+
+
+    def rows(self, first, last):
+
+        """Returns the interpolated values of the rows first to last - 1."""
+
+        position = np.interp(np.arange(first, last), self.row_centres, np.arange(len(self.row_centres)))
+        lower = np.floor(position).astype(int)
+        upper = np.minimum(lower + 1, len(self.row_centres) - 1)
+        fraction = (position - lower)[:,None]
+        return (1 - fraction)*self.columns[lower] + fraction*self.columns[upper]
+
+
+def open_output(out, height, width):
+
+    """
+    Opens an image file for writing strips of rows, a streamed FITS file or a memory-mapped .npy file.
+
+    Returns
+    -------
+    write : function
+        Called with a strip and its first row, in order of the rows
+    close : function
+        Finishes the file
+
+    """
+
+    if out.lower().endswith(FITS_EXTENSIONS):
+        from astropy.io import fits
+        header = fits.Header()
+        header['SIMPLE'] = True
+        header['BITPIX'] = -32
+        header['NAXIS'] = 2
+        header['NAXIS1'] = width
+        header['NAXIS2'] = height
+        stream = fits.StreamingHDU(out, header)
+        return (lambda strip, row: stream.write(strip.astype(np.float32))), stream.close
+    image = np.lib.format.open_memmap(out, mode='w+', dtype=np.float32, shape=(height, width))
+    def write(strip, row):
+        image[row:row + len(strip)] = strip
+    return write, image.flush
+
+
+def subtract_background(image_path, out_root, mask=None, mesh=64, nsigma=3.0, weights=True):
+
+    """
+    Estimates the background and RMS of an image and writes the background subtracted image and its
+    inverse variance weight map.
+
+    Parameters
+    ----------
+    image_path : str
+        Location of the image
+    out_root : str
+        Location of the outputs without extension: <out_root>_background_subtracted and <out_root>_weight,
+        FITS for FITS images and .npy otherwise
+    mask : str or 2Darray
+        The mask or its location, nonzero for the pixels to ignore. None to use every finite pixel.
+    mesh : int
+        Side of the mesh cells
+    nsigma : float
+        Clipping threshold in units of the RMS
+    weights : bool
+        Also write the weight map
+
+    Returns
+    -------
+    result : dict
+        image and weight (None if not written) locations, noise (median RMS of the cells) and sky (median sky
+        level of the cells)
+
+    """
+
+    image = read_image(image_path)
+    if isinstance(mask, basestring):
+        mask = read_image(mask)
+    height, width = image.shape
+    sky, rms = mesh_background(image, mask, mesh, nsigma)
+    sky_map = MeshInterpolator(sky, height, width, mesh)
+    rms_map = MeshInterpolator(rms, height, width, mesh)
+
+    extension = '.fits' if split_extension(image_path)[0].lower().endswith(FITS_EXTENSIONS) else '.npy'
+    result = {"image":out_root+'_background_subtracted'+extension, "weight":None,
+              "noise":float(np.median(rms)), "sky":float(np.median(sky))}
+    outputs = [open_output(result["image"], height, width)]
+    if weights:
+        result["weight"] = out_root+'_weight'+extension
+        outputs.append(open_output(result["weight"], height, width))
+
+    for row in range(0, height, mesh):
+        last = min(row + mesh, height)
+        outputs[0][0](np.asarray(image[row:last], dtype=float) - sky_map.rows(row, last), row)
+        if weights:
+            outputs[1][0](1.0/rms_map.rows(row, last)**2, row)
+    for write, close in outputs:
+        close()
+    return result
+
+
+def background_problem(problem, out_root, mesh=64, nsigma=3.0):
+
+    """
+    Returns a detection problem on the background subtracted image of a problem.
+
+    Parameters
+    ----------
+    problem : object
+        A DetectionProblem reading its image from a file
+    out_root : str
+        Location of the outputs without extension, see subtract_background
+    mesh : int
+        Side of the mesh cells
+    nsigma : float
+        Clipping threshold in units of the RMS
+
+    Returns
+    -------
+    problem : object
+        The problem of the background subtracted image, with the measured noise and, unless the problem has
+        a weight map already, the measured weight map
+
+    """
+
+    from sources import DetectionProblem
+
+    mask = problem.mask if problem.mask is not None else problem.mask_path
+    result = subtract_background(problem.image_path, out_root, mask, mesh, nsigma,
+                                 weights = problem.weight_path is None and problem.weight is None)
+    print "background: sky "+str(result["sky"])+"  noise "+str(result["noise"])
+    if result["weight"] is None:
+        return DetectionProblem(image_path = result["image"], noise = result["noise"], prior = problem.prior,
+                                weight_path = problem.weight_path, weight = problem.weight,
+                                mask_path = problem.mask_path, mask = problem.mask, variance = problem.variance)
+    return DetectionProblem(image_path = result["image"], noise = result["noise"], prior = problem.prior,
+                            weight_path = result["weight"], mask_path = problem.mask_path, mask = problem.mask)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print "Usage: python background.py <image> [output root]"
+        sys.exit(1)
+
+    out_root = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(split_extension(sys.argv[1])[0])[0]
+    print subtract_background(sys.argv[1], out_root)
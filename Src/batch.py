@@ -0,0 +1,299 @@
+"""Source detection on many images with a pool of worker processes.
+
+Every image of a directory or a glob pattern is an independent DetectionProblem, sampled with the settings
+of config.cfg by one of a bounded number of workers. The settings are handed to every worker once when it
+starts instead of with every image. Images are named by their location relative to the directory they
+were found in, so frames of the same name in different subdirectories stay apart. Each image gives one
+samples file at the same relative location in the output directory and one line in the manifest
+(manifest.jsonl in the output directory) with its status, timing, log evidence and number of likelihood
+calculations. While they run, the workers append rate-limited progress records named after their image to
+telemetry_<process id>.jsonl in the output directory instead of printing them, one file per worker so that
+records of concurrent runs never interleave. Images whose samples file already exists are skipped, so an
+interrupted batch is resumed by running it again.
+
+The X and Y priors of every image are its extent, the A and R priors are taken from config.cfg. With
+BACKGROUND=1 the background of every image is subtracted first and its measured noise and weight map are
+used, the background subtracted image and weight map are written next to its samples file.
+
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import zlib
+import random
+import traceback
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from images import FITS_EXTENSIONS
+from catalog import write_samples
+from telemetry import Telemetry
+from background import background_problem
+import sources
+
+
+IMAGE_EXTENSIONS = FITS_EXTENSIONS + ('.npy',)
+
+#Settings of the worker process, set once by init_worker
+worker_settings = None
+
+
+def find_images(pattern):
+
+    """
+    Returns the images of a directory, searched recursively, or the files matching a glob pattern.
+
+    Parameters
+    ----------
+    pattern : str
+        A directory or a glob pattern. Only FITS and .npy files are taken from a directory, a glob pattern
+        may match any image read_image understands.
+
+    Returns
+    -------
+    images : array
+        Sorted locations of the images
+
+    """
+
+    if not os.path.isdir(pattern):
+        return sorted(glob.glob(pattern))
+    images = []
+    for root, dirs, files in os.walk(pattern):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(os.path.join(root, name))
+    return sorted(images)
+
+
+def image_names(images):
+
+    """
+    Returns the names of images, their locations relative to the deepest directory containing all of them.
+
+    Parameters
+    ----------
+    images : array
+        Locations of the images
+
+    Returns
+    -------
+    names : array
+        Relative location of every image without extension, e.g. night_2/frame_001
+
+    """
+
+    directories = [os.path.abspath(os.path.dirname(i)).split(os.sep) for i in images]
+    common = directories[0] if directories else []
+    for directory in directories[1:]:
+        while directory[:len(common)] != common:
+            common = common[:-1]
+    names = []
+    for image, directory in zip(images, directories):
+        name = os.path.join(*(directory[len(common):] + [os.path.basename(image)]))
+        for extension in IMAGE_EXTENSIONS:
+            if name.lower().endswith(extension):
+                name = name[:-len(extension)]
+                break
+        names.append(name)
+    return names
+
+
+def result_path(name, output_dir):
+
+    """
+    Returns the location of the samples file of an image.
+
+    Parameters
+    ----------
+    name : str
+        Name of the image, see image_names
+    output_dir : str
+        Directory of the results
+
+    Returns
+    -------
+    path : str
+        output_dir/<name>_samples.dat
+
+    """
+
+    return os.path.join(output_dir, name+'_samples.dat')
+
+
+def init_worker(settings):
+
+    """
+    Stores the read-only batch settings in the worker process.
+
+    Parameters
+    ----------
+    settings : dict
+        sampler - Nested_Sampler keyword arguments, as returned by sources.sampler_settings
+        noise - RMS noise of the images
+        prior - Amplitude and R prior bounds [[A_l, A_u], [R_l, R_u]]
+        surrogate - Maximum false reject rate of the surrogate, None to disable it
+        telemetry - Seconds between the progress records of a run, None to not record progress
+        background - Mesh size and clipping threshold of the background subtraction, None to use the noise
+        output_dir - Directory of the results, added by run_batch
+
+    """
+
+    global worker_settings
+    worker_settings = settings
+
+
+def run_image(job):
+
+    """
+    Runs the source detection on one image and writes its posterior samples. Errors are reported in the
+    returned record instead of stopping the batch.
+
+    Parameters
+    ----------
+    job : tuple
+        (image, result, name) locations of the image and of its samples file and the name of the image
+
+    Returns
+    -------
+    record : dict
+        The manifest line of the image: image, result, status ("done" or "failed"), elapsed, noise, logZ,
+        likelihood_calculations, iterations and error
+
+    """
+
+    image, result, name = job
+    settings = worker_settings
+    record = {"image":image, "result":result, "status":"failed", "elapsed":None, "noise":None, "logZ":None,
+              "likelihood_calculations":None, "iterations":None, "error":None}
+    startTime = time.time()
+    telemetry = None
+    if settings["telemetry"] is not None:
+        telemetry = Telemetry(os.path.join(settings["output_dir"], 'telemetry_'+str(os.getpid())+'.jsonl'),
+                              interval = settings["telemetry"], run = name)
+    try:
+        #Forked workers inherit the same random state, so every image gets its own reproducible seed
+        seed = zlib.crc32(name) & 0xffffffff
+        random.seed(seed)
+        np.random.seed(seed)
+
+        prior = [[None, None], [None, None]] + [list(i) for i in settings["prior"]]
+        problem = sources.DetectionProblem(image_path = image, noise = settings["noise"], prior = prior)
+        if settings["background"] is not None:
+            mesh, nsigma = settings["background"]
+            problem = background_problem(problem, os.path.splitext(result)[0], mesh = mesh, nsigma = nsigma)
+        record["noise"] = problem.noise
+        if settings["surrogate"] is not None:
+            problem.surrogate = sources.Surrogate(problem, max_false_reject = settings["surrogate"])
+        out = sources.Nested_Sampler(problem = problem, telemetry = telemetry, **settings["sampler"]).fit()
+
+        #Written under a temporary name first so that a killed worker never leaves a result to be skipped
+        data = sources.sample_array(out["samples"])
+        write_samples(data, result+'.part')
+        os.rename(result+'.part', result)
+
+        record.update({"status":"done", "logZ":out["logZ"], "likelihood_calculations":out["likelihood_calculations"],
+                       "iterations":out["iterations"]})
+    except Exception:
+        record["error"] = traceback.format_exc()
+    finally:
+        if telemetry is not None:
+            telemetry.close()
+    record["elapsed"] = time.time() - startTime
+    return record
+
+
+def run_batch(images, output_dir, settings, processes=None, skip_existing=True):
+
+    """
+    Runs the source detection on every image and appends one manifest line per image as they finish.
+
+    Parameters
+    ----------
+    images : array
+        Locations of the images
+    output_dir : str
+        Directory of the samples files and of manifest.jsonl
+    settings : dict
+        Read-only settings of the workers, see init_worker
+    processes : int
+        Number of worker processes. None uses every cpu.
+    skip_existing : bool
+        Skip the images whose samples file already exists
+
+    Returns
+    -------
+    records : array
+        The manifest lines written by this run
+
+    """
+
+    jobs = [(i, result_path(name, output_dir), name) for i, name in zip(images, image_names(images))]
+    for directory in set(os.path.dirname(i[1]) for i in jobs) | set([output_dir]):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    if skip_existing:
+        jobs = [i for i in jobs if not os.path.exists(i[1])]
+    if len(jobs) == 0:
+        return []
+    settings = dict(settings, output_dir = output_dir)
+
+    records = []
+    manifest = open(os.path.join(output_dir, 'manifest.jsonl'), 'a')
+    pool = Pool(min(processes or cpu_count(), len(jobs)), initializer = init_worker, initargs = (settings,))
+    try:
+        for record in pool.imap_unordered(run_image, jobs, chunksize=1):
+            manifest.write(json.dumps(record)+'\n')
+            manifest.flush()
+            records.append(record)
+            print record["status"]+"  "+record["image"]+"  elapsed time: "+str(record["elapsed"])
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        manifest.close()
+    return records
+
+
+def settings_from_config(config):
+
+    """
+    Returns the read-only batch settings of a config dict.
+
+    Parameters
+    ----------
+    config : dict
+        Settings read from config.cfg
+
+    Returns
+    -------
+    settings : dict
+        Settings of the workers, see init_worker
+
+    """
+
+    return {"sampler":sources.sampler_settings(config),
+            "noise":float(config['NOISE']),
+            "prior":[[float(config['A_PRIOR_LOWER']), float(config['A_PRIOR_UPPER'])],
+                     [float(config['R_PRIOR_LOWER']), float(config['R_PRIOR_UPPER'])]],
+            "surrogate":float(config['SURROGATE_MAX_FALSE_REJECT']) if int(config['SURROGATE']) == 1 else None,
+            "telemetry":float(config['TELEMETRY_INTERVAL']) or None,
+            "background":[int(config['BACKGROUND_MESH']), float(config['BACKGROUND_NSIGMA'])]
+                         if int(config['BACKGROUND']) == 1 else None}
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print "Usage: python batch.py <image directory or glob> [output directory]"
+        sys.exit(1)
+
+    Config = sources.Config
+    output_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.dirname(str(Config['OUTPUT_DATA_PATH']))
+    records = run_batch(find_images(sys.argv[1]), output_dir, settings_from_config(Config),
+                        processes = int(Config['BATCH_WORKERS']) or None)
+    print "Images processed: "+str(len(records))+"  failed: "+str(len([i for i in records if i["status"] != "done"]))
@@ -0,0 +1,316 @@
+"""Reproducible benchmarks of the likelihood, the samplers and the end-to-end detection.
+
+Every benchmark runs from fixed seeds on standard images: the toy image of main.py (SrcArray with noise of
+rms 2.0, rendered from a fixed seed) and the small ufig FITS images of assets/simulated_images, whose
+noise is estimated from the median absolute deviation of the image. The results are written to a JSON
+file together with the git commit, the python and numpy versions and the host, so that runs can be
+compared across commits.
+
+    python benchmark.py [output.json] [quick]
+
+Measured are
+
+    * likelihood - likelihood evaluations per second
+    * sampler - replacements per second, likelihood evaluations per replacement and log evidence of every
+      sampler for a fixed number of iterations, and the number and cost of ellipsoid rebuilds
+    * rebuild - seconds to build the clustered ellipsoids around an active set
+    * end_to_end - seconds and iterations until the remaining evidence falls below dlogZ
+    * memo - hit rate and seconds of a run with the likelihood memo, and of the same run repeated from the
+      same seed with the filled memo
+    * import - seconds to import the modules a worker process starts with, and the heavy packages they pull in
+
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import platform
+import subprocess
+import numpy as np
+from images import read_image
+from simulate import render_sources
+from memo import LikelihoodMemo
+import sources
+
+
+SRC = os.path.dirname(os.path.realpath(__file__))
+ASSETS = os.path.join(SRC, "..", "assets", "simulated_images")
+
+#Sources of the toy image of main.py [X, Y, A, R]
+TOY_SOURCES = [[43.71, 22.91, 10.54, 3.34],
+               [101.62, 40.60, 1.37, 3.40],
+               [92.63, 110.56, 1.81, 3.66],
+               [183.60, 85.90, 1.23, 5.06],
+               [34.12, 162.54, 1.95, 6.02],
+               [153.87, 169.18, 1.06, 6.61],
+               [155.54, 32.14, 1.46, 4.05],
+               [130.56, 183.48, 1.63, 4.11]]
+
+UFIG_IMAGES = ["ufig_20_g_gal_sub_500_sub_small.fits", "ufig_20_g_sub_500_sub_small.fits"]
+
+SAMPLERS = ["uniform", "metropolis", "clustered_ellipsoidal", "new", "adaptive", "slice", "galilean"]
+
+IMPORT_MODULES = ["sources", "tiling", "batch", "plot"]
+
+HEAVY_PACKAGES = ["matplotlib", "astropy", "sklearn", "scipy"]
+
+PRIOR_A = [1.0, 12.5]
+PRIOR_R = [2.0, 9.0]
+
+
+def seed_all(seed):
+
+    """Seeds both random number generators used by the samplers."""
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def standard_problems():
+
+    """
+    Returns the standard images as detection problems.
+
+    Returns
+    -------
+    problems : array
+        A list of (name, DetectionProblem). ufig images missing from the assets are left out.
+
+    """
+
+    state = np.random.RandomState(0)
+    toy = render_sources(TOY_SOURCES, 200, 200) + state.normal(0.0, 2.0, size=(200, 200))
+    problems = [("toy", sources.DetectionProblem(data = toy, noise = 2.0, prior = [[None, None], [None, None], PRIOR_A, PRIOR_R]))]
+
+    for name in UFIG_IMAGES:
+        path = os.path.join(ASSETS, name)
+        if not os.path.exists(path):
+            continue
+        data = np.array(read_image(path), dtype=float)
+        noise = 1.4826*np.median(np.abs(data - np.median(data)))
+        problems.append((os.path.splitext(name)[0],
+                         sources.DetectionProblem(data = data, noise = noise, prior = [[None, None], [None, None], PRIOR_A, PRIOR_R])))
+    return problems
+
+
+def bench_likelihood(problem, evaluations=2000, seed=0):
+
+    """
+    Returns the likelihood evaluations per second on sources drawn from the prior.
+
+    """
+
+    seed_all(seed)
+    points = problem.get_sources(evaluations)
+    start = time.time()
+    for i in points:
+        problem.log_likelihood(i)
+    elapsed = time.time() - start
+    return {"evaluations":evaluations, "seconds":elapsed, "evaluations_per_second":evaluations/elapsed}
+
+
+def bench_sampler(problem, sampler, no_active_samples=1200, iterations=2000, seed=0):
+
+    """
+    Returns the speed of a sampler over a fixed number of nested sampling iterations.
+
+    """
+
+    seed_all(seed)
+    nested = sources.Nested_Sampler(no_active_samples = no_active_samples, max_iter = iterations, sample = sampler,
+                                    problem = problem)
+    start = time.time()
+    out = nested.fit()
+    elapsed = time.time() - start
+    return {"iterations":out["iterations"], "seconds":elapsed, "replacements_per_second":out["iterations"]/elapsed,
+            "likelihood_calculations":out["likelihood_calculations"],
+            "evaluations_per_accept":out["evaluations_per_accept"], "logZ":out["logZ"],
+            "rebuilds":out["refresh_stats"]["refreshes"], "rebuild_seconds":out["refresh_stats"]["time"]}
+
+
+def bench_rebuild(problem, no_active_samples=1200, iterations=2000, repeats=5, seed=0):
+
+    """
+    Returns the seconds to build the clustered ellipsoids around the active set left by a Metropolis run.
+
+    """
+
+    seed_all(seed)
+    nested = sources.Nested_Sampler(no_active_samples = no_active_samples, max_iter = iterations, sample = "metropolis",
+                                    problem = problem)
+    active = nested.fit()["src"]
+    LC = min(i.logL for i in active)
+    times = []
+    for k in range(repeats):
+        start = time.time()
+        sampler = sources.Clustered_Sampler(active_samples = active, likelihood_constraint = LC, enlargement = 1.0, no = 0,
+                                            problem = problem)
+        times.append(time.time() - start)
+    return {"repeats":repeats, "seconds":float(np.median(times)), "ellipsoids":len(sampler.ellipsoid_set)}
+
+
+def bench_memo(problem, sampler, no_active_samples=1200, iterations=2000, seed=0):
+
+    """
+    Returns the hit rates and seconds of a run with an exact likelihood memo and of its repetition.
+
+    """
+
+    problem.memo = LikelihoodMemo(max_size = 10**6)
+    record = {}
+    try:
+        for run in ["first", "repeat"]:
+            seed_all(seed)
+            start = time.time()
+            out = sources.Nested_Sampler(no_active_samples = no_active_samples, max_iter = iterations, sample = sampler,
+                                         problem = problem).fit()
+            record[run+"_seconds"] = time.time() - start
+            record[run+"_hit_rate"] = out["memo_stats"]["hit_rate"]
+            problem.memo.hits, problem.memo.misses = 0, 0
+    finally:
+        problem.memo = None
+    return record
+
+
+def bench_end_to_end(problem, sampler, dlogZ=0.1, no_active_samples=100, max_iter=20000, seed=0):
+
+    """
+    Returns the seconds and iterations until the remaining evidence falls below dlogZ, including drawing
+    the first active set.
+
+    """
+
+    seed_all(seed)
+    start = time.time()
+    nested = sources.Nested_Sampler(no_active_samples = no_active_samples, max_iter = max_iter, sample = sampler,
+                                    conv_thresh = dlogZ, problem = problem)
+    setup = time.time() - start
+    stop_by_evidence = sources.Config.get('STOP_BY_EVIDENCE')
+    sources.Config['STOP_BY_EVIDENCE'] = '1'
+    try:
+        out = nested.fit()
+    finally:
+        if stop_by_evidence is None:
+            del sources.Config['STOP_BY_EVIDENCE']
+        else:
+            sources.Config['STOP_BY_EVIDENCE'] = stop_by_evidence
+    converged = out["convergence"]
+    return {"dlogZ":dlogZ, "converged":converged is not None,
+            "seconds":None if converged is None else setup + converged["time"],
+            "iterations":None if converged is None else converged["iteration"],
+            "likelihood_calculations":out["likelihood_calculations"], "logZ":out["logZ"]}
+
+
+def bench_import(module, repeats=5):
+
+    """
+    Returns the median seconds to import a module in a fresh python process, and the heavy packages loaded
+    by the import.
+
+    """
+
+    code = ("import sys, time\n"
+            "start = time.time()\n"
+            "import "+module+"\n"
+            "elapsed = time.time() - start\n"
+            "print repr((elapsed, sorted(set(i.split('.')[0] for i in sys.modules) & set("+repr(HEAVY_PACKAGES)+"))))\n")
+    times = []
+    for k in range(repeats):
+        elapsed, loaded = eval(subprocess.check_output([sys.executable, "-c", code], cwd=SRC).strip().splitlines()[-1])
+        times.append(elapsed)
+    return {"repeats":repeats, "seconds":float(np.median(times)), "heavy_packages":loaded}
+
+
+def environment():
+
+    """
+    Returns the git commit, versions and host of the run.
+
+    """
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SRC,
+                                         stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit":commit, "python":platform.python_version(), "numpy":np.__version__,
+            "host":socket.gethostname(), "date":time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def run_benchmarks(quick=False):
+
+    """
+    Runs every benchmark on every standard image.
+
+    Parameters
+    ----------
+    quick : bool
+        Only the toy image, fewer iterations and no end-to-end runs
+
+    Returns
+    -------
+    results : dict
+        environment - see environment
+        results - one record per benchmark, image and sampler. A sampler which fails on an image (the
+        clustered samplers need enough active points per cluster) gets its error instead of timings.
+
+    """
+
+    iterations = 500 if quick else 2000
+    problems = standard_problems()
+    if quick:
+        problems = problems[:1]
+
+    results = []
+    for module in IMPORT_MODULES:
+        record = {"benchmark":"import", "module":module}
+        record.update(bench_import(module))
+        results.append(record)
+        print record
+
+    for name, problem in problems:
+        record = {"benchmark":"likelihood", "image":name}
+        record.update(bench_likelihood(problem))
+        results.append(record)
+        print record
+
+        for sampler in SAMPLERS:
+            record = {"benchmark":"sampler", "image":name, "sampler":sampler}
+            try:
+                record.update(bench_sampler(problem, sampler, iterations = iterations))
+            except Exception as e:
+                record["error"] = repr(e)
+            results.append(record)
+            print record
+
+        for sampler in ["metropolis", "uniform", "slice"]:
+            record = {"benchmark":"memo", "image":name, "sampler":sampler}
+            record.update(bench_memo(problem, sampler, iterations = iterations))
+            results.append(record)
+            print record
+
+        record = {"benchmark":"rebuild", "image":name}
+        record.update(bench_rebuild(problem, iterations = iterations))
+        results.append(record)
+        print record
+
+        if not quick:
+            for sampler in ["metropolis", "galilean"]:
+                record = {"benchmark":"end_to_end", "image":name, "sampler":sampler}
+                record.update(bench_end_to_end(problem, sampler))
+                results.append(record)
+                print record
+
+    return {"environment":environment(), "results":results}
+
+
+if __name__ == '__main__':
+
+    out = sys.argv[1] if len(sys.argv) > 1 else "benchmark.json"
+    results = run_benchmarks(quick = "quick" in sys.argv[2:])
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print "Benchmark results written to "+out
@@ -0,0 +1,241 @@
+"""A disk cache of detection results keyed by the image content and the run configuration.
+
+The key of a run is the SHA-1 of the image bytes together with the normalised settings which determine
+its result: priors, noise, sampler settings, surrogate, stopping rule and seed. Runs without a seed are
+cached as well, a hit then returns one earlier draw of the same stochastic run. Each entry is a directory
+named after its key holding the posterior samples, the active samples and the catalog as .npy files and
+the run statistics as JSON. An entry is written under a temporary name and renamed into place, so
+concurrent runs never read half-written entries. Reading an entry marks it as recently used, and the least
+recently used entries are removed whenever the cache grows beyond its size.
+
+    cache = ResultCache(directory, max_bytes = 2**30)
+    key = run_key(image_digest(problem), settings)
+    hit = cache.get(key)
+
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from images import split_extension
+
+#Part of every key, increased when a change of the code changes results
+CACHE_VERSION = 5
+
+ARRAYS = ['samples', 'active', 'catalog']
+
+
+def image_digest(problem, chunk=1 << 20):
+
+    """
+    Returns the SHA-1 of the image of a detection problem together with its weight map and mask. Files are
+    read in chunks.
+
+    Parameters
+    ----------
+    problem : object
+        A DetectionProblem
+    chunk : int
+        Number of bytes hashed at a time
+
+    Returns
+    -------
+    digest : str
+        Hexadecimal digest of the image bytes
+
+    """
+
+    sha = hashlib.sha1()
+    for path, data in [(problem.image_path, problem.data_map), (problem.weight_path, problem.weight),
+                       (problem.mask_path, problem.mask)]:
+        if path is not None:
+            File, extension = split_extension(path)
+            sha.update(str(extension))
+            f = open(File, 'rb')
+            block = f.read(chunk)
+            while block:
+                sha.update(block)
+                block = f.read(chunk)
+            f.close()
+        elif data is not None:
+            data = np.ascontiguousarray(data)
+            sha.update(str(data.dtype)+str(data.shape))
+            sha.update(data.data)
+        else:
+            sha.update('none')
+    sha.update(str(problem.variance))
+    return sha.hexdigest()
+
+
+def run_key(digest, settings):
+
+    """
+    Returns the cache key of a run.
+
+    Parameters
+    ----------
+    digest : str
+        Digest of the image, see image_digest
+    settings : dict
+        Everything else which determines the result of the run. Values have to be JSON serialisable;
+        floats are normalised with repr so that 1 and 1.0 give the same key.
+
+    Returns
+    -------
+    key : str
+        Hexadecimal SHA-1 of the image digest and the settings
+
+    """
+
+    def normalise(value):
+        if isinstance(value, dict):
+            return dict((str(k), normalise(v)) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return [normalise(i) for i in value]
+        if isinstance(value, bool) or value is None:
+            return value
+        if isinstance(value, (int, long, float, np.number)):
+            return repr(float(value))
+        return str(value)
+
+    text = json.dumps([CACHE_VERSION, digest, normalise(settings)], sort_keys=True)
+    return hashlib.sha1(text).hexdigest()
+
+
+class ResultCache(object):
+
+    """
+    Detection results on disk with least recently used eviction.
+
+    Attributes
+    ----------
+    directory : str
+        Directory of the entries
+    max_bytes : int
+        Largest total size of the entries
+
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+
+        """
+        Parameters
+        ----------
+        directory : str
+            Directory of the entries, created if missing
+        max_bytes : int
+            Largest total size of the entries
+
+        """
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+
+    def get(self, key):
+
+        """
+        Returns a cached result and marks it as recently used.
+
+        Parameters
+        ----------
+        key : str
+            Key of the run, see run_key
+
+        Returns
+        -------
+        result : dict
+            samples, active and catalog arrays and the stats dict, None if the run is not cached
+
+        """
+
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, 'stats.json')) as f:
+                result = {"stats":json.load(f)}
+            for name in ARRAYS:
+                result[name] = np.load(os.path.join(entry, name+'.npy'))
+            os.utime(entry, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return result
+
+
+    def put(self, key, samples, active, catalog, stats):
+
+        """
+        Stores a result and evicts the least recently used entries beyond max_bytes.
+
+        Parameters
+        ----------
+        key : str
+            Key of the run, see run_key
+        samples : 2Darray
+            Posterior samples, as returned by sources.sample_array
+        active : 2Darray
+            Active samples at the end of the run
+        catalog : 2Darray
+            Catalog of the run, see catalog.extract_catalog
+        stats : dict
+            JSON serialisable statistics of the run
+
+        """
+
+        entry = os.path.join(self.directory, key)
+        if os.path.isdir(entry):
+            return
+        temporary = tempfile.mkdtemp(prefix='.'+key, dir=self.directory)
+        os.chmod(temporary, 0755)
+        for name, data in zip(ARRAYS, [samples, active, catalog]):
+            np.save(os.path.join(temporary, name+'.npy'), np.asarray(data, dtype=float))
+        with open(os.path.join(temporary, 'stats.json'), 'w') as f:
+            json.dump(stats, f, sort_keys=True)
+        try:
+            os.rename(temporary, entry)
+        except OSError:
+            #Another run stored the same key first
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict()
+
+
+    def entries(self):
+
+        """
+        Returns the entries of the cache.
+
+        Returns
+        -------
+        entries : array
+            (last use, bytes, key) of every entry, least recently used first
+
+        """
+
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, i)) for i in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, key))
+            except OSError:
+                continue
+        return sorted(entries)
+
+
+    def evict(self):
+
+        """Removes the least recently used entries until the cache fits into max_bytes."""
+
+        entries = self.entries()
+        total = sum(i[1] for i in entries)
+        for used, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            total -= size
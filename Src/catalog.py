@@ -0,0 +1,221 @@
+"""Source catalogs from posterior samples.
+
+The posterior samples written by run_source_detect (a text table or a binary .npy file with the columns
+X, Y, A, R, logL and logWt) are weighted by their posterior weights and clustered in X, Y on a grid of
+cells of side eps, which is the spatial index of the clustering. As in DBSCAN, a cell is a core cell when
+its 3x3 neighbourhood holds at least minPts samples, connected core cells form one source and the samples
+of other cells, or of clusters of less than minPts samples, are noise. Every source of the catalog gets
+the weighted means and standard deviations of X, Y, A and R of its samples. All steps are vectorised over
+the samples, so millions of samples take seconds.
+
+"""
+
+import os
+import sys
+import numpy as np
+from posterior import importance_weights
+
+
+SAMPLE_COLUMNS = ['X', 'Y', 'A', 'R', 'logL', 'logWt']
+CATALOG_COLUMNS = ['X', 'Y', 'A', 'R', 'X_err', 'Y_err', 'A_err', 'R_err', 'mass', 'samples', 'logL']
+
+
+def write_samples(data, out):
+
+    """
+    Writes posterior samples to a text table, or to a binary .npy file if out ends with .npy.
+
+    Parameters
+    ----------
+    data : 2Darray
+        Samples with the columns of SAMPLE_COLUMNS, as returned by sources.sample_array
+    out : str
+        Location of the samples file
+
+    """
+
+    data = np.asarray(data, dtype=float)
+    if out.lower().endswith('.npy'):
+        np.save(out, data)
+    else:
+        from astropy.io import ascii
+        ascii.write([data[:,k] for k in range(data.shape[1])], out, names=SAMPLE_COLUMNS[:data.shape[1]], format='basic',
+                    overwrite=True)
+
+
+def read_samples(File):
+
+    """
+    Reads posterior samples from a text table or a binary .npy file.
+
+    Parameters
+    ----------
+    File : str
+        Location of the samples file
+
+    Returns
+    -------
+    data : 2Darray
+        Samples with the columns of SAMPLE_COLUMNS. logWt is nan for files written without it.
+
+    """
+
+    if File.lower().endswith('.npy'):
+        data = np.load(File)
+    else:
+        from astropy.io import ascii
+        table = ascii.read(File, format='basic', fast_reader=True)
+        data = np.column_stack([np.asarray(table[i], dtype=float) if i in table.colnames else np.nan
+                                for i in SAMPLE_COLUMNS])
+    if data.shape[1] < len(SAMPLE_COLUMNS):
+        data = np.column_stack((data, np.nan*np.ones((len(data), len(SAMPLE_COLUMNS) - data.shape[1]))))
+    return data
+
+
+def sample_weights(logWt):
+
+    """
+    Returns the normalised posterior weights of samples from their log weights.
+
+    Parameters
+    ----------
+    logWt : array
+        Log weights of the samples. If any is nan every sample gets the same weight.
+
+    Returns
+    -------
+    weights : array
+        Weights summing to one
+
+    """
+
+    logWt = np.asarray(logWt, dtype=float)
+    if len(logWt) == 0 or np.any(np.isnan(logWt)):
+        return np.ones(len(logWt))/max(len(logWt), 1)
+    return importance_weights(logWt)
+
+
+def cluster_samples(X, Y, eps=3.0, minPts=10):
+
+    """
+    Clusters samples in X, Y on a grid of cells of side eps.
+
+    Parameters
+    ----------
+    X : array
+        x coordinates of the samples
+    Y : array
+        y coordinates of the samples
+    eps : float
+        Side of the cells in pixels
+    minPts : int
+        Minimum number of samples in the 3x3 neighbourhood of a core cell
+
+    Returns
+    -------
+    labels : array
+        Cluster of every sample, -1 for noise
+    number_of_clusters : int
+        Number of clusters
+
+    """
+
+    if len(X) == 0:
+        return np.zeros(0, dtype=int), 0
+    i = np.floor((np.asarray(X) - np.min(X))/eps).astype(int)
+    j = np.floor((np.asarray(Y) - np.min(Y))/eps).astype(int)
+    shape = (np.max(j) + 1, np.max(i) + 1)
+    counts = np.bincount(j*shape[1] + i, minlength=shape[0]*shape[1]).reshape(shape)
+
+    from scipy import ndimage
+    neighbourhood = ndimage.convolve(counts, np.ones((3, 3), dtype=int), mode='constant')
+    cells, number_of_clusters = ndimage.label(neighbourhood >= minPts, structure=np.ones((3, 3)))
+    labels = cells[j, i] - 1
+    return labels, number_of_clusters
+
+
+def extract_catalog(data, eps=3.0, minPts=10, min_logL=None):
+
+    """
+    Returns the catalog of the sources found in posterior samples.
+
+    Parameters
+    ----------
+    data : 2Darray
+        Samples with the columns of SAMPLE_COLUMNS
+    eps : float
+        Side of the clustering cells in pixels
+    minPts : int
+        Minimum number of samples around a core cell
+    min_logL : float
+        Only samples with a larger log likelihood are clustered, for example the log likelihood of an
+        empty image
+
+    Returns
+    -------
+    catalog : 2Darray
+        One row per source with the columns of CATALOG_COLUMNS: the weighted means and standard deviations
+        of X, Y, A, R, the posterior mass of the source as a fraction of the mass of all samples given, its
+        number of samples and their largest logL. Sorted by decreasing mass.
+
+    """
+
+    data = np.asarray(data, dtype=float)
+    #Normalised over every sample, so that the mass of a source is a fraction of the whole posterior
+    weights = sample_weights(data[:,5])
+    if min_logL is not None:
+        kept = data[:,4] > min_logL
+        data = data[kept]
+        weights = weights[kept]
+    labels, number_of_clusters = cluster_samples(data[:,0], data[:,1], eps, minPts)
+    if number_of_clusters == 0:
+        return np.empty((0, len(CATALOG_COLUMNS)))
+
+    clustered = labels >= 0
+    labels = labels[clustered]
+    data = data[clustered]
+    weights = weights[clustered]
+
+    mass = np.bincount(labels, weights=weights, minlength=number_of_clusters)
+    samples = np.bincount(labels, minlength=number_of_clusters)
+    found = (mass > 0) & (samples >= minPts)
+    norm = np.where(found, mass, 1.0)
+    mean = np.column_stack([np.bincount(labels, weights=weights*data[:,k], minlength=number_of_clusters)/norm
+                            for k in range(4)])
+    variance = np.column_stack([np.bincount(labels, weights=weights*(data[:,k] - mean[labels,k])**2,
+                                            minlength=number_of_clusters)/norm for k in range(4)])
+    logL = np.full(number_of_clusters, -np.inf)
+    np.maximum.at(logL, labels, data[:,4])
+
+    catalog = np.column_stack((mean, np.sqrt(variance), mass, samples, logL))[found]
+    return catalog[np.argsort(-catalog[:,8], kind='mergesort')]
+
+
+def write_catalog(catalog, out):
+
+    """
+    Writes a catalog to a text table.
+
+    Parameters
+    ----------
+    catalog : 2Darray
+        Catalog with the columns of CATALOG_COLUMNS
+    out : str
+        Location of the catalog
+
+    """
+
+    from astropy.io import ascii
+    ascii.write([catalog[:,k] for k in range(len(CATALOG_COLUMNS))], out, names=CATALOG_COLUMNS, format='basic', overwrite=True)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print "Usage: python catalog.py <samples file> [catalog file]"
+        sys.exit(1)
+
+    out = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(sys.argv[1])[0]+'_catalog.dat'
+    catalog = extract_catalog(read_samples(sys.argv[1]))
+    write_catalog(catalog, out)
+    print "Sources: "+str(len(catalog))+"  written to "+out
@@ -0,0 +1,142 @@
+"""Reading and converting images for source detection.
+
+FITS images are memory-mapped and raw numpy .npy images are opened with np.load(mmap_mode='r'), so the
+2D image is never copied into memory before the likelihood needs it. Images pickled by older versions
+(for example assets/simulated_images/multinest_toy_noised) can still be read, and convert_pickle turns
+them into .npy files once. An extension of a FITS file other than the primary HDU is read by appending
+its number or name in brackets, as in frame.fits[WEIGHT] or frame.fits[2].
+
+"""
+
+import os
+import pickle
+import numpy as np
+
+
+FITS_EXTENSIONS = ('.fits', '.fit', '.fts', '.fits.gz')
+
+
+def split_extension(File):
+
+    """
+    Splits a location of the form file.fits[extension] into the file and the FITS extension.
+
+    Returns
+    -------
+    File : str
+        Location of the file
+    extension : int or str
+        Number or name of the extension, 0 (the primary HDU) if none is given
+
+    """
+
+    if File.endswith(']') and '[' in File:
+        File, extension = File[:-1].rsplit('[', 1)
+        return File, int(extension) if extension.isdigit() else extension
+    return File, 0
+
+
+def can_memmap(File):
+
+    """
+    Returns True if read_image memory-maps the image, for .npy files and uncompressed FITS files.
+
+    """
+
+    File = split_extension(File)[0].lower()
+    return File.endswith('.npy') or (File.endswith(FITS_EXTENSIONS) and not File.endswith('.gz'))
+
+
+def read_image(File, memmap=True):
+
+    """
+    Reads a 2D image from a FITS file, a .npy file or a legacy pickle.
+
+    Parameters
+    ----------
+    File : str
+        Location of the image. FITS locations may end with an extension in brackets, see split_extension
+    memmap : bool
+        Memory-map FITS and .npy images instead of reading them into memory
+
+    Returns
+    -------
+    data_map : array
+        The image in numpy format. For memory-mapped images this is a read-only view of the file.
+
+    """
+
+    File, extension = split_extension(File)
+    if File.lower().endswith(FITS_EXTENSIONS):
+        from astropy.io import fits
+        hdulist = fits.open(File, memmap=memmap)
+        data_map = hdulist[extension].data
+        hdulist.close()
+        return data_map
+
+    if File.lower().endswith('.npy'):
+        return np.load(File, mmap_mode='r' if memmap else None)
+
+    s = open(File,'rb')
+    data_map = pickle.load(s)
+    s.close()
+    return np.asarray(data_map)
+
+
+def convert_pickle(File, out=None):
+
+    """
+    Converts an image pickled by older versions into a .npy file.
+
+    Parameters
+    ----------
+    File : str
+        Location of the pickled image
+    out : str
+        Location of the .npy file. Defaults to File with .npy appended
+
+    Returns
+    -------
+    out : str
+        Location of the .npy file
+
+    """
+
+    if out is None:
+        out = File+'.npy'
+    s = open(File,'rb')
+    data_map = np.asarray(pickle.load(s))
+    s.close()
+    np.save(out, data_map)
+    return out
+
+
+def write_image(data, out):
+
+    """
+    Writes a 2D image to a FITS file or a .npy file depending on the extension of out.
+
+    Parameters
+    ----------
+    data : array
+        The image in numpy format
+    out : str
+        Location of the image
+
+    """
+
+    if out.lower().endswith(FITS_EXTENSIONS):
+        from astropy.io import fits
+        fits.writeto(out, np.asarray(data), overwrite=True)
+    else:
+        np.save(out, np.asarray(data))
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    if len(sys.argv) < 2:
+        print "Usage: python images.py <pickled image> [output.npy]"
+        sys.exit(1)
+    print convert_pickle(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,155 @@
+"""A bounded memo of log likelihoods for repeated parameter vectors.
+
+Metropolis replacements often evaluate a point they evaluated before, and repeated runs from a fixed seed
+evaluate the same points again. A LikelihoodMemo set as the memo of a DetectionProblem keeps the most
+recently used log likelihoods keyed by the exact (X, Y, A, R) of the source, or by the parameters rounded
+to a quantum. A quantised memo returns the likelihood of a nearby point, so the quantum has to be small
+against the scale on which the likelihood changes. Lookups and insertions hold a lock, so one memo can
+serve the threads of a multithreaded likelihood.
+
+Within a single run points are rarely evaluated twice, so the memo pays off when the same problem is run
+again in the same process, as in parameter sweeps from ipython. shared_memo keeps one
+memo per key for the life of the process for that. Only exact memos should be shared: a shared quantised
+memo would return likelihoods of nearby points evaluated by earlier runs, so results would depend on what
+ran before.
+
+"""
+
+import threading
+from collections import OrderedDict
+
+
+#Memos of this process by key, least recently used first, see shared_memo
+MEMOS = OrderedDict()
+
+
+class LikelihoodMemo(object):
+
+    """
+    Least recently used log likelihoods of sources.
+
+    Attributes
+    ----------
+    max_size : int
+        Largest number of remembered likelihoods
+    quantum : float
+        Parameters are rounded to multiples of the quantum before lookup, None for exact keys
+    hits : int
+        Number of lookups which found a likelihood
+    misses : int
+        Number of lookups which did not
+
+    """
+
+    def __init__(self, max_size=100000, quantum=None):
+
+        """
+        Parameters
+        ----------
+        max_size : int
+            Largest number of remembered likelihoods
+        quantum : float
+            Parameters are rounded to multiples of the quantum before lookup, None for exact keys
+
+        """
+
+        self.max_size = max_size
+        self.quantum = quantum
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def key(self, Source):
+
+        """Returns the key of a source."""
+
+        if self.quantum is None:
+            return (float(Source.X), float(Source.Y), float(Source.A), float(Source.R))
+        q = self.quantum
+        return (round(Source.X/q), round(Source.Y/q), round(Source.A/q), round(Source.R/q))
+
+
+    def get(self, key):
+
+        """
+        Returns the log likelihood remembered for a key and marks it as recently used.
+
+        Returns
+        -------
+        logL : float
+            The log likelihood, None if it is not remembered
+
+        """
+
+        with self.lock:
+            value = self.values.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.values[key] = value
+            self.hits += 1
+            return value
+
+
+    def put(self, key, logL):
+
+        """Remembers the log likelihood of a key, forgetting the least recently used beyond max_size."""
+
+        with self.lock:
+            self.values.pop(key, None)
+            self.values[key] = logL
+            while len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+
+
+    def statistics(self):
+
+        """
+        Returns the hit and miss counts of the memo.
+
+        Returns
+        -------
+        stats : dict
+            hits, misses, hit_rate and size
+
+        """
+
+        with self.lock:
+            return {"hits":self.hits, "misses":self.misses,
+                    "hit_rate":self.hits/float(max(self.hits + self.misses, 1)), "size":len(self.values)}
+
+
+def shared_memo(key, max_size=100000, quantum=None, max_memos=4):
+
+    """
+    Returns the memo of this process for a key, so that repeated runs of the same problem share it.
+
+    Parameters
+    ----------
+    key : tuple
+        Everything the likelihood depends on, for example the image digest and the noise
+    max_size : int
+        Largest number of remembered likelihoods
+    quantum : float
+        Parameters are rounded to multiples of the quantum before lookup, None for exact keys
+    max_memos : int
+        Largest number of memos kept, the least recently used is dropped
+
+    Returns
+    -------
+    memo : object
+        The LikelihoodMemo of the key and quantum
+
+    """
+
+    key = (key, quantum)
+    memo = MEMOS.pop(key, None)
+    if memo is None:
+        memo = LikelihoodMemo(max_size, quantum)
+    memo.max_size = max_size
+    MEMOS[key] = memo
+    while len(MEMOS) > max_memos:
+        MEMOS.popitem(last=False)
+    return memo
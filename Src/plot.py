@@ -1,15 +1,37 @@
+import os
 import numpy as np
+import matplotlib
+#Batch nodes have no display, so a non-interactive backend is used there and only saved plots are made
+if os.name == 'posix' and not os.environ.get('DISPLAY') and 'MPLBACKEND' not in os.environ:
+    matplotlib.use('Agg')
 from matplotlib import pyplot as plt
-from matplotlib.transforms import *
 from matplotlib.patches import Ellipse
 import math
-from pylab import figure,show
 import pickle
-from scipy import stats
+from multiprocessing import Process
+from simulate import render_sources, random_sources
 
 
+def show_or_save(out=None):
 
-def show_source(height, width, sources):
+    """
+    Shows the current figure, or saves it and closes it if out is given.
+
+    Parameters
+    ----------
+    out : str
+        Location of the image to write, for example a PNG
+
+    """
+
+    if out is None:
+        plt.show()
+    else:
+        plt.savefig(out)
+        plt.close()
+
+
+def show_source(height, width, sources, out=None):
 
     """
     Shows a 2D xy plot of the sources characterized by parameters [X, Y, A, R]
@@ -22,6 +44,8 @@ def show_source(height, width, sources):
         width of the image
     sources : array
         Array of source objects to show
+    out : str
+        Save the plot to this location instead of showing it
     
     
     Examples
@@ -68,10 +92,147 @@ def show_source(height, width, sources):
     for i in sources:
         z += i.A*np.exp(-1*((xx-i.X)**2+(yy-i.Y)**2)/(2*(i.R**2)))
     plt.imshow(z)
-    plt.show()
+    show_or_save(out)
+
+
+def posterior_weights(logWt):
+
+    """
+    Returns normalised posterior weights from log weights without overflow.
+
+    Parameters
+    ----------
+    logWt : array
+        Log weights of the samples
+
+    Returns
+    -------
+    weights : array
+        Weights summing to one
+
+    """
+
+    logWt = np.asarray(logWt, dtype=float)
+    weights = np.exp(logWt - np.max(logWt))
+    return weights/np.sum(weights)
+
+
+def density_raster(X, Y, height, width, logWt=None, bins=None):
+
+    """
+    Returns the 2D histogram of samples on a raster covering the image, weighted by their posterior weights.
+    The cost of drawing the raster does not depend on the number of samples.
+
+    Parameters
+    ----------
+    X : array
+        x coordinates of the samples
+    Y : array
+        y coordinates of the samples
+    height : int
+        height of the image
+    width : int
+        width of the image
+    logWt : array
+        Log weights of the samples. Every sample counts once if None
+    bins : tuple
+        (x, y) number of bins. By default one per pixel, at most 1024 along each side
+
+    Returns
+    -------
+    raster : 2Darray
+        Array of shape (y bins, x bins) holding the posterior mass (or the number of samples) per bin
+
+    """
+
+    if bins is None:
+        bins = (min(int(width), 1024), min(int(height), 1024))
+    weights = None if logWt is None else posterior_weights(logWt)
+    raster, x_edges, y_edges = np.histogram2d(X, Y, bins=bins, range=[[0, width], [0, height]], weights=weights)
+    return raster.T
+
+
+def decimate(X, Y, max_points, seed=0):
+
+    """
+    Returns at most max_points of the samples drawn without replacement, for overlaying points on a raster.
+
+    Parameters
+    ----------
+    X : array
+        x coordinates of the samples
+    Y : array
+        y coordinates of the samples
+    max_points : int
+        Maximum number of samples returned
+    seed : int
+        Seed of the draw, independent of the global random state
+
+    Returns
+    -------
+    X, Y : array
+        The drawn samples
+
+    """
+
+    X = np.asarray(X)
+    Y = np.asarray(Y)
+    if len(X) <= max_points:
+        return X, Y
+    chosen = np.random.RandomState(seed).choice(len(X), max_points, replace=False)
+    return X[chosen], Y[chosen]
+
+
+def show_density(X, Y, title, height, width, logWt=None, overlay=None, max_points=1000, out=None):
+
+    """
+    Shows the samples as a density raster, weighted by their posterior weights, instead of a scatter plot.
 
+    Parameters
+    ----------
+    X : array
+        x coordinates of the samples
+    Y : array
+        y coordinates of the samples
+    title : str
+        title of the plot
+    height : int
+        height of the image
+    width : int
+        width of the image
+    logWt : array
+        Log weights of the samples. Every sample counts once if None
+    overlay : tuple
+        (X, Y) of points drawn over the raster, decimated to max_points
+    max_points : int
+        Maximum number of overlaid points
+    out : str
+        Save the plot to this location instead of showing it
 
-def plot_histogram(data, bins, title):
+    Examples
+    --------
+
+    >>> import plot
+    >>> import numpy as np
+    >>> X = np.random.normal(100, 5, 100000)
+    >>> Y = np.random.normal(50, 5, 100000)
+    >>> plot.show_density(X, Y, "density demo", 200, 200, overlay = (X, Y), max_points = 200)
+
+    """
+
+    raster = density_raster(X, Y, height, width, logWt)
+    plt.imshow(raster, origin='lower', extent=[0, width, 0, height], interpolation='nearest', cmap='viridis')
+    plt.colorbar(label = "posterior mass" if logWt is not None else "samples")
+    if overlay is not None:
+        oX, oY = decimate(overlay[0], overlay[1], max_points)
+        plt.scatter(oX, oY, marker=".", s=4, color="w")
+    plt.title(title)
+    plt.xlim(0, width)
+    plt.ylim(0, height)
+    show_or_save(out)
+
+
+def plot_histogram(data, bins, title, out=None, logWt=None):
 
     """
     Shows the histogram of a 1D data.
@@ -84,6 +245,10 @@ def plot_histogram(data, bins, title):
         number of bins to hold
     title : str
         title of the plot
+    out : str
+        Save the plot to this location instead of showing it
+    logWt : array
+        Log weights of the data. Shows the posterior mass per bin instead of the counts
 
     Examples
     --------
@@ -102,13 +267,16 @@ def plot_histogram(data, bins, title):
 
     """
 
-    plt.hist(data,bins)
+    #Binned with numpy and drawn as bars, so drawing does not depend on the size of data
+    weights = None if logWt is None else posterior_weights(logWt)
+    counts, edges = np.histogram(data, bins, weights=weights)
+    plt.bar(edges[:-1], counts, width=np.diff(edges), align='edge')
     plt.title(title)
-    plt.show()
+    show_or_save(out)
     return None
 
 
-def show_scatterplot(X,Y,title, height, width):
+def show_scatterplot(X,Y,title, height, width, out=None):
 
     """
     Parameters
@@ -123,6 +291,8 @@ def show_scatterplot(X,Y,title, height, width):
         height limit of the scatter plot                 
     width : int
         width limit of the scatter plot
+    out : str
+        Save the plot to this location instead of showing it
 
     Examples
     --------
@@ -147,10 +317,10 @@ def show_scatterplot(X,Y,title, height, width):
     plt.title(title)
     plt.xlim(0, width)
     plt.ylim(0, height)
-    plt.show()
+    show_or_save(out)
 
 
-def plot_ellipse(points):
+def plot_ellipse(points, out=None):
 
     """
     Plots minimum bounding ellipse around a set of points
@@ -159,6 +329,8 @@ def plot_ellipse(points):
     ----------
     points : 2Darray
         Two dimensional array for plotting the ellipse
+    out : str
+        Save the plot to this location instead of showing it
     
     Examples
     --------
@@ -208,7 +380,7 @@ def plot_ellipse(points):
     ax = plt.gca()
     ax.add_patch(ellipse)
     plt.plot(X[:,0], X[:,1], 'ro')
-    plt.show()
+    show_or_save(out)
 
 def write(data, out):
 
@@ -238,7 +410,7 @@ def write(data, out):
     f.close()
 
 
-def make_source(src_array,height,width):
+def make_source(src_array,height,width, show=True):
 
     """
     Returns the source image with numpy format
@@ -251,6 +423,8 @@ def make_source(src_array,height,width):
         height of the image
     width : int
         width of the image
+    show : bool
+        Show the image. Set to False to only compute it
 
     Returns
     -------
@@ -291,19 +465,15 @@ def make_source(src_array,height,width):
 
     """
 
-    x = np.arange(0, width)
-    y = np.arange(0, height)
-    xx, yy = np.meshgrid(x, y, sparse=True)
-    z = np.zeros((height,width),float)
-    for i in src_array:
-        z+= i[2]*np.exp(-1*((xx-i[0])**2+(yy-i[1])**2)/(2*(i[3]**2)))
-    plt.imshow(z)
-    plt.title("Source image")
-    plt.show()
+    z = render_sources(src_array, height, width)
+    if show:
+        plt.imshow(z)
+        plt.title("Source image")
+        plt.show()
     return z
 
 
-def add_gaussian_noise(mean, sd, data):
+def add_gaussian_noise(mean, sd, data, show=True):
 
     """
     Adds indpendent gaussian noise of given rms units
@@ -316,6 +486,8 @@ def add_gaussian_noise(mean, sd, data):
         Standard deviation (i.e RMS) of the noise
     data : array
         data to which the noise is added
+    show : bool
+        Show the noised image. Set to False to only compute it
 
     Returns
     -------
@@ -360,14 +532,16 @@ def add_gaussian_noise(mean, sd, data):
 
     height = len(data)
     width = len(data[0])
+    from scipy import stats
     my_noise=stats.distributions.norm.rvs(mean,sd,size=(height, width))
     noised = data + my_noise
-    plt.imshow(noised)
-    plt.title("Source image with additive gaussian noise of rms "+str(sd)+" units")
-    plt.show()
+    if show:
+        plt.imshow(noised)
+        plt.title("Source image with additive gaussian noise of rms "+str(sd)+" units")
+        plt.show()
     return noised
 
-def make_random_source(limits, width, height, number_of_sources):
+def make_random_source(limits, width, height, number_of_sources, show=True):
 
     """
     Makes an Image with randomly distributed sources
@@ -382,6 +556,8 @@ def make_random_source(limits, width, height, number_of_sources):
         length of the image
     number_of_sources : int
         Number of sources
+    show : bool
+        Show the image. Set to False to only compute it
 
     Returns
     -------
@@ -410,23 +586,73 @@ def make_random_source(limits, width, height, number_of_sources):
     
     """
     
-    x_l, x_u = limits[0] 
-    y_l, y_u = limits[1]
-    a_l, a_u = limits[2]
-    r_l, r_u = limits[3]
-
-    x = np.arange(0, width)
-    y = np.arange(0, height)
-    xx, yy = np.meshgrid(x, y, sparse=True)
-    z = np.zeros((height,width),float)
-    for i in range(number_of_sources):
-        z+= np.random.uniform(a_l,a_u)*np.exp(-1*((xx-np.random.uniform(x_l,x_u))**2+(yy-np.random.uniform(y_l,y_u))**2)/(2*(np.random.uniform(r_l,r_u)**2)))
-    plt.imshow(z)
-    plt.title("Source image")
-    plt.show()
+    z = render_sources(random_sources(limits, number_of_sources), height, width)
+    if show:
+        plt.imshow(z)
+        plt.title("Source image")
+        plt.show()
     return z
 
 
+def render_results(samples, active, height, width, output_dir=None, logWt=None):
+
+    """
+    Writes the plots of a detection run as PNGs with a non-interactive backend, or shows them one after the
+    other: the X and Y histograms and the density raster of the posterior samples and of the active samples.
+    The posterior plots are weighted by the posterior weights when logWt is given, and at most 1000 samples
+    are overlaid on each raster.
+
+    Parameters
+    ----------
+    samples : 2Darray
+        X, Y of the posterior samples
+    active : 2Darray
+        X, Y of the active samples
+    height : int
+        height of the image
+    width : int
+        width of the image
+    output_dir : str
+        Directory of the PNGs, created if needed. None to show the plots instead
+    logWt : array
+        Log weights of the posterior samples
+
+    """
+
+    if output_dir is not None:
+        plt.switch_backend('Agg')
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+    def out(name):
+        return None if output_dir is None else os.path.join(output_dir, name+".png")
+    for name, points, weights in [("posterior", np.asarray(samples), logWt), ("active", np.asarray(active), None)]:
+        X = points[:,0]
+        Y = height - points[:,1]
+        plot_histogram(data = X, bins = width, title = "X_histogram of "+name+" samples", logWt = weights,
+                       out = out(name+"_x_histogram"))
+        plot_histogram(data = Y, bins = height, title = "Y_histogram of "+name+" samples", logWt = weights,
+                       out = out(name+"_y_histogram"))
+        show_density(X, Y, title = "Density of "+name+" samples", height = height, width = width, logWt = weights,
+                     overlay = (X, Y), out = out(name+"_density"))
+
+
+def render_in_background(samples, active, height, width, output_dir, logWt=None):
+
+    """
+    Runs render_results in a separate process, so that the caller can go on with the next image.
+
+    Returns
+    -------
+    process : object
+        The started multiprocessing.Process. Python waits for it before exiting.
+
+    """
+
+    process = Process(target = render_results, args = (samples, active, height, width, output_dir, logWt))
+    process.start()
+    return process
+
+
 
 if __name__ == '__main__':
         srces =  [[43.71, 22.91, 10.54, 3.34],
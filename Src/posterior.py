@@ -0,0 +1,170 @@
+"""Weighting, duplicate collapsing and equal-weight resampling of posterior samples.
+
+Posterior samples are arrays with the columns X, Y, A, R, logL and logWt of catalog.SAMPLE_COLUMNS.
+Metropolis replacements often return their unchanged starting point, so a posterior holds exact
+duplicates. collapse_duplicates merges them into one sample carrying their summed weight, and
+equal_weight_samples draws samples of equal weight by systematic resampling. Both are single numpy passes
+over the samples.
+
+"""
+
+import numpy as np
+
+
+def log_weights(logL, no_active_samples):
+
+    """
+    Returns the log weights of dead points from their log likelihoods, for posteriors written without logWt.
+    The prior mass shrinks by exp(-1/N) per iteration as in Nested_Sampler.fit.
+
+    Parameters
+    ----------
+    logL : array
+        Log likelihoods of the dead points in the order they died
+    no_active_samples : int
+        Number of active samples of the run
+
+    Returns
+    -------
+    logWt : array
+        Log weights of the dead points
+
+    """
+
+    iteration = np.arange(len(logL))
+    log_width = np.log(1.0 - np.exp(-1.0/no_active_samples)) - iteration/float(no_active_samples)
+    return np.asarray(logL, dtype=float) + log_width
+
+
+def importance_weights(logWt, logZ=None):
+
+    """
+    Returns the posterior weights of samples.
+
+    Parameters
+    ----------
+    logWt : array
+        Log weights of the samples
+    logZ : float
+        Log evidence of the run. If given the weights are exp(logWt - logZ) and sum to the fraction of the
+        evidence held by the samples, otherwise they are normalised to sum to one.
+
+    Returns
+    -------
+    weights : array
+        Posterior weights
+
+    """
+
+    logWt = np.asarray(logWt, dtype=float)
+    if logZ is not None:
+        return np.exp(logWt - logZ)
+    weights = np.exp(logWt - np.max(logWt))
+    return weights/np.sum(weights)
+
+
+def effective_sample_size(weights):
+
+    """
+    Returns the Kish effective sample size (sum w)^2/sum w^2 of weighted samples.
+
+    """
+
+    weights = np.asarray(weights, dtype=float)
+    return np.sum(weights)**2/np.sum(weights**2)
+
+
+def collapse_duplicates(data, logZ=None):
+
+    """
+    Merges samples with identical X, Y, A, R into one sample whose weight is the sum of their weights.
+    Samples are indexed by the bytes of their parameters, so only exact duplicates are merged.
+
+    Parameters
+    ----------
+    data : 2Darray
+        Posterior samples with the columns X, Y, A, R, logL, logWt
+    logZ : float
+        Log evidence of the run, see importance_weights
+
+    Returns
+    -------
+    collapsed : 2Darray
+        The distinct samples, in order of first appearance, with logWt the log of their summed weight
+    counts : array
+        Number of samples merged into each distinct sample
+
+    """
+
+    data = np.asarray(data, dtype=float)
+    parameters = np.ascontiguousarray(data[:,0:4])
+    keys = parameters.view(np.dtype((np.void, parameters.dtype.itemsize*4))).ravel()
+    unique, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+
+    weights = np.bincount(inverse, weights=importance_weights(data[:,5], logZ), minlength=len(unique))
+    order = np.argsort(first, kind='mergesort')
+    collapsed = data[first[order]].copy()
+    with np.errstate(divide='ignore'):
+        collapsed[:,5] = np.log(weights[order])
+    return collapsed, counts[order]
+
+
+def systematic_resample(weights, n, seed=None):
+
+    """
+    Draws n indices with probabilities proportional to weights by systematic resampling, which uses a single
+    uniform number and keeps every index within one copy of its expected count.
+
+    Parameters
+    ----------
+    weights : array
+        Weights of the samples, not necessarily normalised
+    n : int
+        Number of indices to draw
+    seed : int
+        Seed of the draw, independent of the global random state. None draws from the global state.
+
+    Returns
+    -------
+    indices : array
+        The drawn indices, in increasing order
+
+    """
+
+    cumulative = np.cumsum(weights, dtype=float)
+    u = np.random.uniform() if seed is None else np.random.RandomState(seed).uniform()
+    positions = (u + np.arange(n))*cumulative[-1]/n
+    return np.minimum(np.searchsorted(cumulative, positions, side='right'), len(cumulative) - 1)
+
+
+def equal_weight_samples(data, logZ=None, n=None, seed=None):
+
+    """
+    Returns equally weighted posterior samples. Exact duplicates are collapsed first and the number of
+    samples defaults to the effective sample size of the posterior.
+
+    Parameters
+    ----------
+    data : 2Darray
+        Posterior samples with the columns X, Y, A, R, logL, logWt
+    logZ : float
+        Log evidence of the run, see importance_weights
+    n : int
+        Number of samples to draw
+    seed : int
+        Seed of the draw, see systematic_resample
+
+    Returns
+    -------
+    samples : 2Darray
+        Samples with the columns of data, whose logWt is -log(n)
+
+    """
+
+    collapsed, counts = collapse_duplicates(data, logZ)
+    weights = np.exp(collapsed[:,5] - np.max(collapsed[:,5]))
+    if n is None:
+        n = max(int(round(effective_sample_size(weights))), 1)
+    samples = collapsed[systematic_resample(weights, n, seed)]
+    samples[:,5] = -np.log(n)
+    return samples
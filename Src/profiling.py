@@ -0,0 +1,232 @@
+"""Timers and counters for the phases of a nested sampling run.
+
+Code marks a phase with
+
+    with profiler.phase("likelihood"):
+        ...
+
+Phases nest, so every phase is timed along its path of enclosing phases (adaptive;metropolis;likelihood)
+and its self time excludes the phases inside it. The self time of a sampler phase ("metropolis", "slice",
+...) is therefore the time spent proposing points (random numbers, ellipsoid geometry) and in the python
+bookkeeping of the sampler, and the time outside every phase is the evidence bookkeeping of the main loop. At the end of a run
+summary() gives a table per phase and write_folded() writes the self times as folded stacks, the input
+format of flamegraph.pl. A Profiler can also run cProfile for the whole run and dump its statistics.
+
+When profiling is switched off NULL_PROFILER is used, whose phase() returns itself and does nothing, so
+the instrumented code only pays for a method call per phase.
+
+"""
+
+import cProfile
+from timeit import default_timer as clock
+
+
+class Profiler(object):
+
+    """
+    Collects the time spent in nested phases and named counters.
+
+    Attributes
+    ----------
+    enabled : bool
+        True, the profiler records
+    totals : dict
+        [calls, total seconds, self seconds] per path of phases
+    counters : dict
+        Value of every counter
+    cprofile : str
+        Location of the cProfile statistics, None to not run cProfile
+
+    """
+
+    enabled = True
+
+    def __init__(self, cprofile=None):
+
+        """
+        Parameters
+        ----------
+        cprofile : str
+            Also run cProfile between start and stop and dump its statistics to this location
+
+        """
+
+        self.totals = {}
+        self.counters = {}
+        self.stack = []
+        self.pending = None
+        self.cprofile = cprofile
+        self.profile = None
+        self.started = None
+        self.wall = 0.0
+
+
+    def phase(self, name):
+
+        """Returns the profiler as the context manager timing the phase name."""
+
+        self.pending = name
+        return self
+
+
+    def __enter__(self):
+
+        self.stack.append([self.pending, clock(), 0.0])
+        return self
+
+
+    def __exit__(self, *args):
+
+        name, start, children = self.stack.pop()
+        elapsed = clock() - start
+        path = tuple(i[0] for i in self.stack) + (name,)
+        total = self.totals.get(path)
+        if total is None:
+            total = self.totals[path] = [0, 0.0, 0.0]
+        total[0] += 1
+        total[1] += elapsed
+        total[2] += elapsed - children
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        return False
+
+
+    def count(self, name, n=1):
+
+        """Adds n to the counter name."""
+
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def start(self):
+
+        """Starts the wall clock, and cProfile if requested."""
+
+        self.started = clock()
+        if self.cprofile is not None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+
+    def stop(self):
+
+        """Stops the wall clock, and cProfile after dumping its statistics."""
+
+        if self.started is not None:
+            self.wall += clock() - self.started
+            self.started = None
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.cprofile)
+            self.profile = None
+
+
+    def phases(self):
+
+        """
+        Returns the totals per phase name, summed over the paths the phase appears on.
+
+        Returns
+        -------
+        phases : dict
+            [calls, total seconds, self seconds] per phase. Total seconds only count the outermost
+            occurrence of a phase on a path.
+
+        """
+
+        phases = {}
+        for path, (calls, total, own) in self.totals.items():
+            entry = phases.setdefault(path[-1], [0, 0.0, 0.0])
+            entry[0] += calls
+            if path[-1] not in path[:-1]:
+                entry[1] += total
+            entry[2] += own
+        return phases
+
+
+    def summary(self):
+
+        """
+        Returns a table of the calls, total time, self time and share of the wall time of every phase,
+        followed by the counters.
+
+        Returns
+        -------
+        table : str
+            The table, one phase per line sorted by decreasing self time
+
+        """
+
+        wall = self.wall if self.wall > 0 else max([i[1] for i in self.totals.values()] + [1e-12])
+        lines = ["%-24s %10s %12s %12s %8s" % ("phase", "calls", "total [s]", "self [s]", "self %")]
+        phases = self.phases()
+        for name in sorted(phases, key=lambda i: -phases[i][2]):
+            calls, total, own = phases[name]
+            lines.append("%-24s %10d %12.4f %12.4f %7.2f%%" % (name, calls, total, own, 100.0*own/wall))
+        outside = wall - sum([total for path, (calls, total, own) in self.totals.items() if len(path) == 1])
+        lines.append("%-24s %10s %12.4f %12.4f %7.2f%%" % ("(outside phases)", "", outside, outside, 100.0*outside/wall))
+        lines.append("%-24s %10s %12.4f" % ("wall", "", wall))
+        for name in sorted(self.counters):
+            lines.append("%-24s %10d" % (name, self.counters[name]))
+        return "\n".join(lines)
+
+
+    def write_folded(self, out):
+
+        """
+        Writes the self time of every path of phases in microseconds as folded stacks
+        ("adaptive;metropolis;likelihood 1234" per line), which flamegraph.pl turns into a flame graph.
+
+        Parameters
+        ----------
+        out : str
+            Location of the folded stacks
+
+        """
+
+        f = open(out, 'w')
+        for path in sorted(self.totals):
+            f.write(";".join(path)+" "+str(int(round(1e6*self.totals[path][2])))+"\n")
+        f.close()
+
+
+class Null_Profiler(object):
+
+    """
+    A profiler which records nothing, used when profiling is switched off.
+
+    """
+
+    enabled = False
+
+    def phase(self, name):
+
+        return self
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *args):
+
+        return False
+
+
+    def count(self, name, n=1):
+
+        pass
+
+
+    def start(self):
+
+        pass
+
+
+    def stop(self):
+
+        pass
+
+
+NULL_PROFILER = Null_Profiler()
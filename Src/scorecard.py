@@ -0,0 +1,187 @@
+"""Detection quality against compute for simulated images with a known catalog.
+
+The detections are matched one to one to the true sources with a KD-tree: pairs closer than the tolerance
+are matched from the closest pair on. Completeness is the fraction of true sources matched, purity the
+fraction of detections matched, and the errors of X, Y, A and R are taken over the matched pairs.
+run_scorecard runs the detection for every sampler and number of active points and records the scores
+next to the likelihood calculations and the wall time, which gives the cost/quality curve of the settings.
+
+    python scorecard.py <image> <truth catalog> [output.json]
+
+The image and its truth catalog are written by simulate.write_simulation, which renders the same sources
+as plot.make_source. The samplers, active points and tolerance are SCORECARD_SAMPLERS,
+SCORECARD_ACTIVE_POINTS and SCORECARD_TOLERANCE of config.cfg.
+
+"""
+
+import sys
+import json
+import time
+import random
+import numpy as np
+from scipy.spatial import cKDTree
+from astropy.io import ascii
+from catalog import extract_catalog
+import sources
+
+
+def read_truth(File):
+
+    """
+    Reads a ground-truth catalog with the columns X, Y, A, R.
+
+    Returns
+    -------
+    truth : 2Darray
+        Array of shape (number of sources, 4)
+
+    """
+
+    table = ascii.read(File, format='basic')
+    return np.column_stack([np.asarray(table[i], dtype=float) for i in ['X', 'Y', 'A', 'R']]).reshape(-1, 4)
+
+
+def match_catalogs(truth, detected, tolerance):
+
+    """
+    Matches detections to true sources one to one, from the closest pair on.
+
+    Parameters
+    ----------
+    truth : 2Darray
+        True sources, X and Y in the first two columns
+    detected : 2Darray
+        Detections, X and Y in the first two columns
+    tolerance : float
+        Largest distance in pixels of a match
+
+    Returns
+    -------
+    pairs : 2Darray
+        Array of shape (number of matches, 2) with the indices of the matched true source and detection
+
+    """
+
+    if len(truth) == 0 or len(detected) == 0:
+        return np.zeros((0, 2), dtype=int)
+    distances = cKDTree(np.asarray(truth)[:,0:2]).sparse_distance_matrix(cKDTree(np.asarray(detected)[:,0:2]), tolerance).tocoo()
+    order = np.argsort(distances.data, kind='mergesort')
+    used_truth = set()
+    used_detected = set()
+    pairs = []
+    for i, j in zip(distances.row[order], distances.col[order]):
+        if i not in used_truth and j not in used_detected:
+            used_truth.add(i)
+            used_detected.add(j)
+            pairs.append((i, j))
+    return np.array(pairs, dtype=int).reshape(-1, 2)
+
+
+def score(truth, detected, tolerance=3.0):
+
+    """
+    Scores detections against the true sources.
+
+    Parameters
+    ----------
+    truth : 2Darray
+        True sources with the columns X, Y, A, R
+    detected : 2Darray
+        Detections with X, Y, A, R in their first four columns, for example a catalog of catalog.extract_catalog
+    tolerance : float
+        Largest distance in pixels of a match
+
+    Returns
+    -------
+    scores : dict
+        true, detected and matched numbers of sources, completeness, purity and the root mean square
+        errors X_rms, Y_rms, A_rms, R_rms and the mean errors A_bias, R_bias of the matched detections
+
+    """
+
+    truth = np.asarray(truth, dtype=float).reshape(-1, 4)
+    detected = np.asarray(detected, dtype=float)
+    pairs = match_catalogs(truth, detected, tolerance)
+    scores = {"true":len(truth), "detected":len(detected), "matched":len(pairs),
+              "completeness":len(pairs)/float(len(truth)) if len(truth) > 0 else None,
+              "purity":len(pairs)/float(len(detected)) if len(detected) > 0 else None}
+    errors = detected[pairs[:,1], 0:4] - truth[pairs[:,0]] if len(pairs) > 0 else None
+    for k, name in enumerate(['X', 'Y', 'A', 'R']):
+        scores[name+"_rms"] = None if errors is None else float(np.sqrt(np.mean(errors[:,k]**2)))
+    for k, name in [(2, 'A'), (3, 'R')]:
+        scores[name+"_bias"] = None if errors is None else float(np.mean(errors[:,k]))
+    return scores
+
+
+def run_scorecard(problem, truth, samplers, active_points, iterations, tolerance=3.0, seed=0):
+
+    """
+    Runs the detection for every sampler and number of active points and scores it against the truth.
+
+    Parameters
+    ----------
+    problem : object
+        The DetectionProblem of the simulated image
+    truth : 2Darray
+        True sources with the columns X, Y, A, R
+    samplers : array
+        Sampler names, see Nested_Sampler
+    active_points : array
+        Numbers of active samples
+    iterations : int
+        Nested sampling iterations of every run
+    tolerance : float
+        Largest distance in pixels of a match
+    seed : int
+        Seed of every run
+
+    Returns
+    -------
+    records : array
+        One dict per setting with sampler, active_points, likelihood_calculations, seconds, logZ and
+        the scores of score, or the error of a run which failed
+
+    """
+
+    null = problem.null_log_likelihood()
+    records = []
+    for sampler in samplers:
+        for n in active_points:
+            record = {"sampler":sampler, "active_points":n, "iterations":iterations}
+            random.seed(seed)
+            np.random.seed(seed)
+            start = time.time()
+            try:
+                out = sources.Nested_Sampler(no_active_samples = n, max_iter = iterations, sample = sampler,
+                                             problem = problem).fit()
+            except Exception as e:
+                record["error"] = repr(e)
+                records.append(record)
+                continue
+            record.update({"seconds":time.time() - start, "likelihood_calculations":out["likelihood_calculations"],
+                           "logZ":out["logZ"]})
+            record.update(score(truth, extract_catalog(sources.sample_array(out["samples"]), min_logL = null), tolerance))
+            records.append(record)
+            print record
+    return records
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 3:
+        print "Usage: python scorecard.py <image> <truth catalog> [output.json]"
+        sys.exit(1)
+
+    Config = sources.Config
+    problem = sources.DetectionProblem(image_path = sys.argv[1], noise = float(Config['NOISE']),
+                                       prior = [[None, None], [None, None],
+                                                [float(Config['A_PRIOR_LOWER']), float(Config['A_PRIOR_UPPER'])],
+                                                [float(Config['R_PRIOR_LOWER']), float(Config['R_PRIOR_UPPER'])]])
+    records = run_scorecard(problem, read_truth(sys.argv[2]), str(Config['SCORECARD_SAMPLERS']).split(','),
+                            [int(i) for i in str(Config['SCORECARD_ACTIVE_POINTS']).split(',')],
+                            int(Config['MAX_ITER']), tolerance = float(Config['SCORECARD_TOLERANCE']))
+
+    out = sys.argv[3] if len(sys.argv) > 3 else "scorecard.json"
+    with open(out, 'w') as f:
+        json.dump(records, f, indent=1, sort_keys=True)
+    print "Scorecard written to "+out
@@ -0,0 +1,139 @@
+"""Named blocks of shared memory holding read-only arrays for worker processes.
+
+A block is a directory in /dev/shm (the temporary directory where there is no /dev/shm) with one .npy file
+per array. Worker processes attach to a block by its name and memory-map the arrays read-only, so every
+worker reads the same pages and the memory of a node does not grow with the number of workers. The
+process which created a block removes it when it is closed, at the latest when the process exits.
+
+multiprocessing.shared_memory only exists from Python 3.8, and multiprocessing.sharedctypes arrays can
+only be handed to workers when the pool is created, not attached to by name.
+
+"""
+
+import os
+import atexit
+import shutil
+import tempfile
+import numpy as np
+
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class SharedArrays(object):
+
+    """
+    A named block of read-only arrays in shared memory.
+
+    Attributes
+    ----------
+    name : str
+        Name of the block, used by the workers to attach to it
+    owner : bool
+        True in the process which created the block and removes it. Processes forked from it never
+        remove the block.
+
+    """
+
+    def __init__(self, name, owner=False):
+
+        """
+        Attaches to an existing block. Use SharedArrays.create to make a new one.
+
+        Parameters
+        ----------
+        name : str
+            Name of the block
+        owner : bool
+            Remove the block when it is closed
+
+        """
+
+        self.name = name
+        self.owner = owner
+        self.pid = os.getpid()
+        self.arrays = {}
+
+
+    @classmethod
+    def create(cls, arrays):
+
+        """
+        Copies arrays into a new block, which is removed when it is closed or when this process exits.
+
+        Parameters
+        ----------
+        arrays : dict
+            Arrays by name
+
+        Returns
+        -------
+        block : object
+            The new block
+
+        """
+
+        block = cls(tempfile.mkdtemp(prefix='bayes_detect_', dir=SHM_DIR), owner=True)
+        atexit.register(block.close)
+        for key, value in arrays.items():
+            np.save(os.path.join(block.name, key+'.npy'), np.ascontiguousarray(value))
+        return block
+
+
+    @classmethod
+    def attach(cls, name):
+
+        """
+        Attaches to the block created by another process.
+
+        Parameters
+        ----------
+        name : str
+            Name of the block
+
+        Returns
+        -------
+        block : object
+            The block, which is not removed when it is closed
+
+        """
+
+        if not os.path.isdir(name):
+            raise IOError("No shared block "+name)
+        return cls(name)
+
+
+    def __getitem__(self, key):
+
+        """Returns the read-only memory-mapped array stored under key."""
+
+        if key not in self.arrays:
+            self.arrays[key] = np.load(os.path.join(self.name, key+'.npy'), mmap_mode='r')
+        return self.arrays[key]
+
+
+    def keys(self):
+
+        """Returns the names of the arrays of the block."""
+
+        return [i[:-4] for i in os.listdir(self.name) if i.endswith('.npy')]
+
+
+    def close(self):
+
+        """Detaches from the block and removes it if this process created it."""
+
+        self.arrays = {}
+        if self.owner and self.pid == os.getpid():
+            shutil.rmtree(self.name, ignore_errors=True)
+            self.owner = False
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *args):
+
+        self.close()
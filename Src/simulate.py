@@ -0,0 +1,199 @@
+"""Simulated images with many Gaussian sources for testing the detector at scale.
+
+Every source A*exp(-((x-X)^2+(y-Y)^2)/(2R^2)) is separable in x and y, so it is rendered as the outer
+product of two 1D profiles inside a stamp reaching k*R from its centre, and added to the image by slicing.
+The cost of a source depends on its stamp, not on the size of the frame. Large frames are rendered in
+strips of rows, each with only the sources whose stamp overlaps the strip, and streamed to a FITS file
+(or a memory-mapped .npy file), so the whole frame never has to be in memory. The ground-truth catalog
+is written next to the image.
+
+"""
+
+import os
+import sys
+import numpy as np
+from images import FITS_EXTENSIONS
+
+
+def random_sources(limits, number_of_sources, seed=None):
+
+    """
+    Returns sources with parameters drawn uniformly within limits.
+
+    Parameters
+    ----------
+    limits : 2Darray
+        prior limits [[X_l, X_u], [Y_l, Y_u], [A_l, A_u], [R_l, R_u]]
+    number_of_sources : int
+        Number of sources
+    seed : int
+        Seed of the draw, independent of the global random state. None draws from the global state.
+
+    Returns
+    -------
+    src_array : 2Darray
+        Array of shape (number_of_sources, 4) with the columns X, Y, A, R
+
+    """
+
+    state = np.random if seed is None else np.random.RandomState(seed)
+    limits = np.asarray(limits, dtype=float)
+    return state.uniform(limits[:,0], limits[:,1], size=(number_of_sources, 4))
+
+
+def add_sources(z, src_array, row=0, k=5.0):
+
+    """
+    Adds sources to an image, or to a strip of rows of an image, inside their k*R stamps.
+
+    Parameters
+    ----------
+    z : 2Darray
+        The image or strip, modified in place
+    src_array : 2Darray
+        Sources with the columns X, Y, A, R in the coordinates of the full image
+    row : int
+        Row of the full image where z starts
+    k : float
+        Half side of the stamps in units of R
+
+    Returns
+    -------
+    z : 2Darray
+        The image or strip
+
+    """
+
+    height, width = z.shape
+    for X, Y, A, R in src_array:
+        x_l, x_u = max(int(np.floor(X - k*R)), 0), min(int(np.ceil(X + k*R)) + 1, width)
+        y_l, y_u = max(int(np.floor(Y - k*R)), row), min(int(np.ceil(Y + k*R)) + 1, row + height)
+        if x_l >= x_u or y_l >= y_u:
+            continue
+        gx = np.exp(-(np.arange(x_l, x_u) - X)**2/(2*R**2))
+        gy = A*np.exp(-(np.arange(y_l, y_u) - Y)**2/(2*R**2))
+        z[y_l - row:y_u - row, x_l:x_u] += np.outer(gy, gx)
+    return z
+
+
+def render_sources(src_array, height, width, k=5.0):
+
+    """
+    Returns the image of sources in memory.
+
+    Parameters
+    ----------
+    src_array : 2Darray
+        Sources with the columns X, Y, A, R
+    height : int
+        height of the image
+    width : int
+        width of the image
+    k : float
+        Half side of the stamps in units of R
+
+    Returns
+    -------
+    z : 2Darray
+        Source image in numpy format
+
+    """
+
+    return add_sources(np.zeros((height, width), float), np.asarray(src_array, dtype=float), k=k)
+
+
+def write_simulation(out, src_array, height, width, noise=0.0, k=5.0, strip=512, seed=None, dtype=np.float32):
+
+    """
+    Renders sources with gaussian noise strip by strip into a FITS or .npy file and writes the ground-truth
+    catalog to <out without extension>_truth.dat.
+
+    Parameters
+    ----------
+    out : str
+        Location of the image. FITS files are streamed, other files are written as memory-mapped .npy
+    src_array : 2Darray
+        Sources with the columns X, Y, A, R
+    height : int
+        height of the image
+    width : int
+        width of the image
+    noise : float
+        RMS of the additive gaussian noise
+    k : float
+        Half side of the stamps in units of R
+    strip : int
+        Number of rows rendered at a time
+    seed : int
+        Seed of the noise
+    dtype : type
+        Data type of the image
+
+    Returns
+    -------
+    truth : str
+        Location of the ground-truth catalog
+
+    """
+
+    from astropy.io import fits
+    from astropy.io import ascii
+    src_array = np.asarray(src_array, dtype=float).reshape(-1, 4)
+    state = np.random.RandomState(seed)
+    dtype = np.dtype(dtype)
+
+    #Sources sorted by the first row of their stamp, so the sources of a strip are found by bisection
+    first_row = src_array[:,1] - k*src_array[:,3]
+    order = np.argsort(first_row)
+    src_sorted = src_array[order]
+    first_row = first_row[order]
+    last_row = src_sorted[:,1] + k*src_sorted[:,3]
+    max_extent = np.max(2*k*src_sorted[:,3]) if len(src_sorted) > 0 else 0.0
+
+    if out.lower().endswith(FITS_EXTENSIONS):
+        header = fits.Header()
+        header['SIMPLE'] = True
+        header['BITPIX'] = {4:-32, 8:-64}[dtype.itemsize]
+        header['NAXIS'] = 2
+        header['NAXIS1'] = width
+        header['NAXIS2'] = height
+        stream = fits.StreamingHDU(out, header)
+        image = None
+    else:
+        stream = None
+        image = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=(height, width))
+
+    for row in range(0, height, strip):
+        rows = min(strip, height - row)
+        candidates = slice(np.searchsorted(first_row, row - max_extent), np.searchsorted(first_row, row + rows))
+        overlapping = src_sorted[candidates]
+        overlapping = overlapping[last_row[candidates] >= row]
+        z = add_sources(np.zeros((rows, width), float), overlapping, row = row, k = k)
+        if noise > 0:
+            z += state.normal(0.0, noise, size=z.shape)
+        if stream is not None:
+            stream.write(z.astype(dtype))
+        else:
+            image[row:row + rows] = z
+
+    if stream is not None:
+        stream.close()
+    else:
+        del image
+
+    truth = os.path.splitext(out)[0]+'_truth.dat'
+    ascii.write([src_array[:,i] for i in range(4)], truth, names=['X', 'Y', 'A', 'R'], format='basic', overwrite=True)
+    return truth
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 5:
+        print "Usage: python simulate.py <image.fits or image.npy> <height> <width> <number of sources> [noise] [seed]"
+        sys.exit(1)
+
+    height, width, number = int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+    noise = float(sys.argv[5]) if len(sys.argv) > 5 else 2.0
+    seed = int(sys.argv[6]) if len(sys.argv) > 6 else 0
+    src_array = random_sources([[0.0, width], [0.0, height], [1.0, 12.5], [2.0, 9.0]], number, seed = seed)
+    print write_simulation(sys.argv[1], src_array, height, width, noise = noise, seed = seed)
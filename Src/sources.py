@@ -2,36 +2,41 @@
 # Author : Krishna Chaitanya Chavati
 # Email  : chaithukrishnazz2@gmail.com
 
+# Only numpy is imported here. Plotting, clustering and the KD-tree of the surrogate import matplotlib,
+# sklearn and scipy where they are first used, so worker processes which only sample start quickly.
+
 import sys
 import numpy as np
-from matplotlib import pyplot as plt
-from astropy.io import fits
-from astropy.io import ascii
 from math import *
 import random
-from plot import *
+from images import read_image
+from catalog import write_samples, write_catalog, extract_catalog
+from cache import ResultCache, image_digest, run_key
+from memo import LikelihoodMemo, shared_memo
+from background import background_problem
+from posterior import equal_weight_samples
+from profiling import Profiler, NULL_PROFILER
+from telemetry import Telemetry, console
 import time
 import pickle
 import copy
 import warnings
-from scipy.cluster.vq import kmeans2
-from sklearn.cluster import DBSCAN
+from collections import deque
 import os
 
 Config = {}
 
 config_found = 1
 
-data_map = None
-
 try:
-    ConfigFile = open(os.path.dirname(os.path.realpath(__file__))+"\config.cfg", "r")
-except IndexError:
+    ConfigFile = open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.cfg"), "r")
+except IOError:
     print "Can't find the config file"
     config_found = 0
 
 if config_found==1:
     Lines = ConfigFile.readlines()
+    ConfigFile.close()
 
     for line in Lines:
         if line[0]=='#' or line[0]=='\n':
@@ -42,43 +47,8 @@ if config_found==1:
             except IndexError:
                 pass
 
-         
-    File = (Config['IMAGE_PATH'])
-
-    if File[-5:] == '.fits':
-        hdulist   = fits.open(File)
-        data_map   = (hdulist[0].data)
-
-    if File[-5:] != '.fits':
-        s = open(File,'r')
-        data_map = pickle.load(s)
-        s.close()
-
 if config_found==0:
-    
-    File = "../assets/simulated_images/multinest_toy_noised"
-
-    if File[-5:] == '.fits':
-        hdulist   = fits.open(File)
-        data_map   = (hdulist[0].data)
-
-    if File[-5:] != '.fits':
-        s = open(File,'r')
-        data_map = pickle.load(s)
-        s.close()
-
-
-height, width = len(data_map), len(data_map[0])
-no_pixels = width*height
-
-#Converting the data_map into a vector for likelihood calculations
-data_map = data_map.flatten()
-
-
-#Useful in likelihood evaluation for calculating the simulated object as the function of indices
-x_forcalc = np.arange(0, width)
-y_forcalc = np.arange(0, height)
-xx, yy = np.meshgrid(x_forcalc, y_forcalc, sparse=True)
+    Config['IMAGE_PATH'] = "../assets/simulated_images/multinest_toy_noised"
 
 
 class Source:
@@ -111,31 +81,573 @@ class Source:
         self.logWt = None
 
 
-def log_likelihood(Source):
+#---------------------------------------------------------------------------------------------------------------
+#                                     DETECTION PROBLEM
+#---------------------------------------------------------------------------------------------------------------
+
+
+class DetectionProblem(object):
+
+    """
+    The source detection problem for a single image. Owns the image, the noise, the priors and the data
+    precomputed for the likelihood, and is passed explicitly to the Nested_Sampler and its samplers so that
+    one process can hold several images.
+
+    The image is read lazily on first use, so creating a problem (or importing this module in a worker
+    process) does not pay for loading the image.
+
+    Without a weight map or a mask every pixel has the noise of the problem. With either of them the pixels
+    which are masked, have zero weight or are not finite are dropped, and only the coordinates, weights and
+    weighted data of the remaining pixels are kept. The sum of the weighted squared data and the
+    normalisation are computed once, and the model is evaluated from its separable x and y profiles at the
+    kept pixels only, so masked regions cost nothing.
+
+    Attributes
+    ----------
+    image_path : str
+        Location of the image, None if the image was given as data
+    noise : float
+        RMS noise of the image
+    prior : array
+        Prior bounds [[X_l, X_u], [Y_l, Y_u], [A_l, A_u], [R_l, R_u]]. X and Y default to the image extent.
+    weight_path : str
+        Location of the weight map, None if not read from a file
+    mask_path : str
+        Location of the mask, None if not read from a file
+    variance : bool
+        True if the weight map holds variances instead of inverse variances
+    weighted : bool
+        True if the likelihood uses the kept pixels of a weight map or a mask
+    surrogate : object
+        Surrogate used to pre-screen likelihood evaluations, None if disabled
+    profiler : object
+        Profiler timing the likelihood evaluations, see profiling. NULL_PROFILER when not profiling
+    memo : object
+        LikelihoodMemo remembering recent log likelihoods, None if disabled
+    data_map : array
+        The flattened image
+    height : int
+        Height of the image
+    width : int
+        Width of the image
+    no_pixels : int
+        Number of pixels
+    xx, yy : array
+        Sparse pixel coordinate grids used to evaluate the source model
+    K : float
+        Normalisation of the log likelihood
+    pixel_x, pixel_y : array
+        Coordinates of the kept pixels of a weighted problem
+    pixel_weight : array
+        Inverse variances of the kept pixels
+    weighted_data : array
+        Inverse variance times data of the kept pixels
+    weighted_square : float
+        Sum of inverse variance times squared data over the kept pixels
 
     """
-    Returns the log likelihood of the source object.
+
+    def __init__(self, image_path=None, data=None, noise=1.0, prior=None, weight_path=None, weight=None,
+                 mask_path=None, mask=None, variance=False):
+
+        """
+        Initializes the problem. Either image_path or data has to be given.
+
+        Parameters
+        ----------
+        image_path : str
+            Location of the image (FITS, .npy or a legacy pickle), memory-mapped on first use
+        data : array
+            The image in numpy format
+        noise : float
+            RMS noise of the image
+        prior : array
+            Prior bounds [[X_l, X_u], [Y_l, Y_u], [A_l, A_u], [R_l, R_u]]. X and Y bounds may be None
+            to use the image extent.
+        weight_path : str
+            Location of the per-pixel inverse variance (or variance) map, read with the image
+        weight : array
+            The inverse variance (or variance) map in numpy format
+        mask_path : str
+            Location of the mask, read with the image. Nonzero pixels are ignored.
+        mask : array
+            The mask in numpy format, True for pixels to ignore
+        variance : bool
+            The weight map holds variances instead of inverse variances
+
+        """
+
+        self.image_path = image_path
+        self.weight_path = weight_path
+        self.mask_path = mask_path
+        self.variance = variance
+        self.weight = weight
+        self.mask = mask
+        self.weighted = False
+        self.noise = noise
+        self.prior = [[None, None], [None, None], [1.0, 12.5], [2.0, 9.0]] if prior is None else [list(i) for i in prior]
+        self.surrogate = None
+        self.profiler = NULL_PROFILER
+        self.memo = None
+        self.data_map = None
+        self.height = None
+        self.width = None
+        self.no_pixels = None
+        self.xx = None
+        self.yy = None
+        self.K = None
+        self.pixel_x = None
+        self.pixel_y = None
+        self.pixel_weight = None
+        self.weighted_data = None
+        self.weighted_square = None
+        if data is not None:
+            self.set_data(data, weight, mask)
+
+
+    def load(self):
+
+        """
+        Reads the image if it has not been read yet.
+
+        Returns
+        -------
+        problem : object
+            The problem itself
+
+        """
+
+        if self.data_map is None:
+            weight = self.weight
+            if weight is None and self.weight_path is not None:
+                weight = read_image(self.weight_path)
+            mask = self.mask
+            if mask is None and self.mask_path is not None:
+                mask = read_image(self.mask_path)
+            self.set_data(read_image(self.image_path), weight, mask)
+        return self
+
+
+    def set_data(self, data, weight=None, mask=None):
+
+        """
+        Sets the image and precomputes the pixel grids and the likelihood normalisation.
+
+        Parameters
+        ----------
+        data : array
+            The image in numpy format
+        weight : array
+            Inverse variance of every pixel, or its variance if the problem was created with variance=True.
+            None gives every pixel the noise of the problem.
+        mask : array
+            Nonzero for the pixels to ignore
+
+        """
+
+        self.height, self.width = len(data), len(data[0])
+        self.no_pixels = self.width*self.height
+
+        #Converting the data_map into a vector for likelihood calculations. ravel keeps a view of
+        #memory-mapped images instead of copying them
+        data = np.asarray(data)
+        if data.dtype.kind not in 'fc':
+            data = data.astype(float)
+        self.data_map = data.ravel()
+
+        #Useful in likelihood evaluation for calculating the simulated object as the function of indices
+        self.xx, self.yy = np.meshgrid(np.arange(0, self.width), np.arange(0, self.height), sparse=True)
+        #Gaussian normalisation N/2 log(2 pi sigma^2), the same as that of the weighted likelihood with a
+        #uniform weight, so that log evidences are comparable between weighted and unweighted runs
+        self.K = 0.5*self.no_pixels*np.log(2*np.pi*self.noise**2)
+
+        self.weighted = weight is not None or mask is not None
+        if self.weighted:
+            self.set_weights(weight, mask)
+
+
+    def set_weights(self, weight, mask):
+
+        """
+        Keeps the valid pixels of a weighted or masked image and precomputes their weighted statistics.
+
+        Parameters
+        ----------
+        weight : array
+            Inverse variance (or variance) of every pixel, None for the noise of the problem
+        mask : array
+            Nonzero for the pixels to ignore, None to keep every pixel
+
+        """
+
+        if weight is None:
+            weight = np.ones(self.no_pixels)/self.noise**2
+        else:
+            weight = np.asarray(weight, dtype=float).ravel()
+            if self.variance:
+                with np.errstate(divide='ignore'):
+                    weight = 1.0/weight
+        valid = np.isfinite(self.data_map) & np.isfinite(weight) & (weight > 0)
+        if mask is not None:
+            valid &= np.asarray(mask).ravel() == 0
+        pixels = np.flatnonzero(valid)
+
+        self.pixel_x = pixels % self.width
+        self.pixel_y = pixels // self.width
+        self.pixel_weight = weight[pixels]
+        data = np.asarray(self.data_map[pixels], dtype=float)
+        self.weighted_data = self.pixel_weight*data
+        self.weighted_square = np.dot(self.weighted_data, data)
+        self.K = 0.5*(len(pixels)*np.log(2*np.pi) - np.sum(np.log(self.pixel_weight)))
+
+
+    def profiles(self, Source):
+
+        """
+        Returns the model of a source at the kept pixels of a weighted problem, the outer product of its
+        x and y profiles gathered at the pixel coordinates.
+
+        """
+
+        gx = np.exp(-(np.arange(self.width) - Source.X)**2/(2*(Source.R**2)))
+        gy = Source.A*np.exp(-(np.arange(self.height) - Source.Y)**2/(2*(Source.R**2)))
+        return gy[self.pixel_y]*gx[self.pixel_x]
+
+
+    def log_likelihood(self, Source):
+
+        """
+        Returns the log likelihood of the source object, from the memo if it is enabled and remembers the
+        source.
+
+        Parameters
+        ----------
+        Source : object
+            A source object.
+
+        Returns
+        -------
+        log likelihood : float
+            log likelihood of the input object.
+
+        Raises
+        ------
+            TypeError : When we pass an object with any of X, Y, A, R attributes as None type
+
+        """           
+
+        if self.memo is not None:
+            key = self.memo.key(Source)
+            logL = self.memo.get(key)
+            if logL is not None:
+                return logL
+        if self.data_map is None:
+            self.load()
+        with self.profiler.phase("likelihood"):
+            if self.weighted:
+                model = self.profiles(Source)
+                logL = -0.5*(self.weighted_square - 2*np.dot(self.weighted_data, model)
+                             + np.dot(self.pixel_weight, model*model)) - self.K
+            else:
+                simulated_map = Source.A*np.exp(-1*((self.xx-Source.X)**2+(self.yy-Source.Y)**2)/(2*(Source.R**2)))
+                diff_map = self.data_map - simulated_map.flatten()
+                logL = -0.5*np.dot(diff_map, np.transpose((1/(self.noise**2))*diff_map)) - self.K    
+        if self.memo is not None:
+            self.memo.put(key, logL)
+        return logL
+
+
+    def null_log_likelihood(self):
+
+        """
+        Returns the log likelihood of the image without any source, the baseline a detection has to beat.
+
+        Returns
+        -------
+        log likelihood : float
+            log likelihood of a source of zero amplitude
+
+        """
+
+        empty = Source()
+        empty.X, empty.Y, empty.A, empty.R = 0.0, 0.0, 0.0, 1.0
+        return self.log_likelihood(empty)
+
+
+    def log_likelihood_gradient(self, Source):
+
+        """
+        Returns the log likelihood of the source object together with its gradient with respect to
+        X, Y, A and R. Both are computed in one pass from the same Gaussian kernel.
+
+        Parameters
+        ----------
+        Source : object
+            A source object.
+
+        Returns
+        -------
+        log likelihood : float
+            log likelihood of the input object.
+        gradient : array
+            Derivatives of the log likelihood with respect to [X, Y, A, R]
+
+        """
+
+        if self.data_map is None:
+            self.load()
+        with self.profiler.phase("likelihood_gradient"):
+            if self.weighted:
+                dx = self.pixel_x - Source.X
+                dy = self.pixel_y - Source.Y
+                r2 = dx**2 + dy**2
+                model = self.profiles(Source)
+                residual = (self.weighted_data - self.pixel_weight*model)*model
+                logL = -0.5*(self.weighted_square - 2*np.dot(self.weighted_data, model)
+                             + np.dot(self.pixel_weight, model*model)) - self.K
+                gradient = np.array([np.dot(residual, dx)/(Source.R**2),
+                                     np.dot(residual, dy)/(Source.R**2),
+                                     np.sum(residual)/Source.A,
+                                     np.dot(residual, r2)/(Source.R**3)])
+                return logL, gradient
+            dx = self.xx - Source.X
+            dy = self.yy - Source.Y
+            r2 = dx**2 + dy**2
+            simulated_map = Source.A*np.exp(-1*r2/(2*(Source.R**2)))
+            diff_map = self.data_map - simulated_map.flatten()
+            residual = diff_map.reshape(simulated_map.shape)*simulated_map/(self.noise**2)
+            logL = -0.5*np.dot(diff_map, np.transpose((1/(self.noise**2))*diff_map)) - self.K
+            gradient = np.array([np.sum(residual*dx)/(Source.R**2),
+                                 np.sum(residual*dy)/(Source.R**2),
+                                 np.sum(residual)/Source.A,
+                                 np.sum(residual*r2)/(Source.R**3)])
+            return logL, gradient
+
+
+    def screened_log_likelihood(self, Source, LC):
+
+        """
+        Returns the log likelihood of the source object, or the surrogate prediction if the surrogate
+        is enabled and confident that the source lies below the likelihood constraint.
+
+        Parameters
+        ----------
+        Source : object
+            A source object.
+        LC : float
+            likelihood constraint
+
+        Returns
+        -------
+        log likelihood : float
+            log likelihood of the input object, or its predicted value if it was not evaluated.
+        exact : bool
+            True if the log likelihood was evaluated exactly
+
+        """
+
+        if self.surrogate is None:
+            return self.log_likelihood(Source), True
+        with self.profiler.phase("surrogate"):
+            return self.surrogate.evaluate(Source, LC)
+
+
+    def sample_source(self):
+        
+        """
+        Sampling the object from prior distribution.
+
+        Returns
+        -------
+        src : object
+            The source object with X,Y,A,R sampled from their prior distribution and log likelihood calculated.
+
+        """
+
+        x_l, x_u = self.getPrior_X()
+        y_l, y_u = self.getPrior_Y()
+        a_l, a_u = self.getPrior_A()
+        r_l, r_u = self.getPrior_R()
+        src = Source()
+        src.X = random.uniform(x_l, x_u)
+        src.Y = random.uniform(y_l, y_u) 
+        src.A = random.uniform(a_l, a_u)
+        src.R = random.uniform(r_l, r_u)
+        src.logL = self.log_likelihood(src)
+        return src
+
+
+    def get_sources(self, no_active_points):
+
+        """
+        Returns an array of source objects sampled from their prior distribution.
+
+        Parameters
+        ----------
+        no_active_points : int
+            The number of source objects to be returned
+
+        Returns
+        -------
+        src_array : array
+            An array of objects with size equal to no_active_points.
+
+        """
+
+        src_array = []
+        
+        for i in range(no_active_points):
+            src_array.append(self.sample_source())
+        
+        return src_array
+
+
+    def getPrior_A(self):
+
+        """
+        Returns
+        -------
+        bounds : tuple
+            a tuple of the amplitude bounds.
+
+        """
+
+        return tuple(self.prior[2])
+
+
+    def getPrior_R(self):
+
+        """
+        Returns
+        -------
+        bounds : tuple
+            a tuple of the R bounds.
+
+        """
+
+        return tuple(self.prior[3])
+
+
+    def getPrior_X(self):
+
+        """
+        Returns
+        -------
+        bounds : tuple
+            a tuple of the X bounds.
+
+        """
+
+        x_l, x_u = self.prior[0]
+        if x_l is None or x_u is None:
+            self.load()
+        return (0.0 if x_l is None else x_l), (float(self.width) if x_u is None else x_u)
+
+
+    def getPrior_Y(self):
+
+        """
+        Returns
+        -------
+        bounds : tuple
+            a tuple of the Y bounds.
+
+        """
+
+        y_l, y_u = self.prior[1]
+        if y_l is None or y_u is None:
+            self.load()
+        return (0.0 if y_l is None else y_l), (float(self.height) if y_u is None else y_u)
+
+
+def problem_from_config(config, noise=None, prior=None):
+
+    """
+    Returns a DetectionProblem for the image, weight map, mask and settings of a config dict. The image is
+    not read.
 
     Parameters
     ----------
-    Source : object
-        A source object.
+    config : dict
+        Settings read from config.cfg
+    noise : float
+        RMS noise overriding NOISE of the config
+    prior : array
+        Prior bounds overriding the *_PRIOR_* settings of the config
 
     Returns
     -------
-    log likelihood : float
-        log likelihood of the input object.
+    problem : object
+        The detection problem
+
+    """
+
+    if noise is None:
+        noise = float(config.get('NOISE', 1.0))
+    if prior is None:
+        prior = [[None, None], [None, None], [1.0, 12.5], [2.0, 9.0]]
+        for i, name in enumerate(['X', 'Y', 'A', 'R']):
+            for j, bound in enumerate(['LOWER', 'UPPER']):
+                key = name+'_PRIOR_'+bound
+                if key in config:
+                    prior[i][j] = float(config[key])
+    weight_path = str(config.get('WEIGHT_PATH', 'none'))
+    mask_path = str(config.get('MASK_PATH', 'none'))
+    return DetectionProblem(image_path = config['IMAGE_PATH'], noise = noise, prior = prior,
+                            weight_path = None if weight_path == 'none' else weight_path,
+                            mask_path = None if mask_path == 'none' else mask_path,
+                            variance = str(config.get('WEIGHT_TYPE', 'weight')) == 'variance')
+
 
-    Raises
-    ------
-        TypeError : When we pass an object with any of X, Y, A, R attributes as None type
+#The problem used by the module level functions below, built from config.cfg on first use
+problem = None
+
+
+def default_problem():
+
+    """
+    Returns the module level problem, building it from config.cfg on first use.
+
+    """
+
+    global problem
+    if problem is None:
+        problem = problem_from_config(Config)
+    return problem
+
+
+def log_likelihood(Source):
+
+    """
+    Returns the log likelihood of the source object for the default problem.
+    See DetectionProblem.log_likelihood
 
     """           
 
-    simulated_map = Source.A*np.exp(-1*((xx-Source.X)**2+(yy-Source.Y)**2)/(2*(Source.R**2)))
-    diff_map = data_map - simulated_map.flatten()
-    return -0.5*np.dot(diff_map, np.transpose((1/(noise**2))*diff_map)) - K    
-    
+    return default_problem().log_likelihood(Source)
+
+
+def log_likelihood_gradient(Source):
+
+    """
+    Returns the log likelihood of the source object and its gradient for the default problem.
+    See DetectionProblem.log_likelihood_gradient
+
+    """
+
+    return default_problem().log_likelihood_gradient(Source)
+
+
+def screened_log_likelihood(Source, LC):
+
+    """
+    Returns the log likelihood of the source object or its surrogate prediction for the default problem.
+    See DetectionProblem.screened_log_likelihood
+
+    """
+
+    return default_problem().screened_log_likelihood(Source, LC)
+
 
 def proposed_model(x, y, X, Y, A, R):
 
@@ -168,7 +680,7 @@ def proposed_model(x, y, X, Y, A, R):
 def sample_source():
     
     """
-    Sampling the object from prior distribution.
+    Sampling the object from prior distribution of the default problem.
 
     Returns
     -------
@@ -178,19 +690,13 @@ def sample_source():
     
     """
 
-    src = Source()
-    src.X = random.uniform(0.0, x_upper)
-    src.Y = random.uniform(0.0, y_upper) 
-    src.A = random.uniform(amplitude_lower, amplitude_upper)
-    src.R = random.uniform(R_lower, R_upper)
-    src.logL = log_likelihood(src)
-    return src
+    return default_problem().sample_source()
 
 
 def get_sources(no_active_points):
 
     """
-    Returns an array of source objects sampled from their prior distribution.
+    Returns an array of source objects sampled from the prior distribution of the default problem.
 
     Parameters
     ----------
@@ -204,12 +710,7 @@ def get_sources(no_active_points):
 
     """
 
-    src_array = []
-    
-    for i in range(no_active_points):
-        src_array.append(sample_source())
-    
-    return src_array
+    return default_problem().get_sources(no_active_points)
 
 
 def getPrior_A():
@@ -218,12 +719,11 @@ def getPrior_A():
     Returns
     -------
     bounds : tuple
-        a tuple of the amplitude bounds.
+        a tuple of the amplitude bounds of the default problem.
 
     """
 
-    bounds = amplitude_lower, amplitude_upper;
-    return bounds
+    return default_problem().getPrior_A()
 
 
 def getPrior_R():
@@ -232,12 +732,11 @@ def getPrior_R():
     Returns
     -------
     bounds : tuple
-        a tuple of the R bounds.
+        a tuple of the R bounds of the default problem.
 
     """
 
-    bounds = R_lower, R_upper; 
-    return bounds
+    return default_problem().getPrior_R()
 
 
 def getPrior_X():
@@ -246,12 +745,11 @@ def getPrior_X():
     Returns
     -------
     bounds : tuple
-        a tuple of the X bounds.
+        a tuple of the X bounds of the default problem.
 
     """
 
-    bounds = 0.0, width;
-    return bounds
+    return default_problem().getPrior_X()
 
 
 def getPrior_Y():
@@ -260,54 +758,450 @@ def getPrior_Y():
     Returns
     -------
     bounds : tuple
-        a tuple of the Y bounds.
+        a tuple of the Y bounds of the default problem.
+
+    """
+    
+    return default_problem().getPrior_Y()
+
+
+def write(data, out):
+
+    """ 
+    Writes an array to a pickle
+    
+    Parameters
+    ----------
+    data : array
+        Array to be stored      
+    out : str
+        The location to be stored at
+
+    """
+    
+    f = open(out,'w+b')
+    pickle.dump(data, f)
+    f.close()
+
+
+def read(filename):
+
+    """
+    Reads an array from a pickle and returns it.
+
+    Parameters
+    ----------
+    filename : str
+        location of the pickle
+
+    Returns
+    -------
+    data : array
+        Pickle data
+
+    """
+
+    f = open(filename)
+    data = pickle.load(f)
+    f.close()
+    return data
+
+#---------------------------------------------------------------------------------------------------------------
+#                                     SURROGATE PRE-SCREENING
+#---------------------------------------------------------------------------------------------------------------
+
+
+class Surrogate(object):
+
+    """
+    An archive of all exact likelihood evaluations, indexed by a KD-tree over (X, Y, A, R) scaled to the
+    unit hypercube of the prior, used to predict the log likelihood of a candidate before evaluating it.
+
+    The prediction is the inverse distance weighted mean of the nearest archived evaluations and its
+    uncertainty is their spread. Candidates whose prediction plus margin times the spread lies below
+    the likelihood constraint are skipped. A fraction of the skipped candidates is audited with an exact
+    evaluation; the margin grows whenever the audited false reject rate exceeds the bound and shrinks
+    slowly while it stays well below it.
+
+    Attributes
+    ----------
+    problem : object
+        The DetectionProblem whose likelihood evaluations are archived
+    neighbours : int
+        Number of nearest archived evaluations used in the prediction
+    max_false_reject : float
+        Bound on the fraction of skipped candidates which would have satisfied the constraint
+    audit : float
+        Fraction of skipped candidates evaluated exactly to measure the false reject rate
+    rebuild : int
+        Number of new evaluations after which the KD-tree is rebuilt
+    margin : float
+        Number of neighbour spreads a prediction must lie below the constraint to be skipped
+    points : list
+        Archived parameters in the unit hypercube
+    values : list
+        Archived log likelihoods
+    tree : object
+        KD-tree over the first tree_size archived points
+    tree_values : array
+        Log likelihoods of the points in the KD-tree
+    recent : deque
+        Outcomes of the recent audits, True for a false reject
+    stats : dict
+        Counts of candidates, skipped candidates, audits and false rejects
+
+    """
+
+    def __init__(self, problem, neighbours=8, max_false_reject=0.01, audit=0.1, rebuild=500):
+
+        """
+        Initializes the surrogate.
+
+        Parameters
+        ----------
+        problem : object
+            The DetectionProblem whose likelihood evaluations are archived
+        neighbours : int
+            Number of nearest archived evaluations used in the prediction
+        max_false_reject : float
+            Bound on the false reject rate
+        audit : float
+            Fraction of skipped candidates evaluated exactly
+        rebuild : int
+            Number of new evaluations after which the KD-tree is rebuilt
+
+        """
+
+        self.problem = problem
+        self.neighbours = neighbours
+        self.max_false_reject = max_false_reject
+        self.audit = audit
+        self.rebuild = rebuild
+        self.margin = 3.0
+        self.points = []
+        self.values = []
+        self.tree = None
+        self.tree_values = None
+        self.tree_size = 0
+        self.recent = deque(maxlen=200)
+        self.stats = {"candidates":0, "skipped":0, "audited":0, "false_rejects":0}
+        self.lower = None
+        self.span = None
+
+
+    def unit(self, Source):
+
+        """
+        Returns the parameters of a source scaled to the unit hypercube of the prior.
+
+        """
+
+        if self.lower is None:
+            bounds = np.array([self.problem.getPrior_X(), self.problem.getPrior_Y(), self.problem.getPrior_A(), self.problem.getPrior_R()], dtype=float)
+            self.lower = bounds[:,0]
+            self.span = bounds[:,1] - bounds[:,0]
+        return (np.array([Source.X, Source.Y, Source.A, Source.R], dtype=float) - self.lower)/self.span
+
+
+    def add(self, Source):
+
+        """
+        Archives an exact evaluation and rebuilds the KD-tree when enough new ones have accumulated.
+
+        Parameters
+        ----------
+        Source : object
+            A source object with its exact log likelihood
+
+        """
+
+        self.points.append(self.unit(Source))
+        self.values.append(Source.logL)
+        if len(self.points) - self.tree_size >= self.rebuild or self.tree is None and len(self.points) >= self.neighbours:
+            from scipy.spatial import cKDTree
+            self.tree = cKDTree(np.array(self.points))
+            self.tree_values = np.array(self.values)
+            self.tree_size = len(self.points)
+
+
+    def predict(self, Source):
+
+        """
+        Predicts the log likelihood of a source from its nearest archived evaluations.
+
+        Returns
+        -------
+        prediction : float
+            Inverse distance weighted mean of the neighbouring log likelihoods, None if the archive is too small
+        spread : float
+            Standard deviation of the neighbouring log likelihoods
+
+        """
+
+        if self.tree is None:
+            return None, None
+        distance, index = self.tree.query(self.unit(Source), k=self.neighbours)
+        values = self.tree_values[index]
+        weights = 1.0/np.maximum(distance, 1e-12)
+        return np.sum(weights*values)/np.sum(weights), np.std(values)
+
+
+    def evaluate(self, Source, LC):
+
+        """
+        Returns the exact log likelihood of a source, or its prediction if the source is confidently
+        below the likelihood constraint.
+
+        Parameters
+        ----------
+        Source : object
+            A source object
+        LC : float
+            likelihood constraint
+
+        Returns
+        -------
+        log likelihood : float
+            The exact or predicted log likelihood
+        exact : bool
+            True if the log likelihood was evaluated exactly
+
+        """
+
+        self.stats["candidates"] += 1
+        prediction, spread = self.predict(Source)
+        if prediction is None or prediction + self.margin*spread >= LC:
+            Source.logL = self.problem.log_likelihood(Source)
+            self.add(Source)
+            return Source.logL, True
+
+        if np.random.uniform(0, 1) >= self.audit:
+            self.stats["skipped"] += 1
+            return prediction, False
+
+        #Audit the skip decision with an exact evaluation
+        Source.logL = self.problem.log_likelihood(Source)
+        self.add(Source)
+        false_reject = Source.logL > LC
+        self.stats["audited"] += 1
+        self.stats["false_rejects"] += int(false_reject)
+        self.recent.append(false_reject)
+        rate = sum(self.recent)/float(len(self.recent))
+        if rate > self.max_false_reject:
+            self.margin *= 1.2
+        elif rate < 0.5*self.max_false_reject:
+            self.margin = max(0.5, self.margin/1.01)
+        return Source.logL, True
+
+
+    def statistics(self):
+
+        """
+        Returns the counts together with the skip rate and the audited false reject rate.
+
+        """
+
+        stats = dict(self.stats)
+        stats["skip_rate"] = stats["skipped"]/float(max(stats["candidates"], 1))
+        stats["false_reject_rate"] = stats["false_rejects"]/float(max(stats["audited"], 1))
+        stats["margin"] = self.margin
+        return stats
+
+
+#---------------------------------------------------------------------------------------------------------------
+#                                     IMPORTANCE NESTED SAMPLING EVIDENCE
+#---------------------------------------------------------------------------------------------------------------
+
+
+class Importance_Evidence(object):
+
+    """
+    Implementation of the importance nested sampling (INS) evidence estimator proposed by Feroz et al.(2013).
+    Every evaluated point is recorded together with the proposal it was drawn from, and the evidence is
+    the importance sampling estimate
+
+        Z = (1/N) sum_k L(k)/g(k),   g(k) = sum_i (n_i/N) q_i(k)
+
+    where q_i is the proposal density of stage i relative to the prior, n_i the number of points drawn in
+    that stage and N the total number of recorded points. A stage is either the prior itself or a union of
+    ellipsoids in (X, Y), from which one ellipsoid is picked uniformly and a point drawn uniformly inside
+    it; A and R are always drawn from the prior and cancel. The fraction of each ellipsoid inside the prior
+    is estimated by Monte Carlo, since points outside the prior are redrawn.
+
+    The clustered ellipsoidal sampler builds new ellipsoids for every replacement, which would make the
+    number of stages, and the cost of log_evidence, grow with the number of iterations. As long as the
+    ellipsoids of the current stage still enclose all points of the new ellipsoids with at most tolerance
+    more volume, the stage continues and the sampler draws from its ellipsoids instead of the new ones.
+
+    Attributes
+    ----------
+    problem : object
+        The DetectionProblem being sampled
+    stages : list
+        For every stage a list of (centroid, inverse covariance, volume relative to the prior times the
+        number of ellipsoids) of its ellipsoids, or None for the prior
+    counts : list
+        Number of points drawn in every stage
+    points : list
+        (X, Y) of every recorded point
+    logL : list
+        Log likelihood of every recorded point
+    tolerance : float
+        Largest fraction of volume by which the ellipsoids of the current stage may exceed a new set of
+        ellipsoids for the stage to continue
+    ellipsoids : array
+        The ellipsoids of the current stage, None for the prior
+
+    References
+    ----------
+    .. [1] Feroz F., Hobson M.P., Cameron E., Pettitt A.N., 2013, arXiv:1306.2144 (Importance nested sampling and the MultiNest algorithm)
+
+    """
+
+    def __init__(self, problem, tolerance=0.1):
+
+        """
+        Initializes the estimator without any stage.
+
+        Parameters
+        ----------
+        problem : object
+            The DetectionProblem being sampled
+        tolerance : float
+            Largest fraction of volume by which the current stage may exceed new ellipsoids and continue
+
+        """
+
+        self.problem = problem
+        self.stages = []
+        self.counts = []
+        self.points = []
+        self.logL = []
+        self.tolerance = tolerance
+        self.ellipsoids = None
+
+
+    def covers(self, ellipsoids):
+
+        """
+        Returns True if the ellipsoids of the current stage enclose all points of the new ellipsoids and
+        exceed their volume by at most the tolerance.
+
+        """
+
+        if self.ellipsoids is None or len(self.ellipsoids) == 0 or len(ellipsoids) == 0:
+            return False
+        points = np.concatenate([ellipsoid.clpoints for ellipsoid in ellipsoids])
+        inside = np.zeros(len(points), dtype=bool)
+        for ellipsoid in self.ellipsoids:
+            transformed = points - ellipsoid.centroid
+            inside |= np.sum(np.dot(transformed, ellipsoid.inv_cov_mat)*transformed, axis=1) <= 1.0
+        if not inside.all():
+            return False
+        with np.errstate(invalid='ignore'):
+            current = sum(ellipsoid.find_volume() for ellipsoid in self.ellipsoids)
+            return current <= (1.0 + self.tolerance)*sum(ellipsoid.find_volume() for ellipsoid in ellipsoids)
+
+
+    def new_stage(self, ellipsoids):
+
+        """
+        Starts a new stage unless the current stage covers the ellipsoids, see covers. Following points are
+        recorded as drawn from the ellipsoids returned.
+
+        Parameters
+        ----------
+        ellipsoids : array
+            The ellipsoids of the stage, None if the points are drawn from the prior
+
+        Returns
+        -------
+        ellipsoids : array
+            The ellipsoids to draw the following points from, those of the current stage if it continues
+
+        """
 
-    """
-    
-    bounds = 0.0, height;
-    return bounds
+        if ellipsoids is None:
+            self.ellipsoids = None
+            if len(self.stages) > 0 and self.stages[-1] is None:
+                return None
+            self.stages.append(None)
+            self.counts.append(0)
+            return None
+        if self.covers(ellipsoids):
+            return self.ellipsoids
+
+        x_l, x_u = self.problem.getPrior_X()
+        y_l, y_u = self.problem.getPrior_Y()
+        prior_volume = (x_u - x_l)*(y_u - y_l)
+        stage = []
+        for ellipsoid in ellipsoids:
+            #A degenerate ellipsoid has no volume to weight its points with, they get no weight
+            if not np.linalg.det(ellipsoid.covariance_matrix) > 0.0:
+                continue
+            values, vects = np.linalg.eig(ellipsoid.covariance_matrix)
+            scaled = np.dot(vects, np.diag(np.sqrt(np.absolute(values))))
+            randpt = np.random.randn(256, 2)
+            randpt *= (np.random.rand(256)**0.5/np.sqrt(np.sum(randpt**2, axis=1)))[:,np.newaxis]
+            trial = np.dot(randpt, scaled.T) + ellipsoid.centroid
+            inside = np.mean((trial[:,0] >= x_l) & (trial[:,0] <= x_u) & (trial[:,1] >= y_l) & (trial[:,1] <= y_u))
+            volume = ellipsoid.find_volume()*max(inside, 1.0/256)/prior_volume
+            if np.isfinite(volume) and volume > 0.0:
+                stage.append((ellipsoid.centroid, ellipsoid.inv_cov_mat, volume*len(ellipsoids)))
+        self.stages.append(stage)
+        self.counts.append(0)
+        self.ellipsoids = ellipsoids
+        return ellipsoids
 
 
-def write(data, out):
+    def record(self, Source):
 
-    """ 
-    Writes an array to a pickle
-    
-    Parameters
-    ----------
-    data : array
-        Array to be stored      
-    out : str
-        The location to be stored at
+        """
+        Records an evaluated point as drawn from the current stage.
 
-    """
-    
-    f = open(out,'w+b')
-    pickle.dump(data, f)
-    f.close()
+        Parameters
+        ----------
+        Source : object
+            A source object with its log likelihood
 
+        """
 
-def read(filename):
+        self.points.append([Source.X, Source.Y])
+        self.logL.append(Source.logL)
+        self.counts[-1] += 1
 
-    """
-    Reads an array from a pickle and returns it.
 
-    Parameters
-    ----------
-    filename : str
-        location of the pickle
+    def log_evidence(self):
 
-    Returns
-    -------
-    data : array
-        Pickle data
+        """
+        Returns the log evidence estimated from all recorded points.
 
-    """
+        Returns
+        -------
+        logZ : float
+            The importance nested sampling log evidence
+
+        """
+
+        points = np.array(self.points, dtype=float)
+        logL = np.array(self.logL, dtype=float)
+        total = float(len(logL))
+        density = np.zeros(len(logL))
+        for stage, count in zip(self.stages, self.counts):
+            if count == 0:
+                continue
+            if stage is None:
+                density += count/total
+                continue
+            q = np.zeros(len(logL))
+            for centroid, inv_cov, volume in stage:
+                transformed = points - centroid
+                inside = np.sum(np.dot(transformed, inv_cov)*transformed, axis=1) <= 1.0
+                q += inside/volume
+            density += q*count/total
+        valid = density > 0.0
+        return np.logaddexp.reduce(logL[valid] - np.log(density[valid])) - np.log(total)
 
-    f = open(filename)
-    data = pickle.load(f)
-    f.close()
-    return data
 
 #---------------------------------------------------------------------------------------------------------------
 #                                     MAIN NESTED SAMPLER CLASS
@@ -342,6 +1236,12 @@ class Nested_Sampler(object):
         Information for error estimation in evidence
     no_likelihood : int
         To keep track of number of likelihood evaluations made    
+    problem : object
+        The DetectionProblem being solved
+    profiler : object
+        Profiler timing the phases of the run, see profiling. NULL_PROFILER when not profiling
+    telemetry : object
+        Sink of the progress records of the run, see telemetry
 
 
     References 
@@ -355,7 +1255,10 @@ class Nested_Sampler(object):
 
     """
     
-    def __init__(self, no_active_samples, max_iter, sample = "metropolis", conv_thresh=0.1):
+    def __init__(self, no_active_samples, max_iter, sample = "metropolis", conv_thresh=0.1, window=50,
+                 refresh_shrinkage=0.2, refresh_acceptance=0.5, refresh_drift=0.5, refresh_max_cost=0.3,
+                 slice_steps=5, slice_directions="principal", importance=False,
+                 problem=None, dispersion=8.0, eps=10, minPts=10, profiler=None, telemetry=None):
 
         """
         Initializes the nested sampler.
@@ -372,9 +1275,50 @@ class Nested_Sampler(object):
             * "uniform" = Samples the points randomly from a uniform distribution.  
             * "metropolis" = Samples the points according to Metropolis principle.
             * "clustered_ellipsoidal" = Samples the points according to Clustered ellipsoidal method.
+            * "adaptive" = Switches between uniform, clustered ellipsoidal and metropolis sampling
+              depending on which one is currently the cheapest per accepted point.
+            * "slice" = Samples the points by slice sampling along random or principal directions.
+            * "galilean" = Samples the points by Galilean Monte Carlo, reflecting off the likelihood
+              constraint using the likelihood gradient.
             
         conv_thresh : float
             Stopping criterion based on the current evidence in an iteration.  
+        window : int
+            Number of recent replacements per sampler used to measure the cost in "adaptive" mode.
+        refresh_shrinkage : float
+            Measured shrinkage of the log volume occupied by the active samples inside the ellipsoids
+            since the last build after which the "new" sampler rebuilds its ellipsoids.
+        refresh_acceptance : float
+            The ellipsoids are rebuilt when the acceptance rate falls below this fraction of the
+            acceptance rate measured just after the last build.
+        refresh_drift : float
+            The ellipsoids are rebuilt when any ellipsoid has lost this fraction of the active
+            points it was built around.
+        refresh_max_cost : float
+            Maximum fraction of the wall time that may be spent rebuilding ellipsoids.
+        slice_steps : int
+            Number of one dimensional slice moves per replacement in "slice" mode.
+        slice_directions : str
+            "principal" to slice along the principal axes of the active samples or "random"
+            to slice along isotropic random directions.
+        importance : bool
+            Also estimate the evidence by importance nested sampling from every evaluated point.
+            Only available for the "uniform", "clustered_ellipsoidal" and "new" samplers whose
+            proposal densities are known, and not together with a likelihood surrogate.
+        problem : object
+            The DetectionProblem to solve, None for the default problem built from config.cfg
+        dispersion : float
+            Dispersion used in metropolis sampling
+        eps : float
+            Neighbourhood radius of DBSCAN used in clustered ellipsoidal sampling
+        minPts : int
+            Minimum number of points of a DBSCAN cluster
+        profiler : object
+            A profiling.Profiler timing the likelihood, sampling, clustering and ellipsoid phases
+            from here to the end of fit. It is set on the problem until the end of fit. None to not profile.
+        telemetry : object
+            A telemetry.Telemetry receiving progress records during fit. None prints the iteration and the
+            remaining evidence every 1000 iterations.
             
         """
 
@@ -382,14 +1326,65 @@ class Nested_Sampler(object):
         self.no_active_samples     = no_active_samples
         self.maximum_iterations    = max_iter
         self.sample                = sample
-        self.convergence_threshold = 0.1
-        self.active_samples        = get_sources(self.no_active_samples)
+        self.convergence_threshold = conv_thresh
+        self.problem               = problem if problem is not None else default_problem()
+        self.dispersion            = dispersion
+        self.eps                   = eps
+        self.minPts                = minPts
+        self.profiler              = profiler if profiler is not None else NULL_PROFILER
+        self.problem_profiler      = self.problem.profiler # Restored on the problem at the end of fit
+        if profiler is not None:
+            self.problem.profiler  = profiler
+        self.profiler.start()
+        with self.profiler.phase("initial"):
+            self.active_samples    = self.problem.get_sources(self.no_active_samples)
         self.log_evidence          = None # Log evidence
         self.posterior_inferences  = []   # Posterior samples 
         self.log_width             = None # Log width of the prior
         self.Information           = None # Information for error estimation in evidence
         self.no_likelihood         = no_active_samples # To keep track of number of likelihood evaluations made
         self.ellipsoids            = None
+        self.window                = window
+        self.sampler_ladder        = ["uniform", "clustered_ellipsoidal", "metropolis"]
+        self.current_sampler       = self.sampler_ladder[0]
+        self.sampler_stats         = dict((name, deque(maxlen=window)) for name in self.sampler_ladder)
+        self.sampler_seen          = dict((name, None) for name in self.sampler_ladder)
+        self.sampler_switches      = [] # (iteration, from, to, seconds per accepted point) for every switch
+        self.probe                 = None # Sampler being measured and number of probe replacements left
+        self.refresh_shrinkage     = refresh_shrinkage
+        self.refresh_acceptance    = refresh_acceptance
+        self.refresh_drift         = refresh_drift
+        self.refresh_max_cost      = refresh_max_cost
+        self.refresh_window        = deque(maxlen=20) # Likelihood evaluations of the recent replacements
+        self.refresh_baseline      = None # Acceptance rate just after the last build
+        self.last_refresh          = None # Iteration of the last build
+        self.ellipsoid_members     = None # Number of active points each ellipsoid was built around
+        self.ellipsoid_lost        = None # Number of those points replaced since the last build
+        self.ellipsoid_volumes     = None # Volume of the active points inside each ellipsoid at the last build
+        self.start_time            = None
+        self.refresh_stats         = {"refreshes":0, "skipped":0, "time":0.0,
+                                      "shrinkage":0, "acceptance":0, "drift":0, "empty":0, "fallbacks":0}
+        self.slice_steps           = slice_steps
+        self.slice_directions      = slice_directions
+        self.importance            = None
+        self.telemetry             = telemetry if telemetry is not None else Telemetry(interval = None, every = 1000, callbacks = [console])
+        self.telemetry_last        = None # Time, iteration and likelihood evaluations of the last record
+
+        if self.problem.surrogate is not None:
+            for i in self.active_samples:
+                self.problem.surrogate.add(i)
+
+        if importance:
+            if self.sample not in ["uniform", "clustered_ellipsoidal", "new"]:
+                print "Importance nested sampling is not available for the "+self.sample+" sampler"
+            elif self.problem.surrogate is not None:
+                #Points rejected by the surrogate have no exact likelihood to weight
+                print "Importance nested sampling is not available together with the likelihood surrogate"
+            else:
+                self.importance = Importance_Evidence(self.problem)
+                self.importance.new_stage(None)
+                for i in self.active_samples:
+                    self.importance.record(i)
 
     
     def fit(self):
@@ -407,6 +1402,15 @@ class Nested_Sampler(object):
             *  Information - The Information for error estimation
             *  likelihood_calculations - Number of likelihood evaluations
             *  iterations - Number of iterations until stopping
+            *  sampler_switches - Sampler switches made in "adaptive" mode
+            *  refresh_stats - Number, triggers and cost of ellipsoid rebuilds in "new" mode
+            *  evaluations_per_accept - Likelihood evaluations per accepted replacement
+            *  surrogate_stats - Candidates, skips and audited false rejects of the surrogate
+            *  memo_stats - Hits and misses of the likelihood memo, None if disabled
+            *  logZ_INS - The log evidence from importance nested sampling, None if disabled
+            *  convergence - Iteration and seconds since the start of fit at which the remaining evidence
+               first fell below conv_thresh, None if it never did
+            *  profile - Table of the time spent per phase, None if not profiling
 
         """
 
@@ -418,8 +1422,12 @@ class Nested_Sampler(object):
         iteration = None
         stop = None
         prev_stop = 0.0
+        convergence = None
+        self.start_time = time.time()
+        self.telemetry_last = None
        
         for iteration in range(1,60000):
+            self.profiler.count("iterations")
             smallest = 0
             
             #Finding the object with smallest likelihood
@@ -445,8 +1453,11 @@ class Nested_Sampler(object):
             stopping = self.active_samples[largest].logL + self.log_width - self.log_evidence 
             
 
-            if iteration%1000 == 0 or iteration==1:
-                print "Iteration: "+str(iteration) + "  maxZ: "+str(stopping)  
+            if self.telemetry.due(iteration):
+                self.telemetry.emit(self.progress(iteration, stopping))
+
+            if stopping < self.convergence_threshold and convergence is None:
+                convergence = {"iteration":iteration, "time":time.time() - self.start_time}
 
             if stopping < self.convergence_threshold and int(Config['STOP_BY_EVIDENCE'])==1:
                 break
@@ -492,61 +1503,278 @@ class Nested_Sampler(object):
                 LogL[smallest] = self.active_samples[smallest].logL
                 self.no_likelihood = number
 
+            if self.sample == "adaptive":
+                #Obtain new sample using whichever sampler is currently the cheapest
+                updated, number = self.adaptive_sampling(obj = self.active_samples[survivor], active_points = self.active_samples, LC = likelihood_constraint, likelihood_calc =self.no_likelihood, iteration = iteration)
+                self.active_samples[smallest].__dict__ = updated.__dict__.copy()
+                LogL[smallest] = self.active_samples[smallest].logL
+                self.no_likelihood = number
+
+            if self.sample == "slice":
+                #Obtain new sample using slice sampling
+                updated, number = self.slice_sampling(obj = self.active_samples[survivor], active_points = self.active_samples, LC = likelihood_constraint, likelihood_calc =self.no_likelihood)
+                self.active_samples[smallest].__dict__ = updated.__dict__.copy()
+                LogL[smallest] = self.active_samples[smallest].logL
+                self.no_likelihood = number
+
+            if self.sample == "galilean":
+                #Obtain new sample using Galilean Monte Carlo
+                updated, number = self.galilean_sampling(obj = self.active_samples[survivor], active_points = self.active_samples, LC = likelihood_constraint, likelihood_calc =self.no_likelihood)
+                self.active_samples[smallest].__dict__ = updated.__dict__.copy()
+                LogL[smallest] = self.active_samples[smallest].logL
+                self.no_likelihood = number
+
             if self.sample == "new":
 
-                if iteration ==1 or iteration%30==0 :
-                    Clust_ellip = Clustered_Sampler(active_samples=self.active_samples, likelihood_constraint= likelihood_constraint, enlargement=1.0, no=self.no_likelihood)
-                    self.ellipsoids = Clust_ellip.ellipsoid_set
-                found = 0
-                r_l, r_u = getPrior_R()
-                a_l, a_u = getPrior_A() 
-                while found == 0:
-                    arbit = np.random.uniform(0,1)
-                    trial = Source()
-                    clust = Source()
-                    z = int((len(self.ellipsoids))*arbit)
-                    points = None
-                    try:
-                        points = self.ellipsoids[z].sample(n_points=50)
-                    except IndexError:
-                        print "\n"
-                        print "\n"
-                        print "Please adjust the clustering parameters and try again."
-                        print "\n"
-                        print "\n"            
-                    max_likelihood = likelihood_constraint
-                    count = 0
-                    while count<50:
-                        trial.X = points[count][0]
-                        trial.Y = points[count][1]
-                        trial.A = np.random.uniform(a_l,a_u)
-                        trial.R = np.random.uniform(r_l,r_u)            
-                        trial.logL = log_likelihood(trial)
-                        self.no_likelihood+=1
-
-                        if(trial.logL > max_likelihood):
-                            clust.__dict__ = trial.__dict__.copy()
-                            max_likelihood = trial.logL
-                            found = 1
-                            break
+                if self.ellipsoids is not None:
+                    self.track_drift(sample)
+                if self.refresh_due(iteration):
+                    self.refresh_ellipsoids(iteration, likelihood_constraint)
+                if len(self.ellipsoids) == 0:
+                    #No ellipsoid to sample from until the clustering succeeds again
+                    updated, number = self.metropolis_sampling(obj = self.active_samples[survivor], LC = likelihood_constraint, likelihood_calc =self.no_likelihood)
+                    self.active_samples[smallest].__dict__ = updated.__dict__.copy()
+                    LogL[smallest] = self.active_samples[smallest].logL
+                    self.no_likelihood = number
+                    self.refresh_stats["fallbacks"] += 1
+                else:
+                    with self.profiler.phase("new"):
+                        evaluations = self.no_likelihood
+                        found = 0
+                        r_l, r_u = self.problem.getPrior_R()
+                        a_l, a_u = self.problem.getPrior_A() 
+                        while found == 0:
+                            arbit = np.random.uniform(0,1)
+                            trial = Source()
+                            clust = Source()
+                            z = int((len(self.ellipsoids))*arbit)
+                            points = self.ellipsoids[z].sample(n_points=50)
+                            max_likelihood = likelihood_constraint
+                            count = 0
+                            while count<50:
+                                trial.X = points[count][0]
+                                trial.Y = points[count][1]
+                                trial.A = np.random.uniform(a_l,a_u)
+                                trial.R = np.random.uniform(r_l,r_u)            
+                                trial.logL, exact = self.problem.screened_log_likelihood(trial, likelihood_constraint)
+                                if exact:
+                                    self.no_likelihood+=1
+                                if self.importance is not None:
+                                    self.importance.record(trial)
+
+                                if(trial.logL > max_likelihood):
+                                    clust.__dict__ = trial.__dict__.copy()
+                                    max_likelihood = trial.logL
+                                    found = 1
+                                    break
                                 
-                        count+=1    
-                    self.active_samples[smallest].__dict__ = clust.__dict__.copy()
-                    LogL[smallest] = self.active_samples[smallest].logL          
+                                count+=1    
+                            self.active_samples[smallest].__dict__ = clust.__dict__.copy()
+                            LogL[smallest] = self.active_samples[smallest].logL          
+                        self.refresh_window.append(self.no_likelihood - evaluations)
 
             #Shrink width  
             self.log_width -= 1.0 / self.no_active_samples;
 
+        record = self.progress(iteration, stopping)
+        record["final"] = True
+        self.telemetry.emit(record)
+        self.telemetry.flush()
+        self.profiler.stop()
+        self.problem.profiler = self.problem_profiler
+
         # FIX ME: Incorporate the active samples into evidence calculation and information after the loop
         return { "src":self.active_samples,
             "samples":self.posterior_inferences, 
             "logZ":self.log_evidence,
             "Information":self.Information,
             "likelihood_calculations":self.no_likelihood,
-            "iterations":self.maximum_iterations 
+            "iterations":iteration,
+            "sampler_switches":self.sampler_switches,
+            "refresh_stats":self.refresh_stats,
+            "evaluations_per_accept":float(self.no_likelihood - self.no_active_samples)/max(iteration - 1, 1),
+            "surrogate_stats":None if self.problem.surrogate is None else self.problem.surrogate.statistics(),
+            "memo_stats":None if self.problem.memo is None else self.problem.memo.statistics(),
+            "logZ_INS":None if self.importance is None else self.importance.log_evidence(),
+            "convergence":convergence,
+            "profile":self.profiler.summary() if self.profiler.enabled else None
             }
 
 
+    def progress(self, iteration, remaining):
+
+        """
+        Returns the progress record of the current iteration. Rates are measured since the previous record.
+
+        Parameters
+        ----------
+        iteration : int
+            The current nested sampling iteration
+        remaining : float
+            Log of the largest remaining evidence relative to the current evidence
+
+        Returns
+        -------
+        record : dict
+            iteration, logZ, remaining, likelihood_calculations, acceptance (accepted replacements per likelihood
+            evaluation), likelihood_per_second, ellipsoids (None without ellipsoids), sampler and elapsed seconds
+
+        """
+
+        now = time.time()
+        last_time, last_iteration, last_likelihood = self.telemetry_last or (self.start_time, 0, self.no_active_samples)
+        evaluations = self.no_likelihood - last_likelihood
+        seconds = now - last_time
+        self.telemetry_last = (now, iteration, self.no_likelihood)
+        return {"iteration":iteration, "logZ":float(self.log_evidence), "remaining":float(remaining),
+                "likelihood_calculations":self.no_likelihood,
+                "acceptance":(iteration - last_iteration)/float(evaluations) if evaluations > 0 else None,
+                "likelihood_per_second":evaluations/seconds if seconds > 0 else None,
+                "ellipsoids":None if self.ellipsoids is None else len(self.ellipsoids),
+                "sampler":self.current_sampler if self.sample == "adaptive" else self.sample,
+                "elapsed":now - self.start_time}
+
+
+    def refresh_due(self, iteration):
+
+        """
+        Decides whether the "new" sampler should rebuild its ellipsoids in this iteration.
+
+        The ellipsoids are rebuilt when the log volume occupied by the active samples inside them has
+        shrunk by refresh_shrinkage since the last build, when the acceptance rate has fallen below
+        refresh_acceptance times its value just after the build or when an ellipsoid has lost
+        refresh_drift of its members. The volume is measured every time the acceptance window has
+        filled up again. When the last clustering gave no ellipsoid it is retried after as many
+        iterations. Rebuilds are postponed while their total cost is above refresh_max_cost of the
+        wall time.
+
+        Parameters
+        ----------
+        iteration : int
+            The current nested sampling iteration
+
+        Returns
+        -------
+        due : bool
+            True if the ellipsoids should be rebuilt
+
+        """
+
+        if self.ellipsoids is None:
+            return True
+
+        reason = None
+        since = iteration - self.last_refresh
+        if len(self.ellipsoids) == 0:
+            if since >= self.refresh_window.maxlen:
+                reason = "empty"
+        else:
+            if since % self.refresh_window.maxlen == 0 and self.volume_shrinkage() >= self.refresh_shrinkage:
+                reason = "shrinkage"
+            elif len(self.refresh_window) == self.refresh_window.maxlen:
+                acceptance = len(self.refresh_window)/float(sum(self.refresh_window))
+                if self.refresh_baseline is None:
+                    self.refresh_baseline = acceptance
+                elif acceptance < self.refresh_acceptance*self.refresh_baseline:
+                    reason = "acceptance"
+            if reason is None and np.any(self.ellipsoid_lost > self.refresh_drift*self.ellipsoid_members):
+                reason = "drift"
+        if reason is None:
+            return False
+
+        elapsed = time.time() - self.start_time
+        if self.refresh_stats["time"] > self.refresh_max_cost*elapsed:
+            self.refresh_stats["skipped"] += 1
+            return False
+        self.refresh_stats[reason] += 1
+        return True
+
+
+    def refresh_ellipsoids(self, iteration, LC):
+
+        """
+        Rebuilds the ellipsoids of the "new" sampler around the current active samples and
+        resets the quantities which trigger the next rebuild.
+
+        Parameters
+        ----------
+        iteration : int
+            The current nested sampling iteration
+        LC : float
+            likelihood constraint
+
+        """
+
+        start = time.time()
+        with self.profiler.phase("refresh"):
+            Clust_ellip = Clustered_Sampler(active_samples=self.active_samples, likelihood_constraint= LC, enlargement=1.0, no=self.no_likelihood,
+                                            problem=self.problem, eps=self.eps, minPts=self.minPts)
+        self.ellipsoids = Clust_ellip.ellipsoid_set
+        if self.importance is not None:
+            self.ellipsoids = self.importance.new_stage(self.ellipsoids)
+        self.ellipsoid_members = np.array([len(i.clpoints) for i in self.ellipsoids], dtype=float)
+        self.ellipsoid_lost = np.zeros(len(self.ellipsoids))
+        self.ellipsoid_volumes = self.member_volumes()
+        self.last_refresh = iteration
+        self.refresh_window.clear()
+        self.refresh_baseline = None
+        self.refresh_stats["refreshes"] += 1
+        self.refresh_stats["time"] += time.time() - start
+
+
+    def member_volumes(self):
+
+        """
+        Returns the volume of the covariance ellipse of the active samples inside every ellipsoid of the
+        "new" sampler, nan for ellipsoids containing fewer than three active samples.
+
+        """
+
+        points = np.array([[i.X, i.Y] for i in self.active_samples], dtype=float)
+        volumes = np.empty(len(self.ellipsoids))
+        volumes.fill(np.nan)
+        for k in range(len(self.ellipsoids)):
+            transformed = points - self.ellipsoids[k].centroid
+            inside = points[np.sum(np.dot(transformed, self.ellipsoids[k].inv_cov_mat)*transformed, axis=1) <= 1.0]
+            if len(inside) > 2:
+                volumes[k] = np.pi*np.sqrt(max(np.linalg.det(np.cov(inside, rowvar=0)), 0.0))
+        return volumes
+
+
+    def volume_shrinkage(self):
+
+        """
+        Returns the shrinkage of the log volume of the active samples inside the ellipsoids since the last
+        build, 0 if no ellipsoid can be compared.
+
+        """
+
+        volumes = self.member_volumes()
+        valid = np.isfinite(volumes) & np.isfinite(self.ellipsoid_volumes)
+        if not valid.any():
+            return 0.0
+        with np.errstate(divide='ignore'):
+            return float(np.log(np.sum(self.ellipsoid_volumes[valid])/np.sum(volumes[valid])))
+
+
+    def track_drift(self, dead):
+
+        """
+        Counts the discarded sample against every ellipsoid which contains it.
+
+        Parameters
+        ----------
+        dead : object
+            The sample with the smallest likelihood removed in this iteration
+
+        """
+
+        point = np.array([dead.X, dead.Y])
+        for i in range(len(self.ellipsoids)):
+            if self.ellipsoids[i].contains(point):
+                self.ellipsoid_lost[i] += 1
+
+
     def metropolis_sampling(self, obj, LC, likelihood_calc):
 
         """
@@ -571,8 +1799,9 @@ class Nested_Sampler(object):
         """
 
         #Instantiating the metropolis sampler object
-        Metro = Metropolis_sampler(to_evolve = obj, likelihood_constraint = LC, no =likelihood_calc )
-        evolved, number = Metro.sample()
+        with self.profiler.phase("metropolis"):
+            Metro = Metropolis_sampler(to_evolve = obj, likelihood_constraint = LC, no =likelihood_calc, problem = self.problem, dispersion = self.dispersion)
+            evolved, number = Metro.sample()
         return evolved, number
 
 
@@ -600,41 +1829,287 @@ class Nested_Sampler(object):
         """
 
 
-        Clust = Clustered_Sampler(active_samples=active_points, likelihood_constraint=LC, enlargement=1.0, no=likelihood_calc)
-        sample = None
-        number = None
-        while True:
-            sample, number = Clust.sample()
-            if(sample.logL > LC):
-                break
-            Clust = Clustered_Sampler(active_samples=active_points, likelihood_constraint=LC, enlargement=1.0, no=number)   
+        with self.profiler.phase("clustered_ellipsoidal"):
+            Clust = Clustered_Sampler(active_samples=active_points, likelihood_constraint=LC, enlargement=1.0, no=likelihood_calc, importance=self.importance,
+                                      problem=self.problem, eps=self.eps, minPts=self.minPts)
+            sample = None
+            number = None
+            while True:
+                sample, number = Clust.sample()
+                if(sample.logL > LC):
+                    break
+                Clust = Clustered_Sampler(active_samples=active_points, likelihood_constraint=LC, enlargement=1.0, no=number, importance=self.importance,
+                                          problem=self.problem, eps=self.eps, minPts=self.minPts)
         return sample, number
 
     
+    def slice_sampling(self, obj, active_points, LC, likelihood_calc):
+
+        """
+        Returns the sample satisfying the likelihood condition by slice sampling
+
+        Parameters
+        ----------
+        obj : object
+            The sample to evolve
+        active_points : array
+            The full set of active points at current state, used to find the slice directions
+        LC  : float
+            likelihood constraint
+        likelihood_calc : int
+            Number of likelihood calculations until this point
+
+        Returns
+        -------
+        evolved : object
+            The evolved sample satisfying the likelihood constraint
+        number : int
+            The updated likelihood calculations number
+
+        """
+
+        with self.profiler.phase("slice"):
+            Slice = Slice_sampler(to_evolve = obj, active_samples = active_points, likelihood_constraint = LC, no = likelihood_calc,
+                                  steps = self.slice_steps, directions = self.slice_directions, problem = self.problem)
+            evolved, number = Slice.sample()
+        return evolved, number
+
+
+    def galilean_sampling(self, obj, active_points, LC, likelihood_calc):
+
+        """
+        Returns the sample satisfying the likelihood condition by Galilean Monte Carlo
+
+        Parameters
+        ----------
+        obj : object
+            The sample to evolve
+        active_points : array
+            The full set of active points at current state, used to scale the velocity
+        LC  : float
+            likelihood constraint
+        likelihood_calc : int
+            Number of likelihood calculations until this point
+
+        Returns
+        -------
+        evolved : object
+            The evolved sample satisfying the likelihood constraint
+        number : int
+            The updated likelihood calculations number
+
+        """
+
+        with self.profiler.phase("galilean"):
+            Galilean = Galilean_sampler(to_evolve = obj, active_samples = active_points, likelihood_constraint = LC, no = likelihood_calc, problem = self.problem)
+            evolved, number = Galilean.sample()
+        return evolved, number
+
+
     def uniform_sampling(self, LC, likelihood_calc):
 
         """
-        Returns the sample satisfying the likelihood condition by uniform random sampling 
+        Returns the sample satisfying the likelihood condition by uniform random sampling 
+
+        Parameters
+        ----------
+        LC  : float
+            likelihood constraint
+        likelihood_calc : int
+            Number of likelihood calculations until this point
+
+        Returns
+        -------
+        evolved : object
+            The evolved sample satisfying the likelihood constraint
+        number : int
+            The updated likelihood calculations number
+
+        """
+
+        with self.profiler.phase("uniform"):
+            unif = uniform_sampler(likelihood_constraint = LC, no =likelihood_calc, importance = self.importance, problem = self.problem)
+            evolved, number = unif.sample()
+        return evolved, number      
+
+
+    def adaptive_sampling(self, obj, active_points, LC, likelihood_calc, iteration):
+
+        """
+        Returns the sample satisfying the likelihood condition using the sampler which currently has
+        the lowest cost per accepted point.
+
+        Every replacement is timed and its likelihood evaluations are recorded in a sliding window
+        per sampler. Every `window` iterations a neighbour of the current sampler in the ladder
+        uniform -> clustered_ellipsoidal -> metropolis which has not been measured recently is probed
+        for a few replacements, and the run continues with the cheapest sampler among those measured
+        recently. If the clustering finds no usable ellipsoids the measurements of the clustered sampler
+        are dropped and the run continues with metropolis until the clustered sampler is probed again. The
+        likelihood calculations of the failed attempt still count towards the run.
+
+        Parameters
+        ----------
+        obj : object
+            The sample to evolve for metropolis sampling
+        active_points : array
+            The full set of active points at current state
+        LC : float
+            likelihood constraint
+        likelihood_calc : int
+            Number of likelihood calculations until this point
+        iteration : int
+            The current nested sampling iteration
+
+        Returns
+        -------
+        sample : object
+            The evolved sample satisfying the likelihood constraint
+        number : int
+            The updated likelihood calculations number
+
+        """
+
+        if self.probe is None and iteration % self.window == 0:
+            self.choose_sampler(iteration)
+            position = self.sampler_ladder.index(self.current_sampler)
+            candidates = [self.sampler_ladder[i] for i in [position - 1, position + 1]
+                          if 0 <= i < len(self.sampler_ladder) and not self.is_fresh(self.sampler_ladder[i], iteration)]
+            if candidates:
+                #The neighbour measured least recently, one never measured first
+                candidate = min(candidates, key=lambda i: -1 if self.sampler_seen[i] is None else self.sampler_seen[i])
+                self.probe = [candidate, max(5, self.window/5)]
+
+        name = self.current_sampler
+        if self.probe is not None:
+            name = self.probe[0]
+
+        start = time.time()
+        try:
+            if name == "uniform":
+                sample, number = self.uniform_sampling(LC = LC, likelihood_calc = likelihood_calc)
+            if name == "clustered_ellipsoidal":
+                sample, number = self.clustered_sampling(active_points = active_points, LC = LC, likelihood_calc = likelihood_calc)
+            if name == "metropolis":
+                sample, number = self.metropolis_sampling(obj = obj, LC = LC, likelihood_calc = likelihood_calc)
+        except ClusteringError as error:
+            self.sampler_stats[name].clear()
+            self.sampler_seen[name] = iteration
+            self.probe = None
+            if name == self.current_sampler:
+                self.switch_sampler(iteration, "metropolis", None)
+            return self.adaptive_sampling(obj, active_points, LC, error.number, iteration)
+
+        self.sampler_stats[name].append((time.time() - start, number - likelihood_calc))
+        self.sampler_seen[name] = iteration
+
+        if self.probe is not None:
+            self.probe[1] -= 1
+            if self.probe[1] <= 0:
+                self.probe = None
+                self.choose_sampler(iteration)
+
+        return sample, number
+
+
+    def is_fresh(self, name, iteration):
+
+        """
+        Returns True if the sampler has been measured within the last few windows.
+
+        Parameters
+        ----------
+        name : str
+            Name of the sampler
+        iteration : int
+            The current nested sampling iteration
+
+        """
+
+        seen = self.sampler_seen[name]
+        return seen is not None and iteration - seen <= 4*self.window
+
+
+    def sampler_cost(self, name):
+
+        """
+        Returns the mean wall time per accepted point and the acceptance rate of a sampler
+        over its sliding window.
+
+        Parameters
+        ----------
+        name : str
+            Name of the sampler
+
+        Returns
+        -------
+        cost : float
+            Seconds spent per accepted point
+        acceptance : float
+            Accepted points per likelihood evaluation
+
+        """
+
+        stats = self.sampler_stats[name]
+        seconds = sum(i[0] for i in stats)
+        evaluations = sum(i[1] for i in stats)
+        cost = seconds/len(stats)
+        acceptance = float(len(stats))/max(evaluations, 1)
+        return cost, acceptance
+
+
+    def choose_sampler(self, iteration):
+
+        """
+        Switches to the sampler with the lowest cost per accepted point among the samplers
+        measured recently.
+
+        Parameters
+        ----------
+        iteration : int
+            The current nested sampling iteration
+
+        """
+
+        best = self.current_sampler
+        best_cost = None
+        if len(self.sampler_stats[best]) > 0:
+            best_cost = self.sampler_cost(best)[0]
+        for name in self.sampler_ladder:
+            if len(self.sampler_stats[name]) == 0 or not self.is_fresh(name, iteration):
+                continue
+            cost = self.sampler_cost(name)[0]
+            if best_cost is None or cost < best_cost:
+                best, best_cost = name, cost
+        if best != self.current_sampler:
+            self.switch_sampler(iteration, best, best_cost)
+
+
+    def switch_sampler(self, iteration, name, cost):
+
+        """
+        Records and logs a switch of the sampler used in "adaptive" mode.
 
         Parameters
         ----------
-        LC  : float
-            likelihood constraint
-        likelihood_calc : int
-            Number of likelihood calculations until this point
-
-        Returns
-        -------
-        evolved : object
-            The evolved sample satisfying the likelihood constraint
-        number : int
-            The updated likelihood calculations number
+        iteration : int
+            The current nested sampling iteration
+        name : str
+            Name of the sampler to switch to
+        cost : float
+            Measured seconds per accepted point of the new sampler, None if not measured
 
         """
 
-        unif = uniform_sampler(likelihood_constraint = LC, no =likelihood_calc)
-        evolved, number = unif.sample()
-        return evolved, number      
+        if name == self.current_sampler:
+            return
+        previous = self.current_sampler
+        message = "Iteration: "+str(iteration)+"  sampler: "+previous+" -> "+name
+        if cost is not None:
+            message += "  cost per accepted point: "+str(cost)+" s"
+            message += "  acceptance: "+str(self.sampler_cost(name)[1])
+        print message
+        self.sampler_switches.append((iteration, previous, name, cost))
+        self.current_sampler = name
 
 
 #---------------------------------------------------------------------------------------------------------------
@@ -655,10 +2130,12 @@ class uniform_sampler(object):
         likelihood constraint for the point
     number : int
         likelihood calculations until now        
+    importance : object
+        Importance_Evidence recording every evaluated point
 
     """
 
-    def __init__(self, likelihood_constraint, no):
+    def __init__(self, likelihood_constraint, no, importance=None, problem=None):
 
         """
         Initializes the uniform sampler
@@ -669,11 +2146,19 @@ class uniform_sampler(object):
             name says it all
         no : int
             Number of likelihood evaluations until this point
+        importance : object
+            Importance_Evidence recording every evaluated point, None to disable
+        problem : object
+            The DetectionProblem to sample, None for the default problem
 
         """
 
         self.LC     = likelihood_constraint
         self.number = no
+        self.problem = problem if problem is not None else default_problem()
+        self.importance = importance
+        if self.importance is not None:
+            self.importance.new_stage(None)
                 
     
     def sample(self):
@@ -692,10 +2177,10 @@ class uniform_sampler(object):
 
         new   = Source()
                         
-        x_l, x_u = getPrior_X()
-        y_l, y_u = getPrior_Y()
-        r_l, r_u = getPrior_R()
-        a_l, a_u = getPrior_A()
+        x_l, x_u = self.problem.getPrior_X()
+        y_l, y_u = self.problem.getPrior_Y()
+        r_l, r_u = self.problem.getPrior_R()
+        a_l, a_u = self.problem.getPrior_A()
 
         while(True):
             
@@ -703,8 +2188,11 @@ class uniform_sampler(object):
             new.Y = np.random.uniform(y_l,y_u)
             new.A = np.random.uniform(a_l,a_u)
             new.R = np.random.uniform(r_l,r_u)
-            new.logL = log_likelihood(new)
-            self.number+=1
+            new.logL, exact = self.problem.screened_log_likelihood(new, self.LC)
+            if exact:
+                self.number+=1
+            if self.importance is not None:
+                self.importance.record(new)
             
             if(new.logL > self.LC):
                 break
@@ -735,7 +2223,7 @@ class Metropolis_sampler(object):
     
     """
 
-    def __init__(self, to_evolve, likelihood_constraint, no):
+    def __init__(self, to_evolve, likelihood_constraint, no, problem=None, dispersion=8.0):
 
         """
         Initializes the Metropolis sampler
@@ -748,6 +2236,10 @@ class Metropolis_sampler(object):
             name says it all
         no : int
             Number of likelihood evaluations until this point
+        problem : object
+            The DetectionProblem to sample, None for the default problem
+        dispersion : float
+            Initial dispersion of the gaussian proposal distribution
         
         """
 
@@ -755,6 +2247,7 @@ class Metropolis_sampler(object):
         self.LC     = likelihood_constraint
         self.step   = dispersion
         self.number = no
+        self.problem = problem if problem is not None else default_problem()
                 
     
     def sample(self):
@@ -781,10 +2274,10 @@ class Metropolis_sampler(object):
         hit = 0
         miss = 0
         
-        x_l, x_u = getPrior_X()
-        y_l, y_u = getPrior_Y()
-        r_l, r_u = getPrior_R()
-        a_l, a_u = getPrior_A()
+        x_l, x_u = self.problem.getPrior_X()
+        y_l, y_u = self.problem.getPrior_Y()
+        r_l, r_u = self.problem.getPrior_R()
+        a_l, a_u = self.problem.getPrior_A()
 
         stepnormalize = self.step/x_u
 
@@ -811,8 +2304,9 @@ class Metropolis_sampler(object):
                 if(new.A > a_u or new.A < a_l): bord = 1;
                 if(new.R > r_u or new.R < r_l): bord = 1;                
 
-            new.logL = log_likelihood(new)
-            self.number+=1
+            new.logL, exact = self.problem.screened_log_likelihood(new, self.LC)
+            if exact:
+                self.number+=1
             
             if(new.logL > self.LC):
                 metro.__dict__ = new.__dict__.copy()
@@ -837,6 +2331,384 @@ class Metropolis_sampler(object):
         return metro, self.number
 
 
+#---------------------------------------------------------------------------------------------------------------
+#                                     SLICE SAMPLER
+#---------------------------------------------------------------------------------------------------------------
+
+
+class Slice_sampler(object):
+
+    """
+    An Implementation of slice sampling to pick a sample satisfying the likelihood constraint in the
+    current nested sampling phase. The sample is moved along a sequence of one dimensional slices
+    through (X, Y, A, R), each found by stepping out and shrinkage. The parameters are scaled to the
+    unit hypercube of the prior so that one width fits all of them.
+
+    Attributes
+    ----------
+    source : object
+        object to evolve
+    LC : float
+        likelihood constraint for the point
+    number : int
+        likelihood calculations until now
+    steps : int
+        Number of one dimensional slice moves
+    directions : str
+        "principal" or "random"
+    lower : array
+        Lower prior bounds of X, Y, A, R
+    span : array
+        Widths of the prior in X, Y, A, R
+    covariance : array
+        Covariance of the active samples in the unit hypercube
+
+    References
+    ----------
+    .. [1] Neal R. M., 2003, Slice sampling, Annals of Statistics, 31, 705
+    .. [2] Handley W. J., Hobson M. P., Lasenby A. N., 2015, MNRAS, 450, L61 (PolyChord)
+
+    """
+
+    def __init__(self, to_evolve, active_samples, likelihood_constraint, no, steps=5, directions="principal", problem=None):
+
+        """
+        Initializes the slice sampler
+
+        Parameters
+        ----------
+        to_evolve : object
+            The sample to evolve
+        active_samples : array
+            The active samples used to find the slice directions and widths
+        likelihood_constraint: float
+            name says it all
+        no : int
+            Number of likelihood evaluations until this point
+        steps : int
+            Number of one dimensional slice moves
+        directions : str
+            "principal" to slice along the principal axes of the active samples or "random"
+        problem : object
+            The DetectionProblem to sample, None for the default problem
+
+        """
+
+        self.source = to_evolve
+        self.LC = likelihood_constraint
+        self.number = no
+        self.steps = steps
+        self.directions = directions
+        self.problem = problem if problem is not None else default_problem()
+        bounds = np.array([self.problem.getPrior_X(), self.problem.getPrior_Y(), self.problem.getPrior_A(), self.problem.getPrior_R()], dtype=float)
+        self.lower = bounds[:,0]
+        self.span = bounds[:,1] - bounds[:,0]
+        points = np.array([[i.X, i.Y, i.A, i.R] for i in active_samples], dtype=float)
+        self.covariance = np.cov((points - self.lower)/self.span, rowvar=0)
+
+
+    def direction(self):
+
+        """
+        Returns a unit direction in the unit hypercube and the slice width along it.
+
+        Returns
+        -------
+        direction : array
+            Unit vector to slice along
+        width : float
+            Initial width of the slice, proportional to the spread of the active samples along direction
+
+        """
+
+        if self.directions == "principal":
+            values, vects = np.linalg.eigh(self.covariance)
+            k = np.random.randint(len(values))
+            direction = vects[:,k]
+        else:
+            direction = np.random.randn(len(self.lower))
+            direction /= np.sqrt(np.sum(direction**2))
+        width = 2.5*np.sqrt(max(np.dot(direction, np.dot(self.covariance, direction)), 1e-12))
+        return direction, width
+
+
+    def in_slice(self, unit, trial):
+
+        """
+        Checks whether a point of the unit hypercube lies inside the prior and above the likelihood
+        constraint. Points outside the prior cost no likelihood evaluation.
+
+        Parameters
+        ----------
+        unit : array
+            The point in the unit hypercube
+        trial : object
+            Source object which receives the parameters and the log likelihood
+
+        Returns
+        -------
+        inside : bool
+            True if the point satisfies the likelihood constraint
+
+        """
+
+        if np.any(unit < 0.0) or np.any(unit > 1.0):
+            return False
+        trial.X, trial.Y, trial.A, trial.R = self.lower + unit*self.span
+        trial.logL = self.problem.log_likelihood(trial)
+        self.number+=1
+        return trial.logL > self.LC
+
+
+    def sample(self):
+
+        """
+        Method to pick the sample satisfying the likelihood constraint using slice sampling
+
+        Returns
+        -------
+        evolved : object
+            The evolved sample
+        number : int
+            Number of likelihood calculations until now
+
+        """
+
+        evolved = Source()
+        evolved.__dict__ = self.source.__dict__.copy()
+        trial = Source()
+        current = (np.array([evolved.X, evolved.Y, evolved.A, evolved.R], dtype=float) - self.lower)/self.span
+
+        for step in range(self.steps):
+            direction, width = self.direction()
+
+            #Stepping out
+            r = np.random.uniform(0, 1)
+            left, right = -r*width, (1.0 - r)*width
+            count = 0
+            while count < 20 and self.in_slice(current + left*direction, trial):
+                left -= width
+                count+=1
+            count = 0
+            while count < 20 and self.in_slice(current + right*direction, trial):
+                right += width
+                count+=1
+
+            #Shrinkage
+            while True:
+                t = np.random.uniform(left, right)
+                if self.in_slice(current + t*direction, trial):
+                    current = current + t*direction
+                    evolved.__dict__ = trial.__dict__.copy()
+                    break
+                if t < 0.0:
+                    left = t
+                else:
+                    right = t
+                if right - left < 1e-10:
+                    break
+
+        return evolved, self.number
+
+
+#---------------------------------------------------------------------------------------------------------------
+#                                     GALILEAN SAMPLER
+#---------------------------------------------------------------------------------------------------------------
+
+
+class Galilean_sampler(object):
+
+    """
+    An Implementation of Galilean Monte Carlo to pick a sample satisfying the likelihood constraint in
+    the current nested sampling phase. The sample moves along straight lines and when a step crosses the
+    iso-likelihood contour LC the velocity is reflected about the likelihood gradient. If the reflected
+    step also fails the velocity is reversed. The prior boundaries reflect the velocity as walls. The
+    parameters are scaled to the unit hypercube of the prior.
+
+    Attributes
+    ----------
+    source : object
+        object to evolve
+    LC : float
+        likelihood constraint for the point
+    number : int
+        likelihood calculations until now
+    steps : int
+        Number of Galilean steps
+    lower : array
+        Lower prior bounds of X, Y, A, R
+    span : array
+        Widths of the prior in X, Y, A, R
+    scale : array
+        Spread of the active samples in the unit hypercube, used as velocity scale
+
+    References
+    ----------
+    .. [1] Skilling J., 2012, AIP Conf. Proc. 1443, 145 (Bayesian computation in big spaces)
+    .. [2] Feroz F., Skilling J., 2013, AIP Conf. Proc. 1553, 106 (Exploring multi-modal distributions with nested sampling)
+
+    """
+
+    def __init__(self, to_evolve, active_samples, likelihood_constraint, no, steps=20, problem=None):
+
+        """
+        Initializes the Galilean sampler
+
+        Parameters
+        ----------
+        to_evolve : object
+            The sample to evolve
+        active_samples : array
+            The active samples used to scale the velocity
+        likelihood_constraint: float
+            name says it all
+        no : int
+            Number of likelihood evaluations until this point
+        steps : int
+            Number of Galilean steps
+        problem : object
+            The DetectionProblem to sample, None for the default problem
+
+        """
+
+        self.source = to_evolve
+        self.LC = likelihood_constraint
+        self.number = no
+        self.steps = steps
+        self.problem = problem if problem is not None else default_problem()
+        bounds = np.array([self.problem.getPrior_X(), self.problem.getPrior_Y(), self.problem.getPrior_A(), self.problem.getPrior_R()], dtype=float)
+        self.lower = bounds[:,0]
+        self.span = bounds[:,1] - bounds[:,0]
+        points = np.array([[i.X, i.Y, i.A, i.R] for i in active_samples], dtype=float)
+        self.scale = 0.5*np.std((points - self.lower)/self.span, axis=0)
+
+
+    def evaluate(self, unit, trial):
+
+        """
+        Evaluates the log likelihood and its gradient in the unit hypercube.
+
+        Parameters
+        ----------
+        unit : array
+            The point in the unit hypercube
+        trial : object
+            Source object which receives the parameters and the log likelihood
+
+        Returns
+        -------
+        gradient : array
+            Gradient of the log likelihood with respect to the unit hypercube coordinates
+
+        """
+
+        trial.X, trial.Y, trial.A, trial.R = self.lower + unit*self.span
+        trial.logL, gradient = self.problem.log_likelihood_gradient(trial)
+        self.number+=1
+        return gradient*self.span
+
+
+    def reflect_walls(self, unit, velocity):
+
+        """
+        Reflects a point and its velocity at the walls of the unit hypercube.
+
+        Parameters
+        ----------
+        unit : array
+            The point in the unit hypercube
+        velocity : array
+            The velocity
+
+        Returns
+        -------
+        unit : array
+            The reflected point
+        velocity : array
+            The reflected velocity
+
+        """
+
+        below = unit < 0.0
+        above = unit > 1.0
+        unit = np.where(below, -unit, np.where(above, 2.0 - unit, unit))
+        velocity = np.where(below | above, -velocity, velocity)
+        return np.clip(unit, 0.0, 1.0), velocity
+
+
+    def sample(self):
+
+        """
+        Method to pick the sample satisfying the likelihood constraint using Galilean Monte Carlo
+
+        Returns
+        -------
+        evolved : object
+            The evolved sample
+        number : int
+            Number of likelihood calculations until now
+
+        """
+
+        evolved = Source()
+        evolved.__dict__ = self.source.__dict__.copy()
+        trial = Source()
+        current = (np.array([evolved.X, evolved.Y, evolved.A, evolved.R], dtype=float) - self.lower)/self.span
+        velocity = self.scale*np.random.randn(len(current))
+        hit = 0
+        miss = 0
+
+        for count in range(self.steps):
+            moved = False
+            proposed, velocity = self.reflect_walls(current + velocity, velocity)
+            gradient = self.evaluate(proposed, trial)
+            if trial.logL > self.LC:
+                current = proposed
+                moved = True
+            else:
+                #Reflect off the iso-likelihood contour about the gradient at the outside point
+                norm = np.sqrt(np.sum(gradient**2))
+                if norm > 0.0:
+                    normal = gradient/norm
+                    reflected = velocity - 2.0*np.dot(velocity, normal)*normal
+                    bounced, reflected = self.reflect_walls(proposed + reflected, reflected)
+                    self.evaluate(bounced, trial)
+                    if trial.logL > self.LC:
+                        current = bounced
+                        velocity = reflected
+                        moved = True
+
+            if moved:
+                evolved.__dict__ = trial.__dict__.copy()
+                hit+=1
+            else:
+                velocity = -velocity
+                miss+=1
+
+            if( hit > miss ):   velocity *= exp(1.0 / hit);
+            if( hit < miss ):   velocity /= exp(1.0 / miss);
+
+        return evolved, self.number
+
+
+class ClusteringError(Exception):
+
+    """
+    Raised when the clustering of the active samples gives no ellipsoid to sample from.
+
+    Attributes
+    ----------
+    number : int
+        The number of likelihood calculations until the failure, including those of earlier attempts
+
+    """
+
+    def __init__(self, message, number):
+
+        Exception.__init__(self, message)
+        self.number = number
+
+
 #---------------------------------------------------------------------------------------------------------------
 #                                     CLUSTERED ELLIPSOIDAL SAMPLER
 #---------------------------------------------------------------------------------------------------------------
@@ -870,6 +2742,8 @@ class Clustered_Sampler(object):
         Total volume enclosed by the optimal ellipsoids
     number : float
         Number of likelihood evaluations until now 
+    importance : object
+        Importance_Evidence recording every evaluated point
 
     References
     ----------
@@ -881,7 +2755,7 @@ class Clustered_Sampler(object):
     """
 
 
-    def __init__(self, active_samples, likelihood_constraint,enlargement, no):
+    def __init__(self, active_samples, likelihood_constraint,enlargement, no, importance=None, problem=None, eps=10, minPts=10):
 
         """
         Initializes the clustered ellipsoidal sampler.
@@ -896,18 +2770,33 @@ class Clustered_Sampler(object):
             The enlargement factor for ellipsoids
         no : int
             Number of likelihood calculations until the current sampling phase  
+        importance : object
+            Importance_Evidence recording every evaluated point, None to disable
+        problem : object
+            The DetectionProblem to sample, None for the default problem
+        eps : float
+            Neighbourhood radius of DBSCAN
+        minPts : int
+            Minimum number of points of a DBSCAN cluster
 
         """
 
+        self.problem = problem if problem is not None else default_problem()
+        self.eps = eps
+        self.minPts = minPts
         self.points = copy.deepcopy(active_samples)
         self.LC = likelihood_constraint
         self.enlargement = 1.5
         self.clustered_point_set = None
         self.number_of_clusters = None
         self.activepoint_set = self.build_set()
-        self.ellipsoid_set = self.optimal_ellipsoids()
+        with self.problem.profiler.phase("ellipsoids"):
+            self.ellipsoid_set = self.optimal_ellipsoids()
         self.total_vol = None
         self.number = no
+        self.importance = importance
+        if self.importance is not None:
+            self.ellipsoid_set = self.importance.new_stage(self.ellipsoid_set)
 
     
     def build_set(self):
@@ -949,7 +2838,9 @@ class Clustered_Sampler(object):
         
         """
         
-        db = DBSCAN(eps=eps, min_samples=minPts).fit(activepoint_set)
+        from sklearn.cluster import DBSCAN
+        with self.problem.profiler.phase("clustering"):
+            db = DBSCAN(eps=self.eps, min_samples=self.minPts).fit(activepoint_set)
         labels = db.labels_
         number_of_clusters = len(set(labels)) - (1 if -1 in labels else 0)
         return number_of_clusters, labels, activepoint_set    
@@ -979,7 +2870,7 @@ class Clustered_Sampler(object):
             if len(clust_points[i]) > 1:
                 try:
                     ellipsoids[i] = Ellipsoid(points=clust_points[i],
-                              enlargement_factor = 2.0)
+                              enlargement_factor = 2.0, problem = self.problem)
                 except np.linalg.linalg.LinAlgError:
                     ellipsoids[i] = None
                     invalid.append(i)
@@ -1011,7 +2902,8 @@ class Clustered_Sampler(object):
 
         ellipsoids = []
         if ellipsoid is None:
-            ellipsoid = Ellipsoid(points = data, enlargement_factor=1.0)
+            ellipsoid = Ellipsoid(points = data, enlargement_factor=1.0, problem = self.problem)
+        from scipy.cluster.vq import kmeans2
         centroids, labels = kmeans2(data, 2, iter=10)
         clustered_data = [None, None]
         clustered_data[0] = [data[i] for i in range(len(data)) if labels[i]==0]
@@ -1020,7 +2912,7 @@ class Clustered_Sampler(object):
         clustered_ellipsoids = np.empty(2,object)  
         for i in [0, 1]:
             if(len(clustered_data[i]) <= 1):
-                clustered_ellipsoids[i] = Ellipsoid(clustered_data[i],1.0)
+                clustered_ellipsoids[i] = Ellipsoid(clustered_data[i],1.0, problem = self.problem)
                 vol[i]= clustered_ellipsoids[i].volume 
         do = True
 
@@ -1048,30 +2940,28 @@ class Clustered_Sampler(object):
 
         """
 
+        if len(self.ellipsoid_set) == 0:
+            raise ClusteringError("No usable ellipsoids were built from the active samples. "
+                                  "Please adjust the clustering parameters (EPS, MINPTS) and try again.", self.number)
         arbit = np.random.uniform(0,1)
         trial = Source()
         clust = Source()
         z = int((len(self.ellipsoid_set))*arbit)
-        points = None
-        try:
-            points = self.ellipsoid_set[z].sample(n_points=50)
-        except IndexError:
-            print "\n"
-            print "\n"
-            print "Please adjust the clustering parameters and try again."
-            print "\n"
-            print "\n"            
+        points = self.ellipsoid_set[z].sample(n_points=50)
         max_likelihood = self.LC
         count = 0
-        r_l, r_u = getPrior_R()
-        a_l, a_u = getPrior_A()
+        r_l, r_u = self.problem.getPrior_R()
+        a_l, a_u = self.problem.getPrior_A()
         while count<50:
             trial.X = points[count][0]
             trial.Y = points[count][1]
             trial.A = np.random.uniform(a_l,a_u)
             trial.R = np.random.uniform(r_l,r_u)            
-            trial.logL = log_likelihood(trial)
-            self.number+=1
+            trial.logL, exact = self.problem.screened_log_likelihood(trial, self.LC)
+            if exact:
+                self.number+=1
+            if self.importance is not None:
+                self.importance.record(trial)
 
             if(trial.logL > max_likelihood):
                 clust.__dict__ = trial.__dict__.copy()
@@ -1115,7 +3005,7 @@ class Ellipsoid(object):
 
     """
 
-    def __init__(self, points, enlargement_factor):
+    def __init__(self, points, enlargement_factor, problem=None):
 
         """
         Initializes the ellipsoid object
@@ -1126,9 +3016,12 @@ class Ellipsoid(object):
             The point set for the minimum bounding ellipsoid
         enlargement_factor : float
             Enlargement factor for better sampling
+        problem : object
+            The DetectionProblem whose prior bounds the samples, None for the default problem
 
         """
 
+        self.problem = problem if problem is not None else default_problem()
         self.clpoints = points
         self.centroid = np.mean(points,axis=0)
         self.enlargement_factor = enlargement_factor
@@ -1187,10 +3080,10 @@ class Ellipsoid(object):
         dim = 2
         points = np.empty((n_points, dim), dtype = float)
         values, vects = np.linalg.eig(self.covariance_matrix)
-        x_l, x_u = getPrior_X()
-        y_l, y_u = getPrior_Y()
-        r_l, r_u = getPrior_R()
-        a_l, a_u = getPrior_A()        
+        x_l, x_u = self.problem.getPrior_X()
+        y_l, y_u = self.problem.getPrior_Y()
+        r_l, r_u = self.problem.getPrior_R()
+        a_l, a_u = self.problem.getPrior_A()        
         scaled = np.dot(vects, np.diag(np.sqrt(np.absolute(values))))
         bord = 1
         new = None    
@@ -1209,6 +3102,27 @@ class Ellipsoid(object):
         return points
 
     
+    def contains(self, point):
+
+        """
+        Checks whether a point lies inside the ellipsoid
+
+        Parameters
+        ----------
+        point : array
+            The point of interest
+
+        Returns
+        -------
+        inside : bool
+            True if the point lies inside the ellipsoid
+
+        """
+
+        transformed = point - self.centroid
+        return np.dot(np.dot(transformed, self.inv_cov_mat), transformed) <= 1.0
+
+
     def find_volume(self):
 
         """
@@ -1221,11 +3135,67 @@ class Ellipsoid(object):
 
         """
         
-        volume = (np.pi**2)*(np.sqrt(np.linalg.det(self.covariance_matrix)))/2.
+        volume = np.pi*np.sqrt(np.linalg.det(self.covariance_matrix))
         return volume 
 
 
-def run_source_detect(samples = None, iterations = None, sample_method = None, prior= None,noise_rms = None, disp = None,mode = "Manual" ):
+def sampler_settings(config):
+
+    """
+    Returns the Nested_Sampler settings of a config dict.
+
+    Parameters
+    ----------
+    config : dict
+        Settings read from config.cfg
+
+    Returns
+    -------
+    settings : dict
+        Keyword arguments for Nested_Sampler, except the problem
+
+    """
+
+    return {"no_active_samples":int(config['ACTIVE_POINTS']),
+            "max_iter":int(config['MAX_ITER']),
+            "sample":str(config['SAMPLER']),
+            "window":int(config['ADAPTIVE_WINDOW']),
+            "refresh_shrinkage":float(config['REFRESH_SHRINKAGE']),
+            "refresh_acceptance":float(config['REFRESH_ACCEPTANCE']),
+            "refresh_drift":float(config['REFRESH_DRIFT']),
+            "refresh_max_cost":float(config['REFRESH_MAX_COST']),
+            "slice_steps":int(config['SLICE_STEPS']),
+            "slice_directions":str(config['SLICE_DIRECTIONS']),
+            "importance":int(config['INS']) == 1,
+            "dispersion":float(config['DISPERSION']),
+            "eps":float(config['EPS']),
+            "minPts":float(config['MINPTS'])}
+
+
+def sample_array(samples):
+
+    """
+    Returns the parameters, log likelihoods and log weights of a list of source objects as one array.
+
+    Parameters
+    ----------
+    samples : array
+        Source objects, for example the posterior samples returned by Nested_Sampler.fit
+
+    Returns
+    -------
+    data : array
+        Array of shape (len(samples), 6) with the columns X, Y, A, R, logL, logWt
+
+    """
+
+    data = np.empty((len(samples), 6), dtype=float)
+    for k, i in enumerate(samples):
+        data[k] = [i.X, i.Y, i.A, i.R, i.logL, np.nan if i.logWt is None else i.logWt]
+    return data
+
+
+def run_source_detect(samples = None, iterations = None, sample_method = None, prior= None,noise_rms = None, disp = None,mode = "Manual", problem = None, plots = None ):
     
     """
     The main method for Bayesian source detection. Runs and generates plots and histograms for posterior samples and
@@ -1238,7 +3208,8 @@ def run_source_detect(samples = None, iterations = None, sample_method = None, p
     iterations : int
         Maximum number of iterations for nested sampling
     sample_method : str
-        The method for sampling. example : "metropolis", "uniform", "clustered_ellipsoidal"
+        The method for sampling. example : "metropolis", "uniform", "clustered_ellipsoidal", "adaptive", "slice",
+        "galilean"
     prior : array
         Prior distribution for all parameters of the sources
     noise_rms : float
@@ -1252,6 +3223,21 @@ def run_source_detect(samples = None, iterations = None, sample_method = None, p
                    from the config file.
         * "ipython" : Can be ran independently from ipython console. In this case we have to provide all the parameters                        
 
+    problem : object
+        The DetectionProblem to solve. By default it is built from the image in config.cfg with the noise and
+        priors of the running mode.
+    plots : str
+        What to do with the plots. By default "show" in "ipython" mode and PLOTS of config.cfg in "Manual" mode.
+
+        * "show" : Shows the histograms and density rasters of the "png" mode one after the other
+        * "png" : Writes the plots as PNGs to PLOT_DIR of config.cfg in a background process
+        * "none" : No plots
+
+    Returns
+    -------
+    render : object
+        The process writing the PNGs in "png" mode, None otherwise
+
     Notes
     -----
     Generates the following plots successively.
@@ -1263,100 +3249,155 @@ def run_source_detect(samples = None, iterations = None, sample_method = None, p
         * Y-histogram of the active samples
         * Scatter plot of the active samples in 2D i.e (X,Y)
 
-    Outputs the posterior samples and the following information to ASCII file
+    Outputs the posterior samples (X, Y, A, R, logL, logWt, binary if OUTPUT_DATA_PATH ends with .npy), equally
+    weighted posterior samples (OUTPUT_DATA_PATH with _equal_weight before the extension), the catalog of the
+    sources (OUTPUT_DATA_PATH with _catalog.dat as extension) and the following information to ASCII file
         
         * Time elapsed
         * Log evidence
         * Number of iterations
         * Number of likelihood evaluations                 
 
+    With BACKGROUND=1 in "Manual" mode the sky is estimated on a mesh and subtracted first, and the run uses the
+    measured noise and weight map instead of NOISE, see background.
+    With CACHE_DIR set in "Manual" mode the samples, catalog and statistics of the run are cached, and a run of
+    the same image with the same settings and SEED returns them without sampling.
+    With TELEMETRY_OUTPUT set in "Manual" mode the progress records of the run are appended to it as JSON lines.
+    With PROFILE=1 in "Manual" mode the time spent per phase of the run is printed and the flame graph stacks
+    are written to PROFILE_OUTPUT with the extension .folded. PROFILE_CPROFILE=1 also runs cProfile, which
+    slows the run down noticeably, and writes its statistics to PROFILE_OUTPUT with the extension .prof.
+
     """
 
     startTime = time.time()
-    
-    global amplitude_upper
-    global amplitude_lower
-    global x_upper
-    global y_upper
-    global R_upper
-    global R_lower
-    global noise
-    global K
-    global dispersion
-    global output_loc
-    global stop
-    global eps
-    global minPts 
 
     if mode == "ipython":
-        dispersion = disp
-        amplitude_upper = prior[2][1]
-        amplitude_lower = prior[2][0]
-        x_upper = prior[0][1]
-        y_upper = prior[1][1]
-        R_upper = prior[3][1]
-        R_lower = prior[3][0]
-        noise   = noise_rms  
-        K = (no_pixels/2)*(np.log(2*np.pi) + 4*np.log(abs(noise)))
-        n = samples
-        max_iter = iterations
-        sample_type = sample_method
+        if problem is None:
+            problem = problem_from_config(Config, noise = noise_rms, prior = prior)
+        settings = {"no_active_samples":samples, "max_iter":iterations, "sample":sample_method, "dispersion":disp}
         output_loc = 'C:\Users\chaithuzz2\Desktop\Bayes_detect\output\samples.dat'
-        stop = 0
-        eps = 10
-        minPts = 10
+        use_surrogate = 0
+        max_false_reject = 0.01
+        memo_size = 0
+        memo_quantum = 0.0
+        plot_mode = "show"
+        plot_dir = 'C:\Users\chaithuzz2\Desktop\Bayes_detect\output\plots'
+        profiler = None
+        telemetry = None
 
     if mode == "Manual":
-        dispersion = float(Config['DISPERSION'])
-        amplitude_upper = float(Config['A_PRIOR_UPPER'])
-        amplitude_lower = float(Config['A_PRIOR_LOWER'])
-        x_upper = float(Config['X_PRIOR_UPPER'])
-        y_upper = float(Config['Y_PRIOR_UPPER'])
-        R_upper = float(Config['R_PRIOR_UPPER'])
-        R_lower = float(Config['R_PRIOR_LOWER'])
-        noise   = float(Config['NOISE'])
-        K = (no_pixels/2)*(np.log(2*np.pi) + 4*np.log(abs(noise)))
-        max_iter = int(Config['MAX_ITER'])
-        n = int(Config['ACTIVE_POINTS'])
-        sample_type = str(Config['SAMPLER'])
+        if problem is None:
+            problem = problem_from_config(Config)
+            if int(Config['BACKGROUND']) == 1:
+                problem = background_problem(problem, os.path.splitext(str(Config['OUTPUT_DATA_PATH']))[0],
+                                             mesh = int(Config['BACKGROUND_MESH']), nsigma = float(Config['BACKGROUND_NSIGMA']))
+        settings = sampler_settings(Config)
         output_loc = str(Config['OUTPUT_DATA_PATH'])
-        stop = int(Config['STOP_BY_EVIDENCE'])
-        eps = float(Config['EPS'])
-        minPts = float(Config['MINPTS'])
-    
-    nested = Nested_Sampler(no_active_samples = n, max_iter = max_iter, sample = sample_type)
-    out  = nested.fit()
-
-    elapsedTime = time.time() - startTime
-    print "elapsed time: "+str(elapsedTime) 
-    print "log evidence: "+str(out["logZ"])
-    print "number of iterations: "+str(out["iterations"])
-    print "likelihood calculations: "+str(out["likelihood_calculations"])
-
-    data = np.array(out["samples"])
-    
-    X = np.array([i.X for i in data])
-    Y = np.array([i.Y for i in data])
-    A = np.array([i.A for i in data])
-    R = np.array([i.R for i in data])
-    logL = np.array([i.logL for i in data])
-
-    ascii.write([X, Y, A, R, logL], output_loc, names=['X', 'Y', 'A', 'R', 'logL']) 
-
-    srcdata = np.array(out["src"])
-    
-    outX = [i.X for i in out["samples"]]
-    outY = [height-i.Y for i in out["samples"]]   
-
-    plot_histogram(data = outX, bins = width, title = "X_histogram of posterior samples")
-    plot_histogram(data = outY, bins = height, title = "Y_histogram of posterior samples")
-    show_scatterplot(outX,outY, title= "Scatter plot of posterior samples", height = height, width = width)
-
-    outsrcX = [i.X for i in out["src"]]
-    outsrcY = [height-i.Y for i in out["src"]]
-    plot_histogram(data = outsrcX, bins = width, title="Xsrc")
-    plot_histogram(data = outsrcY, bins = height, title="Ysrc")
-    show_scatterplot(outsrcX,outsrcY, title= "Scatter plot of sources", height = height, width = width)
+        use_surrogate = int(Config['SURROGATE'])
+        max_false_reject = float(Config['SURROGATE_MAX_FALSE_REJECT'])
+        memo_size = int(Config['MEMO_SIZE'])
+        memo_quantum = float(Config['MEMO_QUANTUM'])
+        plot_mode = str(Config['PLOTS'])
+        plot_dir = str(Config['PLOT_DIR'])
+        profiler = None
+        if int(Config['PROFILE']) == 1:
+            profiler = Profiler(cprofile = str(Config['PROFILE_OUTPUT'])+'.prof' if int(Config['PROFILE_CPROFILE']) == 1 else None)
+        telemetry = None
+        if str(Config['TELEMETRY_OUTPUT']) != "none" and float(Config['TELEMETRY_INTERVAL']) > 0:
+            telemetry = Telemetry(str(Config['TELEMETRY_OUTPUT']), interval = float(Config['TELEMETRY_INTERVAL']),
+                                  every = 1000, callbacks = [console])
+
+    if plots is not None:
+        plot_mode = plots
+    sample_type = settings["sample"]
+
+    cache = None
+    seed = None
+    if mode == "Manual" and str(Config['SEED']) != "none":
+        seed = int(Config['SEED'])
+        random.seed(seed)
+        np.random.seed(seed)
+    if mode == "Manual" and str(Config['CACHE_DIR']) != "none":
+        cache = ResultCache(str(Config['CACHE_DIR']), max_bytes = int(float(Config['CACHE_SIZE'])*2**20))
+        key = run_key(image_digest(problem),
+                      {"sampler":settings, "noise":problem.noise, "prior":problem.prior, "seed":seed,
+                       "surrogate":max_false_reject if use_surrogate == 1 else None,
+                       "memo_quantum":memo_quantum if memo_size > 0 else None,
+                       "stop_by_evidence":int(Config['STOP_BY_EVIDENCE'])})
+
+    result = None if cache is None else cache.get(key)
+    if result is not None:
+        print "cached result "+key
+        data, active, catalog, stats = result["samples"], result["active"], result["catalog"], result["stats"]
+
+    else:
+        problem.surrogate = None
+        if use_surrogate == 1:
+            problem.surrogate = Surrogate(problem, max_false_reject = max_false_reject)
+        problem.memo = None
+        if memo_size > 0 and memo_quantum > 0:
+            #A quantised memo returns the likelihoods of nearby earlier sources, so a shared one would make
+            #the result depend on the runs before it, and the cached result on which run came first
+            problem.memo = LikelihoodMemo(max_size = memo_size, quantum = memo_quantum)
+        elif memo_size > 0:
+            #Exact keys return the same likelihoods whatever ran before, so the memo is kept for the process
+            #and runs repeated from ipython find the likelihoods of earlier runs
+            problem.memo = shared_memo((image_digest(problem), problem.noise), max_size = memo_size)
+            problem.memo.hits, problem.memo.misses = 0, 0
+
+        nested = Nested_Sampler(problem = problem, profiler = profiler, telemetry = telemetry, **settings)
+        try:
+            out  = nested.fit()
+        finally:
+            if telemetry is not None:
+                telemetry.close()
+
+        data = sample_array(out["samples"])
+        active = sample_array(out["src"])
+        catalog = extract_catalog(data, min_logL = problem.null_log_likelihood())
+        stats = {"elapsed":time.time() - startTime, "logZ":float(out["logZ"]), "Information":float(out["Information"]),
+                 "logZ_INS":None if out["logZ_INS"] is None else float(out["logZ_INS"]),
+                 "iterations":out["iterations"], "likelihood_calculations":out["likelihood_calculations"],
+                 "evaluations_per_accept":out["evaluations_per_accept"], "refresh_stats":out["refresh_stats"],
+                 "surrogate_stats":out["surrogate_stats"], "memo_stats":out["memo_stats"]}
+        if cache is not None:
+            cache.put(key, data, active, catalog, stats)
+        if profiler is not None:
+            print out["profile"]
+            profiler.write_folded(str(Config['PROFILE_OUTPUT'])+'.folded')
+
+    print "elapsed time: "+str(stats["elapsed"]) 
+    print "log evidence: "+str(stats["logZ"])
+    if stats["logZ_INS"] is not None:
+        print "importance nested sampling log evidence: "+str(stats["logZ_INS"])
+    print "number of iterations: "+str(stats["iterations"])
+    print "likelihood calculations: "+str(stats["likelihood_calculations"])
+    print "likelihood calculations per accepted point: "+str(stats["evaluations_per_accept"])
+    if sample_type == "new":
+        print "ellipsoid refreshes: "+str(stats["refresh_stats"])
+    if stats["surrogate_stats"] is not None:
+        print "surrogate pre-screening: "+str(stats["surrogate_stats"])
+    if stats.get("memo_stats") is not None:
+        print "likelihood memo: "+str(stats["memo_stats"])
+
+    write_samples(data, output_loc)
+    root, extension = os.path.splitext(output_loc)
+    write_samples(equal_weight_samples(data, logZ = stats["logZ"]), root+'_equal_weight'+extension)
+    write_catalog(catalog, root+'_catalog.dat')
+    X, Y, logWt = data[:,0], data[:,1], data[:,5]
+
+    problem.load()
+    height, width = problem.height, problem.width
+
+    if plot_mode == "png":
+        from plot import render_in_background
+        return render_in_background(np.column_stack((X, Y)), active[:,0:2], height, width, plot_dir, logWt = logWt)
+
+    if plot_mode == "show":
+        from plot import render_results
+        render_results(np.column_stack((X, Y)), active[:,0:2], height, width, logWt = logWt)
+
+    return None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,164 @@
+"""Progress records of nested sampling runs for watching many runs at once.
+
+A Telemetry decides once per iteration, from a clock reading and an integer comparison, whether a record is
+due. Only then does the sampler put the record together: iteration, log evidence, remaining evidence,
+acceptance rate, number of ellipsoids and likelihood calculations per second. Records are passed to the
+callbacks and appended as JSON lines to a file. The lines are buffered in memory and written together at
+most every flush_interval seconds (the record interval by default), or sooner when the buffer is full, so the
+file can be watched while the run goes on and a run never costs one write per iteration. A run that wants the
+old console output uses the console callback.
+
+    telemetry = Telemetry("run.jsonl", interval = 1.0, run = "image_1")
+    Nested_Sampler(..., telemetry = telemetry).fit()
+    telemetry.close()
+
+"""
+
+import json
+import time
+
+
+def console(record):
+
+    """Prints the iteration and the remaining evidence of a record, as fit used to."""
+
+    print "Iteration: "+str(record["iteration"]) + "  maxZ: "+str(record["remaining"])
+
+
+class Telemetry(object):
+
+    """
+    A rate-limited sink for progress records.
+
+    Attributes
+    ----------
+    path : str
+        Location of the JSON lines file, None to only call the callbacks
+    interval : float
+        Seconds between records, None to not limit by time
+    every : int
+        Iterations between records, None to not limit by iterations
+    callbacks : array
+        Functions called with every record
+    run : str
+        Name of the run added to every record, to tell concurrent runs apart in a shared file
+    flush_interval : float
+        Seconds after which buffered records are written to the file
+
+    """
+
+    def __init__(self, path=None, interval=1.0, every=None, callbacks=None, run=None, buffer_size=65536,
+                 flush_interval=None):
+
+        """
+        Parameters
+        ----------
+        path : str
+            Location of the JSON lines file. Records are appended, so several runs may share a file.
+        interval : float
+            A record is due when this many seconds have passed since the last one
+        every : int
+            A record is due every this many iterations
+        callbacks : array
+            Functions called with every record, see console
+        run : str
+            Name of the run added to every record
+        buffer_size : int
+            Number of characters buffered before they are written to the file
+        flush_interval : float
+            Seconds after which buffered records are written to the file. By default the interval, or one
+            second without an interval
+
+        """
+
+        self.path = path
+        self.interval = interval
+        self.every = every
+        self.callbacks = list(callbacks) if callbacks is not None else []
+        self.run = run
+        self.buffer_size = buffer_size
+        if flush_interval is None:
+            flush_interval = interval if interval is not None else 1.0
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.buffered = 0
+        self.last_flush = time.time()
+        self.last_time = None
+        self.last = None
+
+
+    def due(self, iteration):
+
+        """
+        Returns True if a record should be made in this iteration. The first iteration is always due.
+
+        """
+
+        if self.last_time is None:
+            return True
+        if self.every is not None and iteration % self.every == 0:
+            return True
+        return self.interval is not None and time.time() - self.last_time >= self.interval
+
+
+    def emit(self, record):
+
+        """
+        Passes a record to the callbacks and buffers it for the file.
+
+        Parameters
+        ----------
+        record : dict
+            The record. time, and run if set, are added to it.
+
+        """
+
+        self.last_time = time.time()
+        record["time"] = self.last_time
+        if self.run is not None:
+            record["run"] = self.run
+        self.last = record
+        for callback in self.callbacks:
+            callback(record)
+        if self.path is not None:
+            line = json.dumps(record, sort_keys=True)+"\n"
+            self.buffer.append(line)
+            self.buffered += len(line)
+            if self.buffered >= self.buffer_size or self.last_time - self.last_flush >= self.flush_interval:
+                self.flush()
+
+
+    def flush(self):
+
+        """Appends the buffered records to the file."""
+
+        self.last_flush = time.time()
+        if self.buffer:
+            f = open(self.path, 'a')
+            f.write("".join(self.buffer))
+            f.close()
+            self.buffer = []
+            self.buffered = 0
+
+
+    def close(self):
+
+        """Writes the remaining records."""
+
+        self.flush()
+
+
+def read_records(File):
+
+    """
+    Reads the records of a JSON lines file.
+
+    Returns
+    -------
+    records : array
+        The records in the order they were written
+
+    """
+
+    with open(File) as f:
+        return [json.loads(line) for line in f if line.strip()]
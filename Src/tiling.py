@@ -0,0 +1,332 @@
+"""Tiled source detection for images too large to be sampled as one problem.
+
+The image is cut into tiles of TILE_SIZE pixels, each grown on every side by an overlap of 3*R_PRIOR_UPPER
+pixels so that a source centred inside a tile is completely contained in it. Every tile is an independent
+DetectionProblem with X/Y priors covering the tile only, and is sampled by its own Nested_Sampler, so
+the likelihood only evaluates the pixels of the tile. Tiles are run on a process pool. FITS and .npy
+images are memory-mapped by every worker, which then share the pages of the file in the page cache.
+Images which cannot be mapped (pickles, compressed FITS) are read once into a shared memory block which
+every worker attaches to by name, instead of each worker reading the image or receiving it through a pipe.
+A weight map and a mask are shared and cut into tiles the same way.
+
+The posterior samples of a tile are reduced to a catalog by catalog.extract_catalog, clustering the
+samples which fit better than an empty tile, and the catalogs are merged with a KD-tree: of two detections from different tiles closer
+than the merge radius, the one further from the border of its tile is kept.
+
+"""
+
+import random
+import numpy as np
+from math import ceil
+from multiprocessing import Pool, cpu_count
+from images import read_image, can_memmap
+from shared import SharedArrays
+from background import background_problem
+import catalog as catalogs
+import sources
+
+
+#Columns of the catalogs returned by tile_catalog and merge_catalogs: those of catalog.extract_catalog
+#followed by the tile of the detection
+CATALOG_COLUMNS = catalogs.CATALOG_COLUMNS + ['tile']
+
+
+def make_tiles(height, width, tile_size, overlap):
+
+    """
+    Cuts an image into overlapping tiles.
+
+    Parameters
+    ----------
+    height : int
+        Height of the image
+    width : int
+        Width of the image
+    tile_size : int
+        Side of the tiles before the overlap is added
+    overlap : int
+        Number of pixels added on every side of a tile, clipped at the image border
+
+    Returns
+    -------
+    tiles : array
+        A list of (x_l, x_u, y_l, y_u, core) in pixels, where core is the (x_l, x_u, y_l, y_u) part of
+        the image the tile is responsible for
+
+    """
+
+    tiles = []
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            core = (x, min(x + tile_size, width), y, min(y + tile_size, height))
+            tiles.append((max(core[0] - overlap, 0), min(core[1] + overlap, width),
+                          max(core[2] - overlap, 0), min(core[3] + overlap, height), core))
+    return tiles
+
+
+def tile_catalog(problem, samples, threshold=0.0, eps=3, minPts=10):
+
+    """
+    Reduces the posterior samples of a tile to a catalog of detections.
+
+    Only the samples whose log likelihood exceeds the log likelihood of the empty tile by more than threshold
+    are clustered by catalog.extract_catalog.
+
+    Parameters
+    ----------
+    problem : object
+        The DetectionProblem of the tile
+    samples : array
+        Posterior samples of the tile
+    threshold : float
+        Minimum log likelihood ratio against the empty tile
+    eps : float
+        Side of the clustering cells in pixels
+    minPts : int
+        Minimum number of samples around a core cell
+
+    Returns
+    -------
+    catalog : array
+        Array with the columns of CATALOG_COLUMNS in the coordinates of the tile. The tile column is -1.
+
+    """
+
+    null = problem.null_log_likelihood()
+    catalog = catalogs.extract_catalog(sources.sample_array(samples), eps, minPts, min_logL = null + threshold)
+    return np.column_stack((catalog, -np.ones(len(catalog))))
+
+
+def run_tile(job):
+
+    """
+    Runs the nested sampler on one tile. This is the function mapped over the process pool, so job only
+    holds picklable values.
+
+    Parameters
+    ----------
+    job : dict
+        index - Number of the tile
+        tile - (x_l, x_u, y_l, y_u, core) as returned by make_tiles
+        mapped - Locations of the image, weight map and mask which are memory-mapped, by name
+        shared - Name of the shared memory block holding the others, None if every one is mapped
+        noise - RMS noise of the image
+        prior - Amplitude and R prior bounds [[A_l, A_u], [R_l, R_u]]
+        settings - Nested_Sampler keyword arguments, as returned by sources.sampler_settings
+        surrogate - Maximum false reject rate of the surrogate, None to disable it
+        seed - Seed of the random number generators
+        variance - The weight map holds variances instead of inverse variances
+
+    Returns
+    -------
+    catalog : array
+        Detections of the tile in image coordinates
+    stats : dict
+        logZ, likelihood_calculations and iterations of the tile
+
+    """
+
+    x_l, x_u, y_l, y_u, core = job["tile"]
+    random.seed(job["seed"])
+    np.random.seed(job["seed"])
+
+    #Only the tile is copied out of the shared image, so that the likelihood works on a contiguous block
+    block = SharedArrays.attach(job["shared"]) if job["shared"] is not None else None
+    arrays = {}
+    for key in ["image", "weight", "mask"]:
+        if key in job["mapped"]:
+            arrays[key] = np.array(read_image(job["mapped"][key])[y_l:y_u, x_l:x_u])
+        elif block is not None and key in block.keys():
+            arrays[key] = np.array(block[key][y_l:y_u, x_l:x_u])
+    if block is not None:
+        block.close()
+    data = np.asarray(arrays["image"], dtype=float)
+    weight = np.asarray(arrays["weight"], dtype=float) if "weight" in arrays else None
+    mask = arrays.get("mask")
+    prior = [[0.0, float(x_u - x_l)], [0.0, float(y_u - y_l)]] + [list(i) for i in job["prior"]]
+    problem = sources.DetectionProblem(data = data, noise = job["noise"], prior = prior, weight = weight, mask = mask,
+                                       variance = job["variance"])
+    if job["surrogate"] is not None:
+        problem.surrogate = sources.Surrogate(problem, max_false_reject = job["surrogate"])
+
+    out = sources.Nested_Sampler(problem = problem, **job["settings"]).fit()
+    catalog = tile_catalog(problem, out["samples"])
+    catalog[:,0] += x_l
+    catalog[:,1] += y_l
+    catalog[:,-1] = job["index"]
+    stats = {"logZ":out["logZ"], "likelihood_calculations":out["likelihood_calculations"],
+             "iterations":out["iterations"]}
+    return catalog, stats
+
+
+def edge_distance(catalog, tiles):
+
+    """
+    Returns the distance of every detection to the nearest border of its tile which is not a border of the
+    image. Detections close to such a border are the ones whose source may be cut by the tile.
+
+    Parameters
+    ----------
+    catalog : array
+        Detections in image coordinates with their tile in the tile column
+    tiles : array
+        Tiles as returned by make_tiles
+
+    Returns
+    -------
+    distance : array
+        Distance in pixels, inf for tiles which cover the whole image
+
+    """
+
+    x_max = max(i[1] for i in tiles)
+    y_max = max(i[3] for i in tiles)
+    distance = np.empty(len(catalog))
+    for k, row in enumerate(catalog):
+        x_l, x_u, y_l, y_u, core = tiles[int(row[-1])]
+        borders = [np.inf]
+        if x_l > 0: borders.append(row[0] - x_l)
+        if x_u < x_max: borders.append(x_u - row[0])
+        if y_l > 0: borders.append(row[1] - y_l)
+        if y_u < y_max: borders.append(y_u - row[1])
+        distance[k] = min(borders)
+    return distance
+
+
+def merge_catalogs(catalogs, tiles, radius):
+
+    """
+    Merges the catalogs of the tiles, dropping the duplicates detected in the overlap of neighbouring tiles.
+
+    Detections are visited from the one furthest from the border of its tile inwards. A detection which is
+    kept drops every detection of another tile within radius, so of two duplicates the one seen better
+    is kept.
+
+    Parameters
+    ----------
+    catalogs : array
+        Catalogs of the tiles in image coordinates
+    tiles : array
+        Tiles as returned by make_tiles
+    radius : float
+        Distance in pixels below which detections of different tiles are the same source
+
+    Returns
+    -------
+    catalog : array
+        The merged catalog with the columns of CATALOG_COLUMNS
+
+    """
+
+    catalogs = [i for i in catalogs if len(i) > 0]
+    if len(catalogs) == 0:
+        return np.empty((0, len(CATALOG_COLUMNS)))
+    catalog = np.vstack(catalogs)
+
+    from scipy.spatial import cKDTree
+    tree = cKDTree(catalog[:,0:2])
+    dropped = np.zeros(len(catalog), dtype=bool)
+    for k in np.argsort(-edge_distance(catalog, tiles), kind='mergesort'):
+        if dropped[k]:
+            continue
+        for j in tree.query_ball_point(catalog[k,0:2], radius):
+            if catalog[j,-1] != catalog[k,-1]:
+                dropped[j] = True
+    return catalog[~dropped]
+
+
+def run_tiled(image_path, noise, prior, settings, tile_size=512, processes=None, surrogate=None, seed=0,
+              weight_path=None, mask_path=None, variance=False):
+
+    """
+    Runs the source detection on overlapping tiles of an image and merges their catalogs.
+
+    Parameters
+    ----------
+    image_path : str
+        Location of the image
+    noise : float
+        RMS noise of the image
+    prior : array
+        Amplitude and R prior bounds [[A_l, A_u], [R_l, R_u]]. The overlap of the tiles and the merge
+        radius are 3*R_u
+    settings : dict
+        Nested_Sampler keyword arguments, as returned by sources.sampler_settings
+    tile_size : int
+        Side of the tiles before the overlap is added
+    processes : int
+        Number of worker processes. None uses every cpu and 1 runs the tiles in this process.
+    surrogate : float
+        Maximum false reject rate of the surrogate, None to disable it
+    seed : int
+        Seed of the first tile, the other tiles use the following seeds
+    weight_path : str
+        Location of the inverse variance (or variance) map of the image, None for a uniform noise
+    mask_path : str
+        Location of the mask of the image, nonzero for the pixels to ignore. None to keep every pixel.
+    variance : bool
+        The weight map holds variances instead of inverse variances
+
+    Returns
+    -------
+    catalog : array
+        The merged catalog with the columns of CATALOG_COLUMNS
+    stats : array
+        logZ, likelihood_calculations and iterations of every tile
+
+    """
+
+    paths = {"image":image_path, "weight":weight_path, "mask":mask_path}
+    mapped = dict((key, path) for key, path in paths.items() if path is not None and can_memmap(path))
+    arrays = dict((key, read_image(path)) for key, path in paths.items() if path is not None and key not in mapped)
+    block = SharedArrays.create(arrays) if arrays else None
+    height, width = (read_image(image_path) if "image" in mapped else block["image"]).shape
+    overlap = int(ceil(3*prior[1][1]))
+    tiles = make_tiles(height, width, tile_size, overlap)
+    jobs = [{"index":k, "tile":tile, "mapped":mapped, "shared":None if block is None else block.name,
+             "noise":noise, "prior":prior,
+             "settings":settings, "surrogate":surrogate, "seed":seed + k, "variance":variance}
+            for k, tile in enumerate(tiles)]
+
+    try:
+        if processes == 1:
+            results = map(run_tile, jobs)
+        else:
+            pool = Pool(processes or cpu_count())
+            results = pool.map(run_tile, jobs, chunksize=1)
+            pool.close()
+            pool.join()
+    finally:
+        if block is not None:
+            block.close()
+
+    catalog = merge_catalogs([i[0] for i in results], tiles, 3*prior[1][1])
+    return catalog, [i[1] for i in results]
+
+
+if __name__ == '__main__':
+
+    import os
+    from astropy.io import ascii
+
+    Config = sources.Config
+    prior = [[float(Config['A_PRIOR_LOWER']), float(Config['A_PRIOR_UPPER'])],
+             [float(Config['R_PRIOR_LOWER']), float(Config['R_PRIOR_UPPER'])]]
+    surrogate = float(Config['SURROGATE_MAX_FALSE_REJECT']) if int(Config['SURROGATE']) == 1 else None
+
+    problem = sources.problem_from_config(Config)
+    if int(Config['BACKGROUND']) == 1:
+        problem = background_problem(problem, os.path.splitext(str(Config['OUTPUT_DATA_PATH']))[0],
+                                     mesh = int(Config['BACKGROUND_MESH']), nsigma = float(Config['BACKGROUND_NSIGMA']))
+    catalog, stats = run_tiled(problem.image_path, problem.noise, prior,
+                               sources.sampler_settings(Config), tile_size = int(Config['TILE_SIZE']),
+                               processes = int(Config['TILE_WORKERS']) or None, surrogate = surrogate,
+                               weight_path = problem.weight_path, mask_path = problem.mask_path,
+                               variance = problem.variance)
+
+    print "Tiles: "+str(len(stats))
+    print "Likelihood calculations: "+str(sum(i["likelihood_calculations"] for i in stats))
+    print "Detections: "+str(len(catalog))
+
+    output_loc = os.path.splitext(str(Config['OUTPUT_DATA_PATH']))[0]+'_catalog.dat'
+    ascii.write([catalog[:,k] for k in range(len(CATALOG_COLUMNS))], output_loc, names=CATALOG_COLUMNS, format='basic')
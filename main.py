@@ -13,12 +13,12 @@ SrcArray = [[43.71, 22.91, 10.54, 3.34],
 #prior_array = [[0.0,100.0],[0.0,100.0],[1.0,12.5],[2.0,9.0]]
 
 # When making a fake image with new prior limits. Don't forget update the prior values in config.cfg before running. 
-data_map = plot.make_source(SrcArray, 200, 200)
+data_map = plot.make_source(SrcArray, 200, 200, show = False)
 noise = 2.0
-data_map = plot.add_gaussian_noise(mean=0,sd=noise,data=data_map)
+data_map = plot.add_gaussian_noise(mean=0,sd=noise,data=data_map, show = False)
 plot.write(data_map, "assets/simulated_images/multinest_toy_noised")
 
-#Import sources should be here because we are loading the simulated image globally inside it
+#The image written above is read lazily from IMAGE_PATH in config.cfg when the detection starts
 from Src import sources
 #[X,Y,A,R]
 prior_array = [[0.0,200.0],[0.0,200.0],[1.0,12.5],[2.0,9.0]]